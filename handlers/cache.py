@@ -0,0 +1,99 @@
+import copy
+import functools
+import time
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+from loguru import logger
+
+# Маркер отсутствия значения: None и False - допустимые закешированные результаты
+_MISSING = object()
+
+
+class TTLCache:
+    """Кеш в памяти процесса с ограниченным временем жизни записей"""
+
+    def __init__(self, default_ttl: float = 60.0):
+        self.default_ttl = default_ttl
+        self._data: Dict[Tuple, Tuple[float, Any]] = {}
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, key: Tuple) -> Any:
+        """Получение значения по ключу или _MISSING, если записи нет или она устарела"""
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return _MISSING
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._data[key]
+            self.misses += 1
+            return _MISSING
+        self.hits += 1
+        # Копия защищает кеш от изменения возвращенных словарей вызывающим кодом
+        return copy.deepcopy(value)
+
+    def set(self, key: Tuple, value: Any, ttl: Optional[float] = None):
+        """Сохранение значения на ttl секунд"""
+        ttl = self.default_ttl if ttl is None else ttl
+        self._data[key] = (time.monotonic() + ttl, copy.deepcopy(value))
+
+    def invalidate(self, *namespaces: Hashable):
+        """Удаление записей указанных пространств имен (всех, если они не заданы)"""
+        if not namespaces:
+            self._data.clear()
+        else:
+            for key in [key for key in self._data if key[0] in namespaces]:
+                del self._data[key]
+        self.invalidations += 1
+        logger.debug(f"Кеш настроек сброшен: {', '.join(map(str, namespaces)) or 'все записи'}")
+
+    def stats(self) -> Dict:
+        """Счетчики попаданий и промахов кеша"""
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / total, 4) if total else 0.0,
+            'entries': len(self._data),
+            'invalidations': self.invalidations
+        }
+
+
+def cached(namespace: str, ttl: Optional[float] = None, error: Optional[str] = None, fallback: Any = None):
+    """Кеширование результата асинхронного метода в self.cache по аргументам вызова"""
+    def decorator(method):
+        @functools.wraps(method)
+        async def wrapper(self, *args, **kwargs):
+            key = (namespace, args, tuple(sorted(kwargs.items())))
+            value = self.cache.get(key)
+            if value is not _MISSING:
+                return value
+            try:
+                value = await method(self, *args, **kwargs)
+            except Exception as e:
+                if error is None:
+                    raise
+                # Запасное значение не кешируется: временная ошибка базы не должна
+                # отдаваться как "нет тарифов" или "оплата выключена" до конца TTL
+                logger.error(f"{error.format(*args)}: {e}")
+                return copy.deepcopy(fallback)
+            self.cache.set(key, value, ttl)
+            return value
+        return wrapper
+    return decorator
+
+
+def invalidates(*namespaces: str):
+    """Сброс пространств имен кеша после выполнения изменяющего метода"""
+    def decorator(method):
+        @functools.wraps(method)
+        async def wrapper(self, *args, **kwargs):
+            try:
+                return await method(self, *args, **kwargs)
+            finally:
+                # Сброс и при ошибке: запись могла частично примениться до исключения
+                self.cache.invalidate(*namespaces)
+        return wrapper
+    return decorator
@@ -1,10 +1,20 @@
 import os
 import aiosqlite
 from datetime import datetime, timezone, timedelta
-from typing import Optional, Dict, List
+from typing import Optional, Dict, List, Tuple
 from loguru import logger
 from aiogram import Bot
 from handlers.admin.admin_kb import get_admin_keyboard
+from handlers.db_pool import ConnectionPool, WriteQueue
+from handlers.cache import TTLCache, cached, invalidates
+from handlers.migrations import migrate
+from handlers.ledger import BalanceReconciler, apply_balance_change, apply_referral_rewards
+from handlers.records import ServerRecord, TariffRecord, TransactionRecord, UserRecord
+from handlers.placement import inbound_fill_levels
+from handlers.traffic import TrafficCollector
+from handlers.panel_reconciler import PanelReconciler
+from handlers.evacuation import ServerEvacuation
+from handlers.x_ui_ss import xui_ss_manager
 import random
 import string
 import asyncio
@@ -12,9 +22,74 @@ import asyncio
 os.makedirs('instance', exist_ok=True)
 os.makedirs('handlers', exist_ok=True)
 
+REFERRAL_ALPHABET = string.ascii_uppercase + string.digits
+REFERRAL_CODE_LENGTH = 8
+# Попытки регистрации при совпадении случайного кода с уже выданным
+REFERRAL_CODE_ATTEMPTS = 5
+
+
+def random_referral_code() -> str:
+    """Случайный реферальный код"""
+    return ''.join(random.SystemRandom().choices(REFERRAL_ALPHABET, k=REFERRAL_CODE_LENGTH))
+
+
 class Database:
-    def __init__(self, db_path: str = 'instance/database.db'):
+    def __init__(self, db_path: str = 'instance/database.db', readers: int = 3):
         self.db_path = db_path
+        self.pool = ConnectionPool(db_path, readers=readers)
+        self.write_queue = WriteQueue(self.pool)
+        self.cache = TTLCache(default_ttl=60.0)
+        self._background_tasks = set()
+        self.balance_reconciler = BalanceReconciler(self.pool)
+        self.traffic_collector = TrafficCollector(self.pool, self._write)
+        self.panel_reconciler = PanelReconciler(self.pool, self._write)
+        self.evacuation = ServerEvacuation(self.pool, self._write)
+
+    async def _write(self, operation):
+        """Выполнение изменяющей операции через общую очередь записей"""
+        return await self.write_queue.submit(operation)
+
+    def invalidate_cache(self, *namespaces: str):
+        """Сброс кеша настроек после изменения таблиц в обход методов Database"""
+        self.cache.invalidate(*namespaces)
+
+    def invalidate_server_settings(self):
+        """Сброс кеша серверов после их изменения администратором (в том числе данных входа в панель)"""
+        # Тарифы и пробный период выбираются вместе с именем и состоянием сервера
+        self.cache.invalidate('server_settings', 'active_tariffs', 'trial_settings')
+
+    def invalidate_tariffs(self):
+        """Сброс кеша активных тарифов после их изменения"""
+        self.cache.invalidate('active_tariffs')
+
+    def invalidate_trial_settings(self):
+        """Сброс кеша настроек пробного периода после их изменения"""
+        self.cache.invalidate('trial_settings')
+
+    def invalidate_bot_messages(self):
+        """Сброс кеша сообщений бота после их изменения"""
+        self.cache.invalidate('bot_message')
+
+    def invalidate_crypto_settings(self):
+        """Сброс кеша состояния Crypto Pay после изменения его настроек"""
+        self.cache.invalidate('crypto_enabled')
+
+    def cache_stats(self) -> Dict:
+        """Статистика попаданий в кеш настроек"""
+        return self.cache.stats()
+
+    async def close(self):
+        """Закрытие очереди записей и пула соединений при остановке бота"""
+        if self._background_tasks:
+            await asyncio.gather(*self._background_tasks, return_exceptions=True)
+        await self.balance_reconciler.close()
+        await self.traffic_collector.close()
+        await self.panel_reconciler.close()
+        await self.evacuation.close()
+        # Сессии aiohttp панелей Shadowsocks, открытые сбором трафика и обработчиками бота
+        await xui_ss_manager.close()
+        await self.write_queue.close()
+        await self.pool.close()
 
     async def db_operation_with_retry(self, operation_func, max_attempts=5):
         """Выполнение операции с базой данных с повторными попытками при блокировке"""
@@ -36,287 +111,23 @@ class Database:
     async def init_db(self):
         """Инициализация базы данных"""
         async def _init_db_operation():
-            async with aiosqlite.connect(self.db_path, timeout=20.0) as conn:
-                await conn.execute('''
-                    CREATE TABLE IF NOT EXISTS bot_settings (
-                        bot_token TEXT NOT NULL,
-                        admin_id TEXT NOT NULL,
-                        chat_id TEXT,
-                        chanel_id TEXT,
-                        is_enable BOOLEAN NOT NULL DEFAULT 1
-                    )
-                ''')
-                
-                await conn.execute('''
-                    CREATE TABLE IF NOT EXISTS server_settings (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        name TEXT NOT NULL,
-                        ip TEXT,
-                        url TEXT NOT NULL,
-                        port TEXT NOT NULL,
-                        secret_path TEXT NOT NULL,
-                        username TEXT NOT NULL,
-                        password TEXT NOT NULL,
-                        secretkey TEXT,
-                        inbound_id INTEGER,
-                        protocol TEXT DEFAULT 'vless',
-                        is_enable BOOLEAN NOT NULL DEFAULT 1
-                    )
-                ''')
-                
-                await conn.execute('''
-                    CREATE TABLE IF NOT EXISTS bot_message (
-                        command TEXT PRIMARY KEY,
-                        text TEXT NOT NULL,
-                        image_path TEXT,
-                        is_enable BOOLEAN NOT NULL DEFAULT 1
-                    )
-                ''')
-
-                await conn.execute('''
-                    CREATE TABLE IF NOT EXISTS user (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        username TEXT,
-                        telegram_id INTEGER UNIQUE NOT NULL,
-                        trial_period BOOLEAN DEFAULT 0,
-                        is_enable BOOLEAN NOT NULL DEFAULT 1,
-                        date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        referral_code TEXT UNIQUE,
-                        referral_count INTEGER DEFAULT 0,
-                        referred_by TEXT,
-                        name_account TEXT
-                    )
-                ''')
-
-                await conn.execute('''
-                    CREATE TABLE IF NOT EXISTS tariff (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        name TEXT NOT NULL,
-                        description TEXT,
-                        price DECIMAL(10,2) NOT NULL,
-                        left_day INTEGER NOT NULL,
-                        server_id INTEGER NOT NULL,
-                        is_enable BOOLEAN NOT NULL DEFAULT 1,
-                        FOREIGN KEY (server_id) REFERENCES server_settings(id)
-                    )
-                ''')
-
-                await conn.execute('''
-                    CREATE TABLE IF NOT EXISTS trial_settings (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        name TEXT NOT NULL,
-                        left_day INTEGER NOT NULL,
-                        server_id INTEGER NOT NULL,
-                        is_enable BOOLEAN NOT NULL DEFAULT 1,
-                        FOREIGN KEY (server_id) REFERENCES server_settings(id)
-                    )
-                ''')
-
-                await conn.execute('''
-                    CREATE TABLE IF NOT EXISTS user_subscription (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        user_id INTEGER NOT NULL,
-                        tariff_id INTEGER NOT NULL,
-                        server_id INTEGER NOT NULL,
-                        start_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        end_date TIMESTAMP NOT NULL,
-                        vless TEXT,
-                        is_active BOOLEAN NOT NULL DEFAULT 1,
-                        FOREIGN KEY (user_id) REFERENCES user(id),
-                        FOREIGN KEY (tariff_id) REFERENCES tariff(id),
-                        FOREIGN KEY (server_id) REFERENCES server_settings(id)
-                    )
-                ''')
-
-                await conn.execute('''
-                    CREATE TABLE IF NOT EXISTS yookassa_settings (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        name TEXT,
-                        shop_id TEXT NOT NULL,
-                        api_key TEXT NOT NULL,
-                        description TEXT,
-                        is_enable INTEGER DEFAULT 0
-                    )
-                ''')
-
-                await conn.execute('''
-                    CREATE TABLE IF NOT EXISTS promocodes (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        promocod TEXT NOT NULL,
-                        activation_limit INTEGER DEFAULT 1,
-                        activation_total INTEGER DEFAULT 0,
-                        percentage DECIMAL(5,2) NOT NULL,
-                        is_enable BOOLEAN NOT NULL DEFAULT 1,
-                        date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                    )
-                ''')
-
-                await conn.execute("""
-                    CREATE TABLE IF NOT EXISTS payments (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        user_id INTEGER NOT NULL,
-                        tariff_id INTEGER NOT NULL,
-                        price REAL NOT NULL,
-                        date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        FOREIGN KEY (user_id) REFERENCES user (id),
-                        FOREIGN KEY (tariff_id) REFERENCES tariff (id)
-                    )
-                """)
-                
-                await conn.execute('''
-                    CREATE TABLE IF NOT EXISTS support_info (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        message TEXT NOT NULL,
-                        bot_version TEXT NOT NULL,
-                        support_url TEXT NOT NULL
-                    )
-                ''')
-                
-                await conn.execute('''
-                    CREATE TABLE IF NOT EXISTS notify_settings (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        name TEXT NOT NULL,
-                        interval INTEGER NOT NULL,
-                        type TEXT NOT NULL,
-                        is_enable BOOLEAN NOT NULL DEFAULT 1
-                    )
-                ''')
-                
-                await conn.execute('''
-                    CREATE TABLE IF NOT EXISTS payments_code (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        pay_code TEXT UNIQUE NOT NULL,
-                        sum DECIMAL(10,2) NOT NULL,
-                        is_enable BOOLEAN NOT NULL DEFAULT 1,
-                        create_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                    )
-                ''')
-                
-                await conn.execute('''
-                    CREATE TABLE IF NOT EXISTS crypto_settings (
-                        api_token TEXT NOT NULL,
-                        is_enable BOOLEAN DEFAULT 0,
-                        min_amount DECIMAL(10,2) DEFAULT 1.00,
-                        supported_assets TEXT,  -- JSON строка с поддерживаемыми криптовалютами
-                        webhook_url TEXT,
-                        webhook_secret TEXT
-                    )
-                ''')
-                
-                await conn.execute('''
-                    CREATE TABLE IF NOT EXISTS raffles (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        name TEXT NOT NULL,
-                        description TEXT,
-                        start_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        end_date TIMESTAMP,
-                        status TEXT DEFAULT 'active',
-                        winner_ticket_id INTEGER,
-                        FOREIGN KEY (winner_ticket_id) REFERENCES raffle_tickets(id)
-                    )
-                ''')
-
-                await conn.execute('''
-                    CREATE TABLE IF NOT EXISTS raffle_tickets (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        user_id INTEGER NOT NULL,
-                        telegram_id INTEGER NOT NULL,
-                        ticket_number TEXT UNIQUE NOT NULL,
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        raffle_id INTEGER,
-                        FOREIGN KEY (user_id) REFERENCES user(id),
-                        FOREIGN KEY (raffle_id) REFERENCES raffles(id),
-                        FOREIGN KEY (telegram_id) REFERENCES user(telegram_id)
-                    )
-                ''')
-
-                await conn.execute('''
-                    CREATE TABLE IF NOT EXISTS user_balance (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        user_id INTEGER NOT NULL,
-                        balance DECIMAL(10,2) DEFAULT 0.00,
-                        last_update TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        FOREIGN KEY (user_id) REFERENCES user(telegram_id)
-                    )
-                ''')
-
-                await conn.execute('''
-                    CREATE TABLE IF NOT EXISTS balance_transactions (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        user_id INTEGER NOT NULL,
-                        amount DECIMAL(10,2) NOT NULL,
-                        type TEXT NOT NULL,
-                        description TEXT,
-                        payment_id TEXT,
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        FOREIGN KEY (user_id) REFERENCES user(telegram_id)
-                    )
-                ''')
-
-                await conn.execute("""
-                    CREATE TABLE IF NOT EXISTS referral_condition (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        name TEXT NOT NULL,
-                        description TEXT,
-                        invitations INTEGER NOT NULL,
-                        reward_sum DECIMAL(10,2) NOT NULL,
-                        is_enable BOOLEAN NOT NULL DEFAULT 1,
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                    )
-                """)
-                await conn.commit()
-
-                await conn.execute("""
-                    CREATE TABLE IF NOT EXISTS referral_progress (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        user_id INTEGER NOT NULL,
-                        total_invites INTEGER DEFAULT 0,
-                        last_reward_at TIMESTAMP,
-                        FOREIGN KEY (user_id) REFERENCES user(telegram_id)
-                    )
-                """)
-                await conn.commit()
-
-                await conn.execute("""
-                    CREATE INDEX IF NOT EXISTS idx_referral_progress_user_id 
-                    ON referral_progress(user_id)
-                """)
-                await conn.commit()
-                logger.info("Индексы для таблиц рефералов успешно созданы")
-
-                async with conn.execute("SELECT COUNT(*) FROM referral_condition") as cursor:
-                    count = await cursor.fetchone()
-                    if count[0] == 0:
-                        await conn.execute("""
-                            INSERT INTO referral_condition (name, description, invitations, reward_sum)
-                            VALUES 
-                            ('Начальный уровень', 'Пригласите 5 друзей и получите награду', 5, 50.00),
-                            ('Продвинутый уровень', 'Пригласите 10 друзей и получите награду', 10, 150.00),
-                            ('Профессионал', 'Пригласите 25 друзей и получите награду', 25, 500.00)
-                        """)
-                        await conn.commit()
-
-                await conn.execute("""
-                    CREATE TABLE IF NOT EXISTS referral_rewards_history (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        user_id INTEGER NOT NULL,
-                        condition_id INTEGER NOT NULL,
-                        reward_sum DECIMAL(10,2) NOT NULL,
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        FOREIGN KEY (user_id) REFERENCES user(telegram_id),
-                        FOREIGN KEY (condition_id) REFERENCES referral_condition(id)
-                    )
-                """)
-                await conn.commit()
-
-                await conn.commit()
-                logger.info("База данных инициализирована")
+            # Миграции выполняются синхронным sqlite3 в отдельном потоке,
+            # при актуальной схеме это одно чтение PRAGMA user_version
+            version = await asyncio.to_thread(migrate, self.db_path)
+            logger.info(f"База данных инициализирована, версия схемы: {version}")
+            return version
         
-        return await self.db_operation_with_retry(_init_db_operation)
-
+        result = await self.db_operation_with_retry(_init_db_operation)
+        self.pool.start_checkpoint_task()
+        self.balance_reconciler.start()
+        self.traffic_collector.start()
+        self.panel_reconciler.start()
+        return result
+
+    @cached('bot_settings')
     async def get_bot_settings(self) -> Optional[Dict]:
         """Получение настроек бота из базы данных"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.pool.reader() as db:
             async with db.execute('SELECT * FROM bot_settings LIMIT 1') as cursor:
                 settings = await cursor.fetchone()
                 if settings:
@@ -329,9 +140,10 @@ class Database:
                     }
                 return None
 
+    @cached('bot_message', ttl=300.0)
     async def get_bot_message(self, command: str) -> Optional[Dict]:
         """Получение сообщения бота по команде"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.pool.reader() as db:
             async with db.execute(
                 'SELECT * FROM bot_message WHERE command = ? AND is_enable = 1', 
                 (command,)
@@ -348,8 +160,7 @@ class Database:
 
     async def get_all_servers(self) -> List[Dict]:
         """Получение списка всех серверов"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
+        async with self.pool.reader() as db:
             async with db.execute('SELECT * FROM server_settings') as cursor:
                 servers = await cursor.fetchall()
                 return [dict(server) for server in servers]
@@ -357,125 +168,127 @@ class Database:
     async def register_user(self, telegram_id: int, username: str = None, bot = None, full_name: str = None) -> bool:
         """Регистрация нового пользователя"""
         try:
-            current_date = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            
-            # Отладочный вывод
-            logger.info(f"register_user: telegram_id={telegram_id}, username={username}, full_name={full_name}")
-            
-            async with aiosqlite.connect(self.db_path) as db:
-                async with db.execute(
-                    'SELECT id FROM user WHERE telegram_id = ?',
-                    (telegram_id,)
-                ) as cursor:
-                    user = await cursor.fetchone()
-                    if user:
-                        # Пользователь уже существует, обновляем его данные
-                        if full_name:
-                            await db.execute(
-                                'UPDATE user SET username = ?, name_account = ? WHERE telegram_id = ?',
-                                (username, full_name, telegram_id)
-                            )
-                            await db.commit()
-                            logger.info(f"Обновлены данные пользователя: {telegram_id}, name_account={full_name}")
-                        return True
-                
-                while True:
-                    referral_code = ''.join(random.choices(string.ascii_uppercase + string.digits, k=8))
-                    
-                    async with db.execute(
-                        'SELECT id FROM user WHERE referral_code = ?',
-                        (referral_code,)
-                    ) as cursor:
-                        if not await cursor.fetchone():
-                            break
-                
-                await db.execute(
-                    'INSERT INTO user (telegram_id, username, referral_code, name_account) VALUES (?, ?, ?, ?)',
-                    (telegram_id, username, referral_code, full_name)
-                )
-                await db.commit()
-
-                await db.execute("""
-                    INSERT INTO referral_progress (user_id, total_invites)
-                    VALUES (?, 0)
-                """, (telegram_id,))
-                await db.commit()
-                
-                async with db.execute(
-                    'SELECT reg_notify FROM bot_settings LIMIT 1'
-                ) as cursor:
-                    notify_settings = await cursor.fetchone()
-                
-                if notify_settings and notify_settings[0] != 0 and bot:
-                    message_text = (
-                        "🔔 <b>Новая регистрация!</b>\n\n"
-                        "🚀 Пользователь успешно зарегистрирован!\n"
-                        f"🟢 ID: <code>{telegram_id}</code> (@{username or 'Не указан'})\n"
-                        "<blockquote>"
-                        f"📌 ID: {telegram_id}\n"
-                        f"👤 Username: @{username or 'Не указан'}\n"
-                        f"📝 Имя: {full_name or 'Не указано'}\n"
-                        f"⏳ Дата: {current_date}\n"
-                        "</blockquote>"
+            async def _operation(db, referral_code):
+                # Новый пользователь и его прогресс рефералов фиксируются одной единицей;
+                # для существующего вставка ничего не делает и RETURNING пуст
+                async with db.execute("""
+                    INSERT INTO user (telegram_id, username, referral_code, name_account)
+                    VALUES (?, ?, ?, ?)
+                    ON CONFLICT(telegram_id) DO NOTHING
+                    RETURNING id
+                """, (telegram_id, username, referral_code, full_name)) as cursor:
+                    created = await cursor.fetchone() is not None
+
+                if created:
+                    await db.execute("""
+                        INSERT INTO referral_progress (user_id, total_invites)
+                        VALUES (?, 0)
+                    """, (telegram_id,))
+                elif full_name:
+                    # Пользователь уже существует, обновляем его данные
+                    await db.execute(
+                        'UPDATE user SET username = ?, name_account = ? WHERE telegram_id = ?',
+                        (username, full_name, telegram_id)
                     )
-                    
-                    try:
-                        await bot.send_message(
-                            chat_id=notify_settings[0],
-                            text=message_text,
-                            parse_mode="HTML",
-                            reply_markup=get_admin_keyboard()
-                        )
-                    except Exception as e:
-                        logger.error(f"Ошибка при отправке уведомления о регистрации: {e}")
-            
+                    logger.info(f"Обновлены данные пользователя: {telegram_id}, name_account={full_name}")
+                return created
+
+            for attempt in range(1, REFERRAL_CODE_ATTEMPTS + 1):
+                try:
+                    created = await self._write(lambda db: _operation(db, random_referral_code()))
+                    break
+                except aiosqlite.IntegrityError:
+                    # Совпадение по UNIQUE(referral_code): повтор с новым кодом
+                    if attempt == REFERRAL_CODE_ATTEMPTS:
+                        raise
+                    logger.warning(f"Реферальный код занят, повторная попытка {attempt} для {telegram_id}")
+
+            if not created:
+                return True
+
             logger.info(f"Зарегистрирован новый пользователь: {telegram_id}")
+            if bot:
+                # Уведомление не задерживает ответ пользователю на /start
+                self._spawn(self._notify_registration(bot, telegram_id, username, full_name))
             return True
             
         except Exception as e:
             logger.error(f"Ошибка при регистрации пользователя {telegram_id}: {e}")
             return False
 
+    def _spawn(self, coro):
+        """Запуск фоновой задачи с сохранением ссылки до ее завершения"""
+        task = asyncio.get_running_loop().create_task(coro)
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+        return task
+
+    async def _notify_registration(self, bot, telegram_id: int, username: str = None, full_name: str = None):
+        """Отправка администратору уведомления о новой регистрации"""
+        notify_settings = await self.get_notify_settings()
+        chat_id = notify_settings.get('reg_notify') if notify_settings else None
+        if not chat_id:
+            return
+
+        current_date = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        message_text = (
+            "🔔 <b>Новая регистрация!</b>\n\n"
+            "🚀 Пользователь успешно зарегистрирован!\n"
+            f"🟢 ID: <code>{telegram_id}</code> (@{username or 'Не указан'})\n"
+            "<blockquote>"
+            f"📌 ID: {telegram_id}\n"
+            f"👤 Username: @{username or 'Не указан'}\n"
+            f"📝 Имя: {full_name or 'Не указано'}\n"
+            f"⏳ Дата: {current_date}\n"
+            "</blockquote>"
+        )
+        
+        try:
+            await bot.send_message(
+                chat_id=chat_id,
+                text=message_text,
+                parse_mode="HTML",
+                reply_markup=get_admin_keyboard()
+            )
+        except Exception as e:
+            logger.error(f"Ошибка при отправке уведомления о регистрации: {e}")
+
     async def get_user(self, telegram_id: int) -> Optional[Dict]:
         """Получение информации о пользователе"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
+        async with self.pool.reader() as db:
             async with db.execute(
                 'SELECT * FROM user WHERE telegram_id = ?',
                 (telegram_id,)
             ) as cursor:
-                user = await cursor.fetchone()
-                return dict(user) if user else None
+                cursor.row_factory = UserRecord.row_factory
+                return await cursor.fetchone()
 
+    @cached('trial_settings', error="Ошибка при получении настроек пробного периода")
     async def get_active_trial_settings(self) -> Optional[Dict]:
         """Получение активных настроек пробного периода"""
-        try:
-            async with aiosqlite.connect(self.db_path) as db:
-                db.row_factory = aiosqlite.Row
-                async with db.execute('''
-                    SELECT t.*, s.name as server_name 
-                    FROM trial_settings t 
-                    JOIN server_settings s ON t.server_id = s.id
-                    WHERE t.is_enable = 1 
-                    LIMIT 1
-                ''') as cursor:
-                    row = await cursor.fetchone()
-                    return dict(row) if row else None
-        except Exception as e:
-            logger.error(f"Ошибка при получении настроек пробного периода: {e}")
-            return None
+        async with self.pool.reader() as db:
+            async with db.execute('''
+                SELECT t.*, s.name as server_name 
+                FROM trial_settings t 
+                JOIN server_settings s ON t.server_id = s.id
+                WHERE t.is_enable = 1 
+                LIMIT 1
+            ''') as cursor:
+                row = await cursor.fetchone()
+                return dict(row) if row else None
 
     async def update_user_trial_status(self, telegram_id: int, used: bool = True) -> bool:
         """Обновление статуса использования пробного периода"""
         try:
-            async with aiosqlite.connect(self.db_path) as db:
+            async def _operation(db):
                 await db.execute(
                     'UPDATE user SET trial_period = ? WHERE telegram_id = ?',
                     (used, telegram_id)
                 )
-                await db.commit()
-                logger.info(f"Обновлен статус пробного периода для пользователя {telegram_id}: {used}")
-                return True
+
+            await self._write(_operation)
+            logger.info(f"Обновлен статус пробного периода для пользователя {telegram_id}: {used}")
+            return True
         except Exception as e:
             logger.error(f"Ошибка при обновлении статуса пробного периода для пользователя {telegram_id}: {e}")
             return False
@@ -487,73 +300,70 @@ class Database:
             return str(user_id) in settings['admin_id']
         return False
 
+    @cached('server_settings', error="Ошибка при получении настроек сервера {}")
     async def get_server_settings(self, server_id: int) -> Optional[Dict]:
         """Получение настроек сервера по ID"""
-        try:
-            async with aiosqlite.connect(self.db_path) as db:
-                db.row_factory = aiosqlite.Row
-                async with db.execute(
-                    'SELECT * FROM server_settings WHERE id = ?',
-                    (server_id,)
-                ) as cursor:
-                    row = await cursor.fetchone()
-                    return dict(row) if row else None
-        except Exception as e:
-            logger.error(f"Ошибка при получении настроек сервера {server_id}: {e}")
-            return None
+        async with self.pool.reader() as db:
+            async with db.execute(
+                'SELECT * FROM server_settings WHERE id = ?',
+                (server_id,)
+            ) as cursor:
+                cursor.row_factory = ServerRecord.row_factory
+                return await cursor.fetchone()
 
     async def get_connection(self):
         """Получение соединения с базой данных"""
         return await aiosqlite.connect(self.db_path)
 
+    @cached('active_tariffs', error="Ошибка при получении тарифов", fallback=[])
     async def get_active_tariffs(self) -> List[Dict]:
         """Получение активных тарифов с информацией о серверах"""
-        try:
-            async with aiosqlite.connect(self.db_path) as db:
-                db.row_factory = aiosqlite.Row
-                async with db.execute("""
-                    SELECT t.*, s.name as server_name 
-                    FROM tariff t 
-                    INNER JOIN server_settings s ON t.server_id = s.id 
-                    WHERE t.is_enable = 1 AND s.is_enable = 1
-                """) as cursor:
-                    tariffs = await cursor.fetchall()
-                    return [dict(row) for row in tariffs] if tariffs else []
-        except Exception as e:
-            logger.error(f"Ошибка при получении тарифов: {e}")
-            return []
+        async with self.pool.reader() as db:
+            async with db.execute("""
+                SELECT t.*, s.name as server_name 
+                FROM tariff t 
+                INNER JOIN server_settings s ON t.server_id = s.id 
+                WHERE t.is_enable = 1 AND s.is_enable = 1
+            """) as cursor:
+                tariffs = await cursor.fetchall()
+                return [dict(row) for row in tariffs] if tariffs else []
 
     async def get_yookassa_settings(self):
         """Получение настроек YooKassa"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.pool.reader() as db:
             async with db.execute("SELECT * FROM yookassa_settings LIMIT 1") as cursor:
                 settings = await cursor.fetchone()
                 return settings if settings else None
 
+    @invalidates('yookassa_enabled')
     async def update_yookassa_settings(self, name, shop_id, api_key, description, is_enable):
         """Обновление настроек YooKassa"""
-        async with await self.get_connection() as db:
+        async def _operation(db):
             await db.execute('''
                 INSERT OR REPLACE INTO yookassa_settings (id, name, shop_id, api_key, description, is_enable)
                 VALUES (1, ?, ?, ?, ?, ?)
             ''', (name, shop_id, api_key, description, is_enable))
-            await db.commit()
 
+        await self._write(_operation)
+
+    @invalidates('yookassa_enabled')
     async def enable_yookassa(self, enable: bool):
         """Включение/выключение YooKassa"""
-        async with await self.get_connection() as db:
+        async def _operation(db):
             await db.execute("UPDATE yookassa_settings SET is_enable = ?", (int(enable),))
-            await db.commit()
+
+        await self._write(_operation)
 
     async def add_promo_tariff(self, name: str, description: str, left_day: int, server_id: int) -> bool:
         """Добавление нового промо-тарифа"""
         try:
-            async with aiosqlite.connect(self.db_path) as conn:
+            async def _operation(conn):
                 await conn.execute("""
                     INSERT INTO tariff_promo (name, description, left_day, server_id, is_enable)
                     VALUES (?, ?, ?, ?, 1)
                 """, (name, description, left_day, server_id))
-                await conn.commit()
+
+            await self._write(_operation)
             return True
         except Exception as e:
             logger.error(f"Ошибка при добавлении промо-тарифа: {e}")
@@ -562,8 +372,7 @@ class Database:
     async def get_promo_tariffs(self) -> list:
         """Получение списка активных промо-тарифов"""
         try:
-            async with aiosqlite.connect(self.db_path) as conn:
-                conn.row_factory = aiosqlite.Row
+            async with self.pool.reader() as conn:
                 async with conn.execute("""
                     SELECT tp.*, ss.name as server_name
                     FROM tariff_promo tp
@@ -578,13 +387,14 @@ class Database:
     async def delete_promo_tariff(self, tariff_id: int) -> bool:
         """Деактивация промо-тарифа"""
         try:
-            async with aiosqlite.connect(self.db_path) as conn:
+            async def _operation(conn):
                 await conn.execute("""
                     UPDATE tariff_promo 
                     SET is_enable = 0 
                     WHERE id = ?
                 """, (tariff_id,))
-                await conn.commit()
+
+            await self._write(_operation)
             return True
         except Exception as e:
             logger.error(f"Ошибка при удалении промо-тарифа: {e}")
@@ -593,7 +403,7 @@ class Database:
     async def get_server_promo_inbound(self, server_id: int) -> int:
         """Получение promo inbound_id для сервера"""
         try:
-            async with aiosqlite.connect(self.db_path) as conn:
+            async with self.pool.reader() as conn:
                 async with conn.execute("""
                     SELECT inbound_id_promo 
                     FROM server_settings 
@@ -605,58 +415,156 @@ class Database:
             logger.error(f"Ошибка при получении promo inbound_id: {e}")
             return None
 
+    async def get_inbound_fill_levels(self, server_id: int = None) -> List[Dict]:
+        """Заполненность inbounds серверов для администратора"""
+        try:
+            async with self.pool.reader() as conn:
+                return await inbound_fill_levels(conn, server_id)
+        except Exception as e:
+            logger.error(f"Ошибка при получении заполненности inbounds: {e}")
+            return []
+
+    async def get_traffic_report(self, since_ts: int = 0, server_id: int = None, limit: int = 50) -> List[Dict]:
+        """Трафик подписок с момента since_ts по убыванию для администратора"""
+        try:
+            async with self.pool.reader() as conn:
+                async with conn.execute("""
+                    SELECT tu.subscription_id, us.user_id, us.server_id, s.name AS server_name,
+                           SUM(tu.up) AS up, SUM(tu.down) AS down
+                    FROM traffic_usage tu
+                    JOIN user_subscription us ON us.id = tu.subscription_id
+                    LEFT JOIN server_settings s ON s.id = us.server_id
+                    WHERE tu.bucket >= ? AND (? IS NULL OR us.server_id = ?)
+                    GROUP BY tu.subscription_id
+                    ORDER BY SUM(tu.up) + SUM(tu.down) DESC
+                    LIMIT ?
+                """, (since_ts, server_id, server_id, limit)) as cursor:
+                    return [dict(row) for row in await cursor.fetchall()]
+        except Exception as e:
+            logger.error(f"Ошибка при получении отчета по трафику: {e}")
+            return []
+
+    async def get_subscription_traffic(self, subscription_id: int, since_ts: int = 0) -> Dict:
+        """Суммарный трафик подписки с момента since_ts"""
+        try:
+            async with self.pool.reader() as conn:
+                async with conn.execute("""
+                    SELECT COALESCE(SUM(up), 0), COALESCE(SUM(down), 0)
+                    FROM traffic_usage WHERE subscription_id = ? AND bucket >= ?
+                """, (subscription_id, since_ts)) as cursor:
+                    up, down = await cursor.fetchone()
+                    return {'up': up, 'down': down}
+        except Exception as e:
+            logger.error(f"Ошибка при получении трафика подписки {subscription_id}: {e}")
+            return {'up': 0, 'down': 0}
+
+    async def start_evacuation(self, source_server_id: int, target_server_ids: List[int],
+                               bot: Bot = None) -> Optional[int]:
+        """Запуск переноса ключей сервера на целевые серверы (или продолжение начатого), возвращает id задания"""
+        try:
+            evacuation_id = await self.evacuation.create(source_server_id, target_server_ids)
+            self.evacuation.start(evacuation_id, bot)
+            return evacuation_id
+        except Exception as e:
+            logger.error(f"Ошибка при запуске переноса ключей сервера {source_server_id}: {e}")
+            return None
+
+    async def get_evacuation(self, evacuation_id: int) -> Optional[Dict]:
+        """Состояние задания переноса ключей для администратора"""
+        try:
+            return await self.evacuation.status(evacuation_id)
+        except Exception as e:
+            logger.error(f"Ошибка при получении задания переноса {evacuation_id}: {e}")
+            return None
+
+    async def set_server_inbound(self, server_id: int, inbound_id: int,
+                                 max_clients: int = None, is_enable: bool = True) -> bool:
+        """Добавление inbound в пул сервера или изменение его лимита и состояния"""
+        try:
+            async def _operation(conn):
+                await conn.execute("""
+                    INSERT INTO server_inbounds (server_id, inbound_id, max_clients, is_enable)
+                    VALUES (?, ?, ?, ?)
+                    ON CONFLICT(server_id, inbound_id) DO UPDATE SET
+                        max_clients = excluded.max_clients,
+                        is_enable = excluded.is_enable
+                """, (server_id, inbound_id, max_clients, int(is_enable)))
+
+            await self._write(_operation)
+            return True
+        except Exception as e:
+            logger.error(f"Ошибка при изменении пула inbounds сервера {server_id}: {e}")
+            return False
+
+    @invalidates('bot_settings', 'notify_settings')
     async def set_reg_notify(self, chat_id: int) -> bool:
         """Установка ID чата для уведомлений о регистрации"""
         try:
-            async with aiosqlite.connect(self.db_path) as conn:
+            async def _operation(conn):
                 await conn.execute("""
                     UPDATE bot_settings 
                     SET reg_notify = ?
                 """, (chat_id,))
-                await conn.commit()
+
+            await self._write(_operation)
             return True
         except Exception as e:
             logger.error(f"Ошибка при установке ID чата для уведомлений о регистрации: {e}")
             return False
 
+    @invalidates('bot_settings', 'notify_settings')
     async def set_pay_notify(self, chat_id: int) -> bool:
         """Установка ID чата для уведомлений о платежах"""
         try:
-            async with aiosqlite.connect(self.db_path) as conn:
+            async def _operation(conn):
                 await conn.execute("""
                     UPDATE bot_settings 
                     SET pay_notify = ?
                 """, (chat_id,))
-                await conn.commit()
+
+            await self._write(_operation)
             return True
         except Exception as e:
             logger.error(f"Ошибка при установке ID чата для уведомлений о платежах: {e}")
             return False
 
-    async def get_notify_settings(self) -> dict:
-        """Получение настроек уведомлений"""
+    @invalidates('bot_settings')
+    async def set_panel_reconcile(self, enabled: bool) -> bool:
+        """Включение исправления расхождений при сверке панелей (иначе только отчет)"""
         try:
-            async with aiosqlite.connect(self.db_path) as conn:
-                conn.row_factory = aiosqlite.Row
-                async with conn.execute("""
-                    SELECT reg_notify, pay_notify 
-                    FROM bot_settings 
-                    LIMIT 1
-                """) as cursor:
-                    return dict(await cursor.fetchone())
+            async def _operation(conn):
+                await conn.execute("""
+                    UPDATE bot_settings 
+                    SET panel_reconcile = ?
+                """, (int(enabled),))
+
+            await self._write(_operation)
+            return True
         except Exception as e:
-            logger.error(f"Ошибка при получении настроек уведомлений: {e}")
-            return {}
+            logger.error(f"Ошибка при изменении режима сверки панелей: {e}")
+            return False
+
+    @cached('notify_settings', error="Ошибка при получении настроек уведомлений", fallback={})
+    async def get_notify_settings(self) -> dict:
+        """Получение настроек уведомлений"""
+        async with self.pool.reader() as conn:
+            async with conn.execute("""
+                SELECT reg_notify, pay_notify 
+                FROM bot_settings 
+                LIMIT 1
+            """) as cursor:
+                return dict(await cursor.fetchone())
 
     async def add_review(self, username: str, message: str) -> bool:
         """Добавление нового отзыва"""
         try:
-            async with aiosqlite.connect(self.db_path) as conn:
+            async def _operation(conn):
                 await conn.execute("""
                     INSERT INTO Reviews (username, message)
                     VALUES (?, ?)
                 """, (username, message))
-                await conn.commit()
+
+            await self._write(_operation)
             return True
         except Exception as e:
             logger.error(f"Ошибка при добавлении отзыва: {e}")
@@ -665,8 +573,7 @@ class Database:
     async def get_reviews(self, limit: int = 10) -> list:
         """Получение последних отзывов"""
         try:
-            async with aiosqlite.connect(self.db_path) as conn:
-                conn.row_factory = aiosqlite.Row
+            async with self.pool.reader() as conn:
                 async with conn.execute("""
                     SELECT * FROM Reviews 
                     ORDER BY date DESC 
@@ -677,28 +584,26 @@ class Database:
             logger.error(f"Ошибка при получении отзывов: {e}")
             return []
 
+    @cached('support_info', ttl=300.0, error="Ошибка при получении информации о поддержке")
     async def get_support_info(self) -> Optional[Dict]:
         """Получение информации о поддержке"""
-        try:
-            async with aiosqlite.connect(self.db_path) as db:
-                db.row_factory = aiosqlite.Row
-                async with db.execute('SELECT * FROM support_info ORDER BY id DESC LIMIT 1') as cursor:
-                    row = await cursor.fetchone()
-                    return dict(row) if row else None
-        except Exception as e:
-            logger.error(f"Ошибка при получении информации о поддержке: {e}")
-            return None
+        async with self.pool.reader() as db:
+            async with db.execute('SELECT * FROM support_info ORDER BY id DESC LIMIT 1') as cursor:
+                row = await cursor.fetchone()
+                return dict(row) if row else None
 
+    @invalidates('support_info')
     async def update_support_info(self, message: str, bot_version: str, support_url: str) -> bool:
         """Обновление информации о поддержке"""
         try:
-            async with aiosqlite.connect(self.db_path) as db:
+            async def _operation(db):
                 await db.execute('''
                     INSERT INTO support_info (message, bot_version, support_url)
                     VALUES (?, ?, ?)
                 ''', (message, bot_version, support_url))
-                await db.commit()
-                return True
+
+            await self._write(_operation)
+            return True
         except Exception as e:
             logger.error(f"Ошибка при обновлении информации о поддержке: {e}")
             return False
@@ -706,7 +611,7 @@ class Database:
     async def add_notify_setting(self, name: str, interval: int, type: str) -> bool:
         """Добавление новой настройки уведомлений"""
         try:
-            async with aiosqlite.connect(self.db_path) as db:
+            async def _operation(db):
                 await db.execute("""
                     UPDATE notify_settings 
                     SET is_enable = 0 
@@ -717,10 +622,10 @@ class Database:
                     INSERT INTO notify_settings (name, interval, type)
                     VALUES (?, ?, ?)
                 """, (name, interval, type))
-                
-                await db.commit()
-                logger.info(f"Добавлена новая настройка уведомлений: {name} (тип: {type})")
-                return True
+
+            await self._write(_operation)
+            logger.info(f"Добавлена новая настройка уведомлений: {name} (тип: {type})")
+            return True
         except Exception as e:
             logger.error(f"Ошибка при добавлении настройки уведомлений: {e}")
             return False
@@ -728,8 +633,7 @@ class Database:
     async def get_notify_setting(self, setting_id: int) -> Optional[Dict]:
         """Получение настройки уведомлений по ID"""
         try:
-            async with aiosqlite.connect(self.db_path) as db:
-                db.row_factory = aiosqlite.Row
+            async with self.pool.reader() as db:
                 async with db.execute(
                     'SELECT * FROM notify_settings WHERE id = ?',
                     (setting_id,)
@@ -743,8 +647,7 @@ class Database:
     async def get_all_notify_settings(self) -> List[Dict]:
         """Получение всех настроек уведомлений"""
         try:
-            async with aiosqlite.connect(self.db_path) as db:
-                db.row_factory = aiosqlite.Row
+            async with self.pool.reader() as db:
                 async with db.execute('SELECT * FROM notify_settings') as cursor:
                     rows = await cursor.fetchall()
                     return [dict(row) for row in rows]
@@ -755,8 +658,7 @@ class Database:
     async def get_active_notify_settings(self) -> List[Dict]:
         """Получение активных настроек уведомлений"""
         try:
-            async with aiosqlite.connect(self.db_path) as db:
-                db.row_factory = aiosqlite.Row
+            async with self.pool.reader() as db:
                 async with db.execute(
                     'SELECT * FROM notify_settings WHERE is_enable = 1'
                 ) as cursor:
@@ -770,43 +672,38 @@ class Database:
                                   interval: int = None, type: str = None, 
                                   is_enable: bool = None) -> bool:
         """Обновление настройки уведомлений"""
+        update_values = []
+        update_fields = []
+        if name is not None:
+            update_fields.append("name = ?")
+            update_values.append(name)
+        if interval is not None:
+            update_fields.append("interval = ?")
+            update_values.append(interval)
+        if type is not None:
+            update_fields.append("type = ?")
+            update_values.append(type)
+        if is_enable is not None:
+            update_fields.append("is_enable = ?")
+            update_values.append(is_enable)
+
+        if not update_fields:
+            return False
+        update_values.append(setting_id)
+
         try:
-            async with aiosqlite.connect(self.db_path) as db:
-                async with db.execute(
-                    'SELECT * FROM notify_settings WHERE id = ?',
-                    (setting_id,)
-                ) as cursor:
-                    current = await cursor.fetchone()
-                    if not current:
-                        return False
+            async def _operation(db):
+                cursor = await db.execute(f"""
+                    UPDATE notify_settings 
+                    SET {', '.join(update_fields)}
+                    WHERE id = ?
+                """, update_values)
+                return cursor.rowcount > 0
 
-                update_values = []
-                update_fields = []
-                if name is not None:
-                    update_fields.append("name = ?")
-                    update_values.append(name)
-                if interval is not None:
-                    update_fields.append("interval = ?")
-                    update_values.append(interval)
-                if type is not None:
-                    update_fields.append("type = ?")
-                    update_values.append(type)
-                if is_enable is not None:
-                    update_fields.append("is_enable = ?")
-                    update_values.append(is_enable)
-
-                if update_fields:
-                    update_values.append(setting_id)
-                    query = f"""
-                        UPDATE notify_settings 
-                        SET {', '.join(update_fields)}
-                        WHERE id = ?
-                    """
-                    await db.execute(query, update_values)
-                    await db.commit()
-                    logger.info(f"Обновлена настройка уведомлений ID: {setting_id}")
-                    return True
-                return False
+            updated = await self._write(_operation)
+            if updated:
+                logger.info(f"Обновлена настройка уведомлений ID: {setting_id}")
+            return updated
         except Exception as e:
             logger.error(f"Ошибка при обновлении настройки уведомлений: {e}")
             return False
@@ -814,14 +711,15 @@ class Database:
     async def delete_notify_setting(self, setting_id: int) -> bool:
         """Удаление настройки уведомлений"""
         try:
-            async with aiosqlite.connect(self.db_path) as db:
+            async def _operation(db):
                 await db.execute(
                     'DELETE FROM notify_settings WHERE id = ?',
                     (setting_id,)
                 )
-                await db.commit()
-                logger.info(f"Удалена настройка уведомлений ID: {setting_id}")
-                return True
+
+            await self._write(_operation)
+            logger.info(f"Удалена настройка уведомлений ID: {setting_id}")
+            return True
         except Exception as e:
             logger.error(f"Ошибка при удалении настройки уведомлений: {e}")
             return False
@@ -829,41 +727,44 @@ class Database:
     async def enable_notify_setting(self, setting_id: int, enable: bool) -> bool:
         """Включение/выключение настройки уведомлений"""
         try:
-            async with aiosqlite.connect(self.db_path) as db:
+            async def _operation(db):
                 await db.execute(
                     'UPDATE notify_settings SET is_enable = ? WHERE id = ?',
                     (enable, setting_id)
                 )
-                await db.commit()
-                status = "включена" if enable else "выключена"
-                logger.info(f"Настройка уведомлений ID: {setting_id} {status}")
-                return True
+
+            await self._write(_operation)
+            status = "включена" if enable else "выключена"
+            logger.info(f"Настройка уведомлений ID: {setting_id} {status}")
+            return True
         except Exception as e:
             logger.error(f"Ошибка при изменении статуса настройки уведомлений: {e}")
             return False
 
     async def update_notify_setting_by_name(self, name: str, is_enable: bool = None) -> bool:
         """Обновление настройки уведомлений по имени"""
+        if is_enable is None:
+            return False
         try:
-            async with aiosqlite.connect(self.db_path) as db:
+            async def _operation(db):
                 async with db.execute(
                     'SELECT id FROM notify_settings WHERE name = ? AND is_enable = 1',
                     (name,)
                 ) as cursor:
-                    setting = await cursor.fetchone()
-                    if not setting:
+                    if not await cursor.fetchone():
                         return False
 
-                if is_enable is not None:
-                    await db.execute(
-                        'UPDATE notify_settings SET is_enable = ? WHERE name = ?',
-                        (is_enable, name)
-                    )
-                    await db.commit()
-                    status = "включена" if is_enable else "выключена"
-                    logger.info(f"Настройка уведомлений '{name}' {status}")
-                    return True
-                return False
+                await db.execute(
+                    'UPDATE notify_settings SET is_enable = ? WHERE name = ?',
+                    (is_enable, name)
+                )
+                return True
+
+            updated = await self._write(_operation)
+            if updated:
+                status = "включена" if is_enable else "выключена"
+                logger.info(f"Настройка уведомлений '{name}' {status}")
+            return updated
         except Exception as e:
             logger.error(f"Ошибка при обновлении настройки уведомлений по имени: {e}")
             return False
@@ -871,22 +772,19 @@ class Database:
     async def get_expiring_subscriptions(self) -> List[Dict]:
         """Получение подписок, которые заканчиваются в течение 24 часов"""
         try:
-            async with aiosqlite.connect(self.db_path) as db:
-                db.row_factory = aiosqlite.Row
+            async with self.pool.reader() as db:
                 
-                now = datetime.now(timezone.utc)
-                end_time = now + timedelta(hours=24)
+                now_ts = int(datetime.now(timezone.utc).timestamp())
+                end_ts = now_ts + 24 * 3600
                 
-                now_str = now.strftime('%Y-%m-%d %H:%M:%S.%f')
-                end_time_str = end_time.strftime('%Y-%m-%d %H:%M:%S.%f')
-                
-                logger.debug(f"Проверка подписок между {now_str} и {end_time_str}")
+                logger.debug(f"Проверка подписок между {now_ts} и {end_ts}")
                 
+                # Диапазон по индексу (is_active, end_ts) вместо разбора строк дат
                 async with db.execute("""
                     SELECT * FROM user_subscription 
-                    WHERE datetime(end_date) BETWEEN datetime(?) AND datetime(?)
-                    AND is_active = 1
-                """, (now_str, end_time_str)) as cursor:
+                    WHERE is_active = 1
+                    AND end_ts BETWEEN ? AND ?
+                """, (now_ts, end_ts)) as cursor:
                     rows = await cursor.fetchall()
                     subscriptions = [dict(row) for row in rows]
                     logger.debug(f"Найдено подписок: {len(subscriptions)}")
@@ -898,14 +796,13 @@ class Database:
     async def get_tariff(self, tariff_id: int) -> Optional[Dict]:
         """Получение информации о тарифе"""
         try:
-            async with aiosqlite.connect(self.db_path) as db:
-                db.row_factory = aiosqlite.Row
+            async with self.pool.reader() as db:
                 async with db.execute(
                     'SELECT * FROM tariff WHERE id = ?',
                     (tariff_id,)
                 ) as cursor:
-                    row = await cursor.fetchone()
-                    return dict(row) if row else None
+                    cursor.row_factory = TariffRecord.row_factory
+                    return await cursor.fetchone()
         except Exception as e:
             logger.error(f"Ошибка при получении тарифа: {e}")
             return None
@@ -913,14 +810,13 @@ class Database:
     async def get_server(self, server_id: int) -> Optional[Dict]:
         """Получение информации о сервере"""
         try:
-            async with aiosqlite.connect(self.db_path) as db:
-                db.row_factory = aiosqlite.Row
+            async with self.pool.reader() as db:
                 async with db.execute(
                     'SELECT * FROM server_settings WHERE id = ?',
                     (server_id,)
                 ) as cursor:
-                    row = await cursor.fetchone()
-                    return dict(row) if row else None
+                    cursor.row_factory = ServerRecord.row_factory
+                    return await cursor.fetchone()
         except Exception as e:
             logger.error(f"Ошибка при получении сервера: {e}")
             return None
@@ -928,14 +824,15 @@ class Database:
     async def add_payment_code(self, pay_code: str, sum: float) -> bool:
         """Добавление нового кода оплаты"""
         try:
-            async with aiosqlite.connect(self.db_path) as db:
+            async def _operation(db):
                 await db.execute("""
                     INSERT INTO payments_code (pay_code, sum)
                     VALUES (?, ?)
                 """, (pay_code, sum))
-                await db.commit()
-                logger.info(f"Добавлен новый код оплаты: {pay_code}")
-                return True
+
+            await self._write(_operation)
+            logger.info(f"Добавлен новый код оплаты: {pay_code}")
+            return True
         except Exception as e:
             logger.error(f"Ошибка при добавлении кода оплаты: {e}")
             return False
@@ -943,8 +840,7 @@ class Database:
     async def get_payment_code(self, pay_code: str) -> Optional[Dict]:
         """Получение информации о коде оплаты"""
         try:
-            async with aiosqlite.connect(self.db_path) as db:
-                db.row_factory = aiosqlite.Row
+            async with self.pool.reader() as db:
                 async with db.execute(
                     'SELECT * FROM payments_code WHERE pay_code = ? AND is_enable = 1',
                     (pay_code,)
@@ -958,14 +854,15 @@ class Database:
     async def disable_payment_code(self, pay_code: str) -> bool:
         """Деактивация кода оплаты"""
         try:
-            async with aiosqlite.connect(self.db_path) as db:
+            async def _operation(db):
                 await db.execute(
                     'UPDATE payments_code SET is_enable = 0 WHERE pay_code = ?',
                     (pay_code,)
                 )
-                await db.commit()
-                logger.info(f"Код оплаты деактивирован: {pay_code}")
-                return True
+
+            await self._write(_operation)
+            logger.info(f"Код оплаты деактивирован: {pay_code}")
+            return True
         except Exception as e:
             logger.error(f"Ошибка при деактивации кода оплаты: {e}")
             return False
@@ -973,8 +870,7 @@ class Database:
     async def get_all_payment_codes(self) -> List[Dict]:
         """Получение списка всех кодов оплаты"""
         try:
-            async with aiosqlite.connect(self.db_path) as db:
-                db.row_factory = aiosqlite.Row
+            async with self.pool.reader() as db:
                 async with db.execute('SELECT * FROM payments_code') as cursor:
                     rows = await cursor.fetchall()
                     return [dict(row) for row in rows]
@@ -985,14 +881,15 @@ class Database:
     async def enable_payment_code(self, pay_code: str) -> bool:
         """Активация кода оплаты"""
         try:
-            async with aiosqlite.connect(self.db_path) as db:
+            async def _operation(db):
                 await db.execute(
                     'UPDATE payments_code SET is_enable = 1 WHERE pay_code = ?',
                     (pay_code,)
                 )
-                await db.commit()
-                logger.info(f"Код оплаты активирован: {pay_code}")
-                return True
+
+            await self._write(_operation)
+            logger.info(f"Код оплаты активирован: {pay_code}")
+            return True
         except Exception as e:
             logger.error(f"Ошибка при активации кода оплаты: {e}")
             return False
@@ -1000,7 +897,7 @@ class Database:
     async def get_active_codes_sum(self) -> float:
         """Получение суммы всех активных кодов оплаты"""
         try:
-            async with aiosqlite.connect(self.db_path) as db:
+            async with self.pool.reader() as db:
                 async with db.execute(
                     'SELECT SUM(sum) FROM payments_code WHERE is_enable = 1'
                 ) as cursor:
@@ -1013,7 +910,7 @@ class Database:
     async def get_used_codes_sum(self) -> float:
         """Получение суммы всех использованных кодов оплаты"""
         try:
-            async with aiosqlite.connect(self.db_path) as db:
+            async with self.pool.reader() as db:
                 async with db.execute(
                     'SELECT SUM(sum) FROM payments_code WHERE is_enable = 0'
                 ) as cursor:
@@ -1023,37 +920,30 @@ class Database:
             logger.error(f"Ошибка при получении суммы использованных кодов: {e}")
             return 0.0
 
+    @cached('yookassa_enabled', error="Ошибка при проверке статуса Юкассы", fallback=False)
     async def is_yookassa_enabled(self) -> bool:
         """Проверка активности Юкассы"""
-        try:
-            async with aiosqlite.connect(self.db_path) as db:
-                async with db.execute(
-                    'SELECT is_enable FROM yookassa_settings WHERE is_enable = 1 LIMIT 1'
-                ) as cursor:
-                    result = await cursor.fetchone()
-                    return bool(result[0]) if result else False
-        except Exception as e:
-            logger.error(f"Ошибка при проверке статуса Юкассы: {e}")
-            return False
+        async with self.pool.reader() as db:
+            async with db.execute(
+                'SELECT is_enable FROM yookassa_settings WHERE is_enable = 1 LIMIT 1'
+            ) as cursor:
+                result = await cursor.fetchone()
+                return bool(result[0]) if result else False
 
+    @cached('crypto_enabled', error="Ошибка при проверке статуса Crypto Pay", fallback=False)
     async def is_crypto_enabled(self) -> bool:
         """Проверка активности Crypto Pay"""
-        try:
-            async with aiosqlite.connect(self.db_path) as db:
-                async with db.execute(
-                    'SELECT is_enable FROM crypto_settings WHERE is_enable = 1 LIMIT 1'
-                ) as cursor:
-                    result = await cursor.fetchone()
-                    return bool(result[0]) if result else False
-        except Exception as e:
-            logger.error(f"Ошибка при проверке статуса Crypto Pay: {e}")
-            return False        
+        async with self.pool.reader() as db:
+            async with db.execute(
+                'SELECT is_enable FROM crypto_settings WHERE is_enable = 1 LIMIT 1'
+            ) as cursor:
+                result = await cursor.fetchone()
+                return bool(result[0]) if result else False
 
     async def get_crypto_settings(self) -> Optional[Dict]:
         """Получение настроек Crypto Pay"""
         try:
-            async with aiosqlite.connect(self.db_path) as db:
-                db.row_factory = aiosqlite.Row
+            async with self.pool.reader() as db:
                 async with db.execute(
                     'SELECT * FROM crypto_settings WHERE is_enable = 1 LIMIT 1'
                 ) as cursor:
@@ -1068,8 +958,7 @@ class Database:
     async def execute_fetchone(self, query: str, params: tuple = ()) -> Optional[Dict]:
         """Выполнение запроса с получением одной строки"""
         async def _execute_query():
-            async with aiosqlite.connect(self.db_path, timeout=20.0) as db:
-                db.row_factory = aiosqlite.Row
+            async with self.pool.reader() as db:
                 async with db.execute(query, params) as cursor:
                     result = await cursor.fetchone()
                     return dict(result) if result else None
@@ -1083,13 +972,14 @@ class Database:
     async def create_raffle(self, name: str, description: str) -> bool:
         """Создание нового розыгрыша"""
         try:
-            async with aiosqlite.connect(self.db_path) as db:
+            async def _operation(db):
                 await db.execute("""
                     INSERT INTO raffles (name, description, status)
                     VALUES (?, ?, 'active')
                 """, (name, description))
-                await db.commit()
-                return True
+
+            await self._write(_operation)
+            return True
         except Exception as e:
             logger.error(f"Ошибка при создании розыгрыша: {e}")
             return False
@@ -1097,25 +987,57 @@ class Database:
     async def add_raffle_tickets(self, user_id: int, telegram_id: int, tickets_count: int, raffle_id: int) -> bool:
         """Добавление билетов пользователю"""
         try:
-            async with aiosqlite.connect(self.db_path) as conn:
-                for _ in range(tickets_count):
-                    ticket_number = f"T{random.randint(100000, 999999)}"
-                    await conn.execute("""
-                        INSERT INTO raffle_tickets 
-                        (user_id, telegram_id, ticket_number, raffle_id)
-                        VALUES (?, ?, ?, ?)
-                    """, (user_id, telegram_id, ticket_number, raffle_id))
-                await conn.commit()
-                return True
+            await self._write(
+                lambda conn: self._issue_raffle_tickets(conn, [(user_id, telegram_id, tickets_count)], raffle_id)
+            )
+            return True
         except Exception as e:
             logger.error(f"Ошибка при добавлении билетов: {e}")
             return False
 
+    async def add_raffle_tickets_bulk(self, grants: List[Tuple[int, int, int]], raffle_id: int) -> int:
+        """Выдача билетов многим пользователям одной транзакцией, возвращает число билетов"""
+        try:
+            issued = await self._write(lambda conn: self._issue_raffle_tickets(conn, grants, raffle_id))
+            logger.info(f"Выдано билетов: {issued} для {len(grants)} пользователей (розыгрыш {raffle_id})")
+            return issued
+        except Exception as e:
+            logger.error(f"Ошибка при массовой выдаче билетов: {e}")
+            return 0
+
+    async def _issue_raffle_tickets(self, conn, grants: List[Tuple[int, int, int]], raffle_id: int) -> int:
+        """Выдача билетов пачкой: grants - список (user_id, telegram_id, количество)"""
+        total = sum(count for _, _, count in grants if count > 0)
+        if total == 0:
+            return 0
+
+        # Блок номеров резервируется одним UPDATE, поэтому номера не пересекаются
+        async with conn.execute("""
+            UPDATE raffle_ticket_sequence
+            SET next_number = next_number + ?
+            WHERE id = 1
+            RETURNING next_number - ?
+        """, (total, total)) as cursor:
+            first_number = (await cursor.fetchone())[0]
+
+        def _rows():
+            number = first_number
+            for user_id, telegram_id, count in grants:
+                for _ in range(max(count, 0)):
+                    yield (user_id, telegram_id, f"T{number}", raffle_id)
+                    number += 1
+
+        await conn.executemany("""
+            INSERT INTO raffle_tickets 
+            (user_id, telegram_id, ticket_number, raffle_id)
+            VALUES (?, ?, ?, ?)
+        """, _rows())
+        return total
+
     async def get_user_tickets(self, telegram_id: int, raffle_id: int = None) -> List[Dict]:
         """Получение билетов пользователя"""
         try:
-            async with aiosqlite.connect(self.db_path) as conn:
-                conn.row_factory = aiosqlite.Row
+            async with self.pool.reader() as conn:
                 query = """
                     SELECT rt.*, r.name as raffle_name, u.username 
                     FROM raffle_tickets rt
@@ -1139,8 +1061,7 @@ class Database:
     async def get_active_raffles(self) -> List[Dict]:
         """Получение активных розыгрышей"""
         try:
-            async with aiosqlite.connect(self.db_path) as conn:
-                conn.row_factory = aiosqlite.Row
+            async with self.pool.reader() as conn:
                 cursor = await conn.execute("""
                     SELECT * FROM raffles 
                     WHERE status = 'active' 
@@ -1155,8 +1076,7 @@ class Database:
     async def get_raffle_participants(self, raffle_id: int) -> List[Dict]:
         """Получение участников розыгрыша с их билетами"""
         try:
-            async with aiosqlite.connect(self.db_path) as conn:
-                conn.row_factory = aiosqlite.Row
+            async with self.pool.reader() as conn:
                 cursor = await conn.execute("""
                     SELECT 
                         u.telegram_id,
@@ -1178,15 +1098,16 @@ class Database:
     async def deactivate_raffle(self) -> bool:
         """Деактивация текущего активного розыгрыша"""
         try:
-            async with aiosqlite.connect(self.db_path) as db:
+            async def _operation(db):
                 await db.execute("""
                     UPDATE raffles 
                     SET status = 'inactive', 
                         end_date = datetime('now')
                     WHERE status = 'active'
                 """)
-                await db.commit()
-                return True
+
+            await self._write(_operation)
+            return True
         except Exception as e:
             logger.error(f"Ошибка при деактивации розыгрыша: {e}")
             return False
@@ -1194,10 +1115,11 @@ class Database:
     async def delete_all_raffle_tickets(self) -> bool:
         """Удаление всех билетов розыгрыша"""
         try:
-            async with aiosqlite.connect(self.db_path) as db:
+            async def _operation(db):
                 await db.execute("DELETE FROM raffle_tickets")
-                await db.commit()
-                return True
+
+            await self._write(_operation)
+            return True
         except Exception as e:
             logger.error(f"Ошибка при удалении билетов: {e}")
             return False
@@ -1205,8 +1127,7 @@ class Database:
     async def get_tickets_report(self) -> List[Dict]:
         """Получение данных о билетах для отчета"""
         try:
-            async with aiosqlite.connect(self.db_path) as db:
-                db.row_factory = aiosqlite.Row
+            async with self.pool.reader() as db:
                 cursor = await db.execute("""
                     SELECT 
                         u.username,
@@ -1227,7 +1148,7 @@ class Database:
     async def get_user_balance(self, user_id: int) -> float:
         """Получение баланса пользователя с повторными попытками"""
         async def _operation():
-            async with aiosqlite.connect(self.db_path) as conn:
+            async with self.pool.reader() as conn:
                 async with conn.execute(
                     "SELECT balance FROM user_balance WHERE user_id = ?",
                     (user_id,)
@@ -1238,66 +1159,83 @@ class Database:
         return await self.db_operation_with_retry(_operation)
 
     async def update_balance(self, user_id: int, amount: float, type: str, description: str = None, payment_id: str = None) -> bool:
-        """Обновление баланса пользователя с повторными попытками"""
-        async def _operation():
-            async with aiosqlite.connect(self.db_path) as conn:
-                try:
-                    async with conn.execute(
-                        "SELECT balance FROM user_balance WHERE user_id = ?",
-                        (user_id,)
-                    ) as cursor:
-                        current_balance = await cursor.fetchone()
-
-                    if current_balance:
-                        await conn.execute(
-                            """
-                            UPDATE user_balance 
-                            SET balance = balance + ?, last_update = CURRENT_TIMESTAMP 
-                            WHERE user_id = ?
-                            """,
-                            (amount, user_id)
-                        )
-                    else:
-                        await conn.execute(
-                            "INSERT INTO user_balance (user_id, balance) VALUES (?, ?)",
-                            (user_id, amount)
-                        )
-
-                    await conn.execute(
-                        """
-                        INSERT INTO balance_transactions 
-                        (user_id, amount, type, description, payment_id) 
-                        VALUES (?, ?, ?, ?, ?)
-                        """,
-                        (user_id, amount, type, description, payment_id)
-                    )
-
-                    await conn.commit()
-                    return True
-                except Exception as e:
-                    logger.error(f"Ошибка при обновлении баланса: {e}")
-                    return False
+        """Обновление баланса пользователя"""
+        async def _unit(conn):
+            # Отрицательная сумма списывается только при достаточном балансе
+            new_balance = await apply_balance_change(conn, user_id, amount, type, description, payment_id)
+            if new_balance is None:
+                logger.warning(f"Недостаточно средств для списания {-amount} у пользователя {user_id}")
+                return False
+            return True
 
-        return await self.db_operation_with_retry(_operation)
+        try:
+            return await self._write(_unit)
+        except Exception as e:
+            logger.error(f"Ошибка при обновлении баланса: {e}")
+            return False
 
     async def get_balance_transactions(self, user_id: int, limit: int = None) -> List[Dict]:
         """Получение транзакций пользователя с повторными попытками"""
         async def _operation():
-            async with aiosqlite.connect(self.db_path) as conn:
-                conn.row_factory = aiosqlite.Row
+            async with self.pool.reader() as conn:
                 query = """
                     SELECT * FROM balance_transactions 
                     WHERE user_id = ? 
-                    ORDER BY created_at DESC
+                    ORDER BY created_at DESC, id DESC
                 """
+                params = (user_id,)
                 if limit:
-                    query += f" LIMIT {limit}"
+                    query += " LIMIT ?"
+                    params += (int(limit),)
                 
-                async with conn.execute(query, (user_id,)) as cursor:
-                    return [dict(row) for row in await cursor.fetchall()]
+                async with conn.execute(query, params) as cursor:
+                    cursor.row_factory = TransactionRecord.row_factory
+                    return await cursor.fetchall()
 
         return await self.db_operation_with_retry(_operation)
 
+    async def get_balance_transactions_page(self, user_id: int, limit: int = 20,
+                                            cursor: Optional[Tuple[str, int]] = None) -> Dict:
+        """Страница транзакций пользователя по ключу (created_at, id) предыдущей страницы"""
+        async def _operation():
+            # Ключевая пагинация идет по индексу (user_id, created_at), в котором
+            # rowid хранится последним ключом, поэтому OFFSET и сортировка не нужны
+            query = """
+                SELECT * FROM balance_transactions 
+                WHERE user_id = ? {after}
+                ORDER BY created_at DESC, id DESC
+                LIMIT ?
+            """
+            if cursor is None:
+                sql, params = query.format(after=''), (user_id, limit + 1)
+            else:
+                sql = query.format(after='AND (created_at, id) < (?, ?)')
+                params = (user_id, cursor[0], cursor[1], limit + 1)
+
+            async with self.pool.reader() as conn:
+                async with conn.execute(sql, params) as db_cursor:
+                    db_cursor.row_factory = TransactionRecord.row_factory
+                    rows = await db_cursor.fetchall()
+
+            items = rows[:limit]
+            next_cursor = None
+            if len(rows) > limit:
+                next_cursor = (items[-1]['created_at'], items[-1]['id'])
+            return {'items': items, 'next_cursor': next_cursor}
+
+        return await self.db_operation_with_retry(_operation)
+
+    async def iter_balance_transactions(self, user_id: int, page_size: int = 500):
+        """Потоковый обход всей истории транзакций пользователя постранично"""
+        cursor = None
+        while True:
+            page = await self.get_balance_transactions_page(user_id, page_size, cursor)
+            for item in page['items']:
+                yield item
+            cursor = page['next_cursor']
+            if cursor is None:
+                return
+
     async def check_balance_sufficient(self, user_id: int, required_amount: float) -> bool:
         """Проверка достаточности средств с повторными попытками"""
         async def _operation():
@@ -1310,8 +1248,7 @@ class Database:
     async def get_referral_conditions(self) -> List[Dict]:
         """Получение активных условий реферальной программы"""
         async def _operation():
-            async with aiosqlite.connect(self.db_path) as conn:
-                conn.row_factory = aiosqlite.Row
+            async with self.pool.reader() as conn:
                 cursor = await conn.execute("""
                     SELECT * FROM referral_condition 
                     WHERE is_enable = 1 
@@ -1324,8 +1261,7 @@ class Database:
     async def get_user_referral_progress(self, user_id: int) -> Dict:
         """Получение прогресса реферальной программы пользователя"""
         async def _operation():
-            async with aiosqlite.connect(self.db_path) as conn:
-                conn.row_factory = aiosqlite.Row
+            async with self.pool.reader() as conn:
                 cursor = await conn.execute("""
                     SELECT rp.*, u.referral_count 
                     FROM referral_progress rp
@@ -1339,88 +1275,47 @@ class Database:
 
     async def create_referral_progress(self, user_id: int) -> bool:
         """Создание записи прогресса реферальной программы"""
-        async def _operation():
-            async with aiosqlite.connect(self.db_path) as conn:
-                await conn.execute("""
-                    INSERT INTO referral_progress (user_id, total_invites)
-                    VALUES (?, 0)
-                """, (user_id,))
-                await conn.commit()
-                return True
-        
-        return await self.db_operation_with_retry(_operation)
+        async def _unit(conn):
+            await conn.execute("""
+                INSERT INTO referral_progress (user_id, total_invites)
+                VALUES (?, 0)
+            """, (user_id,))
+            return True
+
+        return await self._write(_unit)
 
     async def update_referral_progress(self, user_id: int, total_invites: int) -> bool:
         """Обновление прогресса реферальной программы"""
-        async def _operation():
-            async with aiosqlite.connect(self.db_path) as conn:
-                await conn.execute("""
-                    UPDATE referral_progress 
-                    SET total_invites = ?, 
-                        last_reward_at = CURRENT_TIMESTAMP
-                    WHERE user_id = ?
-                """, (total_invites, user_id))
-                await conn.commit()
-                return True
-        
-        return await self.db_operation_with_retry(_operation)
+        async def _unit(conn):
+            await conn.execute("""
+                UPDATE referral_progress 
+                SET total_invites = ?, 
+                    last_reward_at = CURRENT_TIMESTAMP
+                WHERE user_id = ?
+            """, (total_invites, user_id))
+            return True
+
+        return await self._write(_unit)
 
     async def check_referral_reward(self, user_id: int) -> Optional[float]:
         """Проверка и начисление реферальной награды"""
-        async def _operation():
-            async with aiosqlite.connect(self.db_path) as conn:
-                conn.row_factory = aiosqlite.Row
-                
-                cursor = await conn.execute("""
-                    SELECT total_invites 
-                    FROM referral_progress 
-                    WHERE user_id = ?
-                """, (user_id,))
-                progress = await cursor.fetchone()
-                
-                if not progress:
-                    return None
-                    
-                cursor = await conn.execute("""
-                    SELECT * FROM referral_condition 
-                    WHERE is_enable = 1 
-                    AND invitations <= ?
-                    ORDER BY invitations DESC
-                """, (progress['total_invites'],))
-                conditions = await cursor.fetchall()
-                
-                for condition in conditions:
-                    cursor = await conn.execute("""
-                        SELECT id FROM referral_rewards_history 
-                        WHERE user_id = ? AND condition_id = ?
-                    """, (user_id, condition['id']))
-                    
-                    if not await cursor.fetchone():  
-                        await self.update_balance(
-                            user_id=user_id,
-                            amount=condition['reward_sum'],
-                            type='referral_reward',
-                            description=f"Награда за приглашение {condition['invitations']} пользователей"
-                        )
-                        
-                        await conn.execute("""
-                            INSERT INTO referral_rewards_history 
-                            (user_id, condition_id, reward_sum) 
-                            VALUES (?, ?, ?)
-                        """, (user_id, condition['id'], condition['reward_sum']))
-                        
-                        await conn.commit()
-                        return condition['reward_sum']
-                
-                return None
-        
-        return await self.db_operation_with_retry(_operation)
+        totals = await self._write(lambda conn: apply_referral_rewards(conn, user_id))
+        return totals.get(user_id)
+
+    async def evaluate_all_referral_rewards(self) -> Dict[int, float]:
+        """Пересчет наград всех рефереров (например, после акции), возвращает начисления по пользователям"""
+        try:
+            totals = await self._write(lambda conn: apply_referral_rewards(conn))
+            logger.info(f"Начислены реферальные награды {len(totals)} пользователям на сумму {sum(totals.values())}")
+            return totals
+        except Exception as e:
+            logger.error(f"Ошибка при пересчете реферальных наград: {e}")
+            return {}
 
     async def get_user_by_referral_code(self, referral_code: str) -> Dict:
         """Получение пользователя по реферальному коду"""
         async def _operation():
-            async with aiosqlite.connect(self.db_path) as conn:
-                conn.row_factory = aiosqlite.Row
+            async with self.pool.reader() as conn:
                 cursor = await conn.execute("""
                     SELECT * FROM user WHERE referral_code = ?
                 """, (referral_code,))
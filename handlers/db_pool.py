@@ -0,0 +1,346 @@
+import asyncio
+import os
+import sqlite3
+import time
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import aiosqlite
+from loguru import logger
+
+# Настройки соединения, общие для бота (aiosqlite) и веб-приложения (sqlite3)
+SQLITE_PRAGMAS = (
+    "PRAGMA busy_timeout = 5000",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA cache_size = -16000",
+    "PRAGMA mmap_size = 134217728",
+    "PRAGMA temp_store = MEMORY",
+)
+
+# Режим журнала хранится в самом файле базы, его достаточно включить один раз
+SQLITE_WAL_PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA journal_size_limit = 67108864",
+)
+
+
+def configure_sqlite_connection(conn: sqlite3.Connection):
+    """Применение настроек к синхронному соединению sqlite3"""
+    for pragma in SQLITE_PRAGMAS:
+        conn.execute(pragma)
+
+
+def enable_wal(conn: sqlite3.Connection) -> str:
+    """Перевод файла базы в режим WAL, возвращает итоговый режим журнала"""
+    mode = conn.execute(SQLITE_WAL_PRAGMAS[0]).fetchone()[0]
+    for pragma in SQLITE_WAL_PRAGMAS[1:]:
+        conn.execute(pragma)
+    return mode
+
+
+class ConnectionPool:
+    """Пул долгоживущих соединений aiosqlite: несколько читателей и один писатель"""
+
+    def __init__(self, db_path: str, readers: int = 3, timeout: float = 20.0,
+                 health_check_interval: float = 30.0, checkpoint_interval: float = 60.0,
+                 wal_truncate_size: int = 64 * 1024 * 1024):
+        self.db_path = db_path
+        self.readers_count = max(1, readers)
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+        self.checkpoint_interval = checkpoint_interval
+        self.wal_truncate_size = wal_truncate_size
+        self._checkpoint_task: Optional[asyncio.Task] = None
+
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._open_lock: Optional[asyncio.Lock] = None
+        self._open_lock_loop = None
+        self._writer_lock: Optional[asyncio.Lock] = None
+        self._readers: Optional[asyncio.Queue] = None
+        self._all_readers: List[aiosqlite.Connection] = []
+        self._writer: Optional[aiosqlite.Connection] = None
+        self._last_used: Dict[aiosqlite.Connection, float] = {}
+        self._closed = True
+
+    async def _connect(self) -> aiosqlite.Connection:
+        """Открытие и настройка нового соединения"""
+        conn = await aiosqlite.connect(self.db_path, timeout=self.timeout)
+        conn.row_factory = aiosqlite.Row
+        for pragma in SQLITE_PRAGMAS:
+            await conn.execute(pragma)
+        self._last_used[conn] = time.monotonic()
+        return conn
+
+    async def _close_connection(self, conn: Optional[aiosqlite.Connection]):
+        """Закрытие соединения без проброса ошибок"""
+        if conn is None:
+            return
+        self._last_used.pop(conn, None)
+        try:
+            await conn.close()
+        except Exception as e:
+            logger.debug(f"Ошибка при закрытии соединения с базой данных: {e}")
+
+    async def open(self):
+        """Открытие соединений пула (вызывается лениво при первом обращении)"""
+        loop = asyncio.get_running_loop()
+        if not self._closed and self._loop is loop:
+            return
+
+        if self._loop is not loop:
+            # Примитивы asyncio привязаны к циклу событий, поэтому при смене цикла
+            # (например, повторный asyncio.run) пул создается заново. Блокировка
+            # создается один раз на цикл: одновременные первые обращения ждут одного открытия
+            if self._open_lock_loop is not loop:
+                self._open_lock = asyncio.Lock()
+                self._open_lock_loop = loop
+            if not self._closed:
+                logger.warning("Пул соединений используется из нового цикла событий, соединения будут пересозданы")
+                self._closed = True
+                # Соединения прежнего цикла закрываются явно, иначе их потоки aiosqlite остаются
+                # работать до конца процесса. Список отделяется до первого await, поэтому
+                # одновременные обращения из нового цикла не закрывают их повторно
+                stale = [self._writer, *self._all_readers]
+                self._writer = None
+                self._readers = None
+                self._all_readers = []
+                if self._checkpoint_task is not None and self._checkpoint_task.get_loop() is not loop:
+                    self._checkpoint_task = None
+                for conn in stale:
+                    await self._close_connection(conn)
+
+        async with self._open_lock:
+            if not self._closed and self._loop is loop:
+                return
+
+            self._writer_lock = asyncio.Lock()
+            self._writer = await self._connect()
+            async with self._writer.execute(SQLITE_WAL_PRAGMAS[0]) as cursor:
+                journal_mode = (await cursor.fetchone())[0]
+            for pragma in SQLITE_WAL_PRAGMAS[1:]:
+                await self._writer.execute(pragma)
+            if journal_mode.lower() != 'wal':
+                logger.warning(f"Не удалось включить WAL, текущий режим журнала: {journal_mode}")
+
+            self._readers = asyncio.Queue()
+            self._all_readers = []
+            for _ in range(self.readers_count):
+                conn = await self._connect()
+                self._all_readers.append(conn)
+                self._readers.put_nowait(conn)
+            self._loop = loop
+            self._closed = False
+            logger.info(f"Пул соединений открыт: {self.readers_count} читателей, 1 писатель ({self.db_path})")
+
+    async def _ensure_healthy(self, conn: aiosqlite.Connection) -> aiosqlite.Connection:
+        """Проверка соединения, простаивавшего дольше интервала, и замена мертвого"""
+        now = time.monotonic()
+        if now - self._last_used.get(conn, 0.0) < self.health_check_interval:
+            return conn
+
+        try:
+            await conn.execute_fetchall("SELECT 1")
+            self._last_used[conn] = now
+            return conn
+        except Exception as e:
+            logger.warning(f"Соединение с базой данных не прошло проверку, переподключение: {e}")
+            await self._close_connection(conn)
+            new_conn = await self._connect()
+            if conn in self._all_readers:
+                self._all_readers[self._all_readers.index(conn)] = new_conn
+            return new_conn
+
+    @asynccontextmanager
+    async def reader(self):
+        """Выдача соединения для чтения на время операции"""
+        await self.open()
+        conn = await self._readers.get()
+        try:
+            conn = await self._ensure_healthy(conn)
+            yield conn
+        finally:
+            self._last_used[conn] = time.monotonic()
+            if self._closed:
+                await self._close_connection(conn)
+            else:
+                self._readers.put_nowait(conn)
+
+    @asynccontextmanager
+    async def writer(self):
+        """Выдача единственного соединения для записи на время операции"""
+        await self.open()
+        async with self._writer_lock:
+            self._writer = await self._ensure_healthy(self._writer)
+            conn = self._writer
+            try:
+                yield conn
+            finally:
+                self._last_used[conn] = time.monotonic()
+                # Незафиксированная транзакция означает, что операция прервалась
+                if conn.in_transaction:
+                    try:
+                        await conn.rollback()
+                    except Exception as e:
+                        logger.error(f"Ошибка при откате транзакции: {e}")
+
+    def _wal_size(self) -> int:
+        """Текущий размер файла -wal в байтах"""
+        try:
+            return os.path.getsize(f"{self.db_path}-wal")
+        except OSError:
+            return 0
+
+    async def checkpoint(self, truncate: bool = False):
+        """Перенос страниц из WAL в основной файл базы"""
+        mode = 'TRUNCATE' if truncate else 'PASSIVE'
+        async with self.writer() as conn:
+            async with conn.execute(f"PRAGMA wal_checkpoint({mode})") as cursor:
+                busy, log_pages, checkpointed = await cursor.fetchone()
+        logger.debug(f"Checkpoint {mode}: busy={busy}, log={log_pages}, checkpointed={checkpointed}")
+        return busy, log_pages, checkpointed
+
+    async def _checkpoint_loop(self):
+        """Фоновая задача, удерживающая размер -wal файла в заданных пределах"""
+        while True:
+            await asyncio.sleep(self.checkpoint_interval)
+            try:
+                # Пассивный checkpoint не ждет читателей; усечение файла выполняется,
+                # только если WAL разросся из-за долгих читающих транзакций
+                await self.checkpoint(truncate=self._wal_size() > self.wal_truncate_size)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Ошибка при выполнении checkpoint WAL: {e}")
+
+    def start_checkpoint_task(self):
+        """Запуск фонового checkpoint, если он еще не запущен"""
+        if self._checkpoint_task is None or self._checkpoint_task.done():
+            self._checkpoint_task = asyncio.get_running_loop().create_task(self._checkpoint_loop())
+
+    async def close(self):
+        """Закрытие всех соединений пула"""
+        if self._checkpoint_task is not None:
+            self._checkpoint_task.cancel()
+            try:
+                await self._checkpoint_task
+            except (asyncio.CancelledError, Exception):
+                pass
+            self._checkpoint_task = None
+
+        if self._closed:
+            return
+        self._closed = True
+
+        while self._readers is not None and not self._readers.empty():
+            await self._close_connection(self._readers.get_nowait())
+
+        async with self._writer_lock:
+            await self._close_connection(self._writer)
+            self._writer = None
+
+        self._all_readers = []
+        logger.info("Пул соединений с базой данных закрыт")
+
+
+class WriteQueue:
+    """Очередь записей: единственная задача-писатель выполняет единицы работы и фиксирует их пачкой"""
+
+    def __init__(self, pool: ConnectionPool, batch_window: float = 0.005, max_batch: int = 64):
+        self.pool = pool
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+
+        self.batches = 0
+        self.units = 0
+
+    def _ensure_started(self):
+        """Запуск задачи-писателя в текущем цикле событий"""
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop or self._task is None or self._task.done():
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._task = loop.create_task(self._run())
+
+    async def submit(self, operation: Callable[[aiosqlite.Connection], Awaitable[Any]]) -> Any:
+        """Постановка единицы работы в очередь и ожидание ее результата.
+
+        operation получает соединение писателя и не должна вызывать commit/rollback
+        или ставить в очередь новые записи: фиксацией управляет очередь.
+        """
+        self._ensure_started()
+        future = self._loop.create_future()
+        self._queue.put_nowait((operation, future))
+        return await future
+
+    async def _collect_batch(self) -> List[Optional[Tuple[Callable, asyncio.Future]]]:
+        """Ожидание первой записи и добор остальных в течение окна группировки"""
+        batch = [await self._queue.get()]
+        deadline = self._loop.time() + self.batch_window
+        while len(batch) < self.max_batch:
+            timeout = deadline - self._loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        """Главный цикл писателя; None в очереди означает остановку"""
+        while True:
+            batch = await self._collect_batch()
+            units = [item for item in batch if item is not None]
+            if units:
+                await self._execute_batch(units)
+            if len(units) != len(batch):
+                return
+
+    async def _execute_batch(self, batch: List[Tuple[Callable, asyncio.Future]]):
+        """Выполнение пачки в одной транзакции; каждая единица изолирована точкой сохранения"""
+        outcomes = []
+        try:
+            async with self.pool.writer() as conn:
+                await conn.execute("BEGIN IMMEDIATE")
+                for operation, future in batch:
+                    if future.done():
+                        continue
+                    await conn.execute("SAVEPOINT write_unit")
+                    try:
+                        result = await operation(conn)
+                        await conn.execute("RELEASE write_unit")
+                        outcomes.append((future, result, None))
+                    except Exception as e:
+                        await conn.execute("ROLLBACK TO write_unit")
+                        await conn.execute("RELEASE write_unit")
+                        outcomes.append((future, None, e))
+                await conn.commit()
+        except Exception as e:
+            # Транзакция целиком не удалась: ни одна единица не зафиксирована
+            logger.error(f"Ошибка при фиксации пачки записей: {e}")
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        self.batches += 1
+        self.units += len(outcomes)
+        for future, result, error in outcomes:
+            if future.done():
+                continue
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+    async def close(self):
+        """Завершение задачи-писателя после обработки уже поставленных записей"""
+        if self._task is None or self._task.done():
+            return
+        self._queue.put_nowait(None)
+        await self._task
+        self._task = None
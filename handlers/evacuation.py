@@ -0,0 +1,364 @@
+import asyncio
+import time
+import uuid
+from collections import defaultdict
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from loguru import logger
+
+from handlers.db_pool import ConnectionPool
+from handlers.placement import inbound_fill_levels
+from handlers.x_ui import XUI_BULK_CHUNK, xui_manager
+
+# Подписок в одной пачке переноса: одна запись плана, по списку inbounds на сервер и одна замена строк
+EVACUATION_BATCH = 200
+
+# Уведомлений пользователям в секунду (ограничение Telegram - около 30)
+EVACUATION_NOTIFY_RATE = 20
+
+
+class ServerEvacuation:
+    """Перенос всех активных ключей VLESS с сервера на другие серверы пачками, с продолжением после сбоя"""
+
+    def __init__(self, pool: ConnectionPool, write: Callable[[Callable], Awaitable]):
+        self.pool = pool
+        # Запись через очередь записей базы (Database._write)
+        self.write = write
+        self._tasks: Dict[int, asyncio.Task] = {}
+
+    async def create(self, source_server_id: int, target_server_ids: List[int]) -> int:
+        """Новое задание переноса или уже начатое задание этого сервера"""
+        async def _operation(conn):
+            async with conn.execute(
+                "SELECT id FROM server_evacuations WHERE source_server_id = ? AND status = 'running'",
+                (source_server_id,)
+            ) as cursor:
+                row = await cursor.fetchone()
+            if row:
+                return row[0]
+            async with conn.execute(
+                "INSERT INTO server_evacuations (source_server_id, target_server_ids) VALUES (?, ?) RETURNING id",
+                (source_server_id, ','.join(str(server_id) for server_id in target_server_ids))
+            ) as cursor:
+                return (await cursor.fetchone())[0]
+
+        return await self.write(_operation)
+
+    def start(self, evacuation_id: int, bot=None) -> asyncio.Task:
+        """Запуск задания в фоне, если оно еще не выполняется"""
+        task = self._tasks.get(evacuation_id)
+        if task is None or task.done():
+            task = asyncio.get_running_loop().create_task(self.run(evacuation_id, bot))
+            self._tasks[evacuation_id] = task
+        return task
+
+    async def close(self):
+        """Остановка выполняемых заданий: при следующем запуске они продолжатся с места остановки"""
+        tasks = [task for task in self._tasks.values() if not task.done()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks.clear()
+
+    async def status(self, evacuation_id: int) -> Optional[Dict]:
+        """Состояние задания и число подписок по статусам"""
+        async with self.pool.reader() as conn:
+            async with conn.execute("SELECT * FROM server_evacuations WHERE id = ?", (evacuation_id,)) as cursor:
+                evacuation = await cursor.fetchone()
+            if evacuation is None:
+                return None
+            async with conn.execute("""
+                SELECT status, COUNT(*) FROM server_evacuation_items
+                WHERE evacuation_id = ? GROUP BY status
+            """, (evacuation_id,)) as cursor:
+                counts = {row[0]: row[1] for row in await cursor.fetchall()}
+        return dict(evacuation, items=counts)
+
+    async def _servers(self, server_ids: List[int]) -> Dict[int, Dict]:
+        async with self.pool.reader() as conn:
+            async with conn.execute(
+                f"SELECT * FROM server_settings WHERE id IN ({', '.join('?' for _ in server_ids)})",
+                server_ids
+            ) as cursor:
+                return {row['id']: dict(row) for row in await cursor.fetchall()}
+
+    async def _targets(self, targets: List[Dict]) -> List[List]:
+        """Inbounds целевых серверов с текущей загрузкой: [загрузка, лимит, сервер, inbound]"""
+        slots = []
+        async with self.pool.reader() as conn:
+            for server in targets:
+                levels = await inbound_fill_levels(conn, server['id'])
+                if not levels:
+                    # Сервер без пула: единственный inbound из настроек сервера
+                    slots.append([0, None, server, server['inbound_id']])
+                slots.extend(
+                    [level['load'], level['max_clients'], server, level['inbound_id']]
+                    for level in levels if level['is_enable']
+                )
+        return slots
+
+    async def _plan(self, evacuation_id: int, source_id: int, slots: List[List], limit: int) -> int:
+        """План следующей пачки: целевой inbound, UUID и email нового клиента для каждой подписки"""
+        now = int(time.time())
+        async with self.pool.reader() as conn:
+            async with conn.execute("""
+                SELECT us.id, us.user_id, us.end_ts
+                FROM user_subscription us
+                WHERE us.server_id = ? AND us.is_active = 1 AND us.end_ts > ?
+                  AND us.vless LIKE 'vless://%'
+                  AND NOT EXISTS (SELECT 1 FROM server_evacuation_items i
+                                  WHERE i.evacuation_id = ? AND i.subscription_id = us.id)
+                ORDER BY us.id
+                LIMIT ?
+            """, (source_id, now, evacuation_id, limit)) as cursor:
+                rows = await cursor.fetchall()
+        if not rows:
+            return 0
+
+        items = []
+        taken: Set[str] = set()
+        for row in rows:
+            # Наименее загруженный inbound, не достигший лимита
+            candidates = [slot for slot in slots if not slot[1] or slot[0] < slot[1]]
+            if not candidates:
+                logger.error(f"Перенос {evacuation_id}: на целевых серверах закончились места")
+                break
+            slot = min(candidates, key=lambda slot: slot[0])
+            slot[0] += 1
+            email = xui_manager.unique_email(row['user_id'], taken)
+            taken.add(email)
+            items.append((
+                evacuation_id, row['id'], row['user_id'], slot[2]['id'], slot[3],
+                str(uuid.uuid4()), email, row['end_ts'] * 1000
+            ))
+
+        async def _operation(conn):
+            await conn.executemany("""
+                INSERT OR IGNORE INTO server_evacuation_items
+                    (evacuation_id, subscription_id, user_id, target_server_id, target_inbound_id,
+                     client_id, email, expiry_time)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """, items)
+
+        await self.write(_operation)
+        return len(items)
+
+    async def _planned(self, evacuation_id: int) -> List[Dict]:
+        async with self.pool.reader() as conn:
+            async with conn.execute("""
+                SELECT i.*, us.vless AS old_vless, us.inbound_id AS old_inbound_id
+                FROM server_evacuation_items i
+                JOIN user_subscription us ON us.id = i.subscription_id
+                WHERE i.evacuation_id = ? AND i.status = 'planned'
+                ORDER BY i.subscription_id
+                LIMIT ?
+            """, (evacuation_id, EVACUATION_BATCH)) as cursor:
+                return [dict(row) for row in await cursor.fetchall()]
+
+    async def _provision(self, servers: Dict[int, Dict], items: List[Dict]) -> Dict[int, Optional[str]]:
+        """Создание клиентов пачки на целевых серверах: {подписка: ссылка или None}"""
+        links: Dict[int, Optional[str]] = {}
+        groups = defaultdict(list)
+        for item in items:
+            groups[(item['target_server_id'], item['target_inbound_id'])].append(item)
+
+        async def provision_server(server_id: int):
+            server = servers[server_id]
+            # Клиенты, созданные до прерывания задания, уже есть на панели - повторно не добавляются
+            snapshot = await xui_manager.refresh_snapshot(server)
+            existing = snapshot.by_uuid if snapshot is not None else {}
+            for (target_id, inbound_id), group in groups.items():
+                if target_id != server_id:
+                    continue
+                pending = [item for item in group if item['client_id'] not in existing]
+                created = {item['subscription_id'] for item in group if item['client_id'] in existing}
+                for start in range(0, len(pending), XUI_BULK_CHUNK):
+                    chunk = pending[start:start + XUI_BULK_CHUNK]
+                    restored = await xui_manager.restore_clients(server, inbound_id, [
+                        (item['client_id'], item['email'], item['user_id'], item['expiry_time']) for item in chunk
+                    ])
+                    if restored:
+                        created.update(item['subscription_id'] for item in chunk)
+                for item in group:
+                    link = None
+                    if item['subscription_id'] in created:
+                        link = await xui_manager.client_link(server, inbound_id, item['client_id'], item['email'])
+                    links[item['subscription_id']] = link
+
+        # Целевые серверы заполняются параллельно
+        await asyncio.gather(*(provision_server(server_id) for server_id in {key[0] for key in groups}))
+        return links
+
+    async def _swap(self, evacuation_id: int, items: List[Dict], links: Dict[int, Optional[str]]) -> Tuple[int, int, List[Dict]]:
+        """Замена строк подписок одной записью: (перенесено, ошибок, перенесенные)"""
+        async def _operation(conn):
+            moved, failed, done = 0, 0, []
+            for item in items:
+                link = links.get(item['subscription_id'])
+                if not link:
+                    await conn.execute("""
+                        UPDATE server_evacuation_items SET status = 'failed', error = ?
+                        WHERE evacuation_id = ? AND subscription_id = ?
+                    """, ("клиент не создан на целевом сервере", evacuation_id, item['subscription_id']))
+                    failed += 1
+                    continue
+                cursor = await conn.execute(
+                    "UPDATE user_subscription SET is_active = 0 WHERE id = ? AND is_active = 1",
+                    (item['subscription_id'],)
+                )
+                if cursor.rowcount != 1:
+                    # Подписку уже заменили или отключили: новый клиент не нужен
+                    await conn.execute("""
+                        UPDATE server_evacuation_items SET status = 'skipped', vless = ?
+                        WHERE evacuation_id = ? AND subscription_id = ?
+                    """, (link, evacuation_id, item['subscription_id']))
+                    continue
+                # Срок, тариф и дата начала сохраняются: меняются только сервер и ключ
+                cursor = await conn.execute("""
+                    INSERT INTO user_subscription
+                        (user_id, tariff_id, server_id, inbound_id, start_date, end_date, vless, is_active, payment_id)
+                    SELECT user_id, tariff_id, ?, ?, start_date, end_date, ?, 1, payment_id
+                    FROM user_subscription WHERE id = ?
+                """, (item['target_server_id'], item['target_inbound_id'], link, item['subscription_id']))
+                await conn.execute("""
+                    UPDATE server_evacuation_items SET status = 'done', vless = ?, new_subscription_id = ?
+                    WHERE evacuation_id = ? AND subscription_id = ?
+                """, (link, cursor.lastrowid, evacuation_id, item['subscription_id']))
+                moved += 1
+                done.append(item)
+            await conn.execute(
+                "UPDATE server_evacuations SET moved = moved + ?, failed = failed + ? WHERE id = ?",
+                (moved, failed, evacuation_id)
+            )
+            return moved, failed, done
+
+        return await self.write(_operation)
+
+    async def _cleanup(self, source: Dict, servers: Dict[int, Dict], evacuation_id: int,
+                       done: List[Dict]):
+        """Удаление старых клиентов с исходного сервера и лишних новых клиентов с целевых"""
+        if done:
+            # Исходный сервер может быть недоступен: оставшихся клиентов позже удалит сверка панелей
+            deleted = await xui_manager.delete_clients_bulk(
+                source, [(item['old_vless'], item['old_inbound_id']) for item in done]
+            )
+            logger.info(f"Перенос {evacuation_id}: со старого сервера удалено {sum(deleted)} из {len(done)} клиентов")
+
+        async with self.pool.reader() as conn:
+            async with conn.execute("""
+                SELECT target_server_id, target_inbound_id, vless FROM server_evacuation_items
+                WHERE evacuation_id = ? AND status = 'skipped' AND vless IS NOT NULL
+            """, (evacuation_id,)) as cursor:
+                skipped = await cursor.fetchall()
+        by_server = defaultdict(list)
+        for row in skipped:
+            by_server[row['target_server_id']].append((row['vless'], row['target_inbound_id']))
+        for server_id, skipped_links in by_server.items():
+            await xui_manager.delete_clients_bulk(servers[server_id], skipped_links)
+
+        async def _operation(conn):
+            await conn.execute("""
+                UPDATE server_evacuation_items SET vless = NULL
+                WHERE evacuation_id = ? AND status = 'skipped'
+            """, (evacuation_id,))
+
+        if skipped:
+            await self.write(_operation)
+
+    async def notify(self, evacuation_id: int, bot) -> int:
+        """Отправка пользователям новых ключей перенесенных подписок, возвращает число отправленных"""
+        async with self.pool.reader() as conn:
+            async with conn.execute("""
+                SELECT i.subscription_id, i.user_id, i.vless, s.name AS server_name
+                FROM server_evacuation_items i
+                JOIN server_settings s ON s.id = i.target_server_id
+                WHERE i.evacuation_id = ? AND i.status = 'done' AND i.notified = 0
+            """, (evacuation_id,)) as cursor:
+                rows = await cursor.fetchall()
+
+        sent = []
+        for row in rows:
+            message_text = (
+                "🔄 <b>Ваш ключ перенесен на другой сервер</b>\n\n"
+                f"🌐 Новый сервер: {row['server_name']}\n"
+                "⏳ Срок подписки сохранен.\n\n"
+                f"🔑 Новый ключ:\n<code>{row['vless']}</code>"
+            )
+            try:
+                await bot.send_message(chat_id=row['user_id'], text=message_text, parse_mode="HTML")
+            except Exception as e:
+                logger.error(f"Ошибка при отправке нового ключа пользователю {row['user_id']}: {e}")
+            # Отмечаются и неудачные отправки: пользователь мог заблокировать бота
+            sent.append(row['subscription_id'])
+            await asyncio.sleep(1 / EVACUATION_NOTIFY_RATE)
+
+        async def _operation(conn):
+            await conn.executemany(
+                "UPDATE server_evacuation_items SET notified = 1 WHERE evacuation_id = ? AND subscription_id = ?",
+                [(evacuation_id, subscription_id) for subscription_id in sent]
+            )
+
+        if sent:
+            await self.write(_operation)
+        return len(sent)
+
+    async def run(self, evacuation_id: int, bot=None) -> Optional[Dict]:
+        """Выполнение (или продолжение) задания переноса до конца"""
+        async with self.pool.reader() as conn:
+            async with conn.execute("SELECT * FROM server_evacuations WHERE id = ?", (evacuation_id,)) as cursor:
+                evacuation = await cursor.fetchone()
+        if evacuation is None or evacuation['status'] != 'running':
+            return None
+
+        source_id = evacuation['source_server_id']
+        target_ids = [int(server_id) for server_id in evacuation['target_server_ids'].split(',') if server_id]
+        servers = await self._servers([source_id, *target_ids])
+        source = servers.get(source_id)
+        targets = [servers[server_id] for server_id in target_ids
+                   if server_id in servers and servers[server_id]['is_enable'] and server_id != source_id]
+        if source is None or not targets:
+            logger.error(f"Перенос {evacuation_id}: нет исходного или доступных целевых серверов")
+            return None
+
+        # Повторная попытка для подписок, не перенесенных прошлым запуском
+        async def _retry_failed(conn):
+            await conn.execute("""
+                UPDATE server_evacuation_items SET status = 'planned', error = NULL
+                WHERE evacuation_id = ? AND status = 'failed'
+            """, (evacuation_id,))
+            await conn.execute("UPDATE server_evacuations SET failed = 0 WHERE id = ?", (evacuation_id,))
+
+        await self.write(_retry_failed)
+        logger.info(f"Перенос {evacuation_id}: ключи сервера {source_id} переносятся на серверы {target_ids}")
+
+        slots = await self._targets(targets)
+        started = time.monotonic()
+        while True:
+            items = await self._planned(evacuation_id)
+            if not items:
+                if not await self._plan(evacuation_id, source_id, slots, EVACUATION_BATCH):
+                    break
+                items = await self._planned(evacuation_id)
+            links = await self._provision(servers, items)
+            moved, failed, done = await self._swap(evacuation_id, items, links)
+            logger.info(f"Перенос {evacuation_id}: перенесено {moved}, ошибок {failed}")
+            await self._cleanup(source, servers, evacuation_id, done)
+            if bot is not None:
+                await self.notify(evacuation_id, bot)
+            if not moved and failed == len(items):
+                # Целевые серверы не принимают клиентов: задание остается незавершенным до следующего запуска
+                logger.error(f"Перенос {evacuation_id} приостановлен: не удалось создать ни одного клиента")
+                return await self.status(evacuation_id)
+
+        async def _finish(conn):
+            await conn.execute("""
+                UPDATE server_evacuations SET status = 'done', finished_at = CURRENT_TIMESTAMP
+                WHERE id = ? AND NOT EXISTS (SELECT 1 FROM server_evacuation_items
+                                             WHERE evacuation_id = ? AND status IN ('planned', 'failed'))
+            """, (evacuation_id, evacuation_id))
+
+        await self.write(_finish)
+        status = await self.status(evacuation_id)
+        if status is not None:
+            logger.info(f"Перенос {evacuation_id} завершен за {time.monotonic() - started:.1f} сек.: {status['items']}")
+        return status
@@ -0,0 +1,263 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+import aiosqlite
+from loguru import logger
+
+from handlers.db_pool import SQLITE_PRAGMAS, ConnectionPool
+
+# Записи об оплате тарифа напрямую через YooKassa: деньги не проходят через баланс
+NON_BALANCE_TYPES = ('payment', 'pending')
+
+# Допуск на погрешность REAL при сравнении сумм
+BALANCE_EPSILON = 0.000001
+
+
+async def _record_transaction(conn: aiosqlite.Connection, user_id: int, amount: float, type: str,
+                              description: str = None, payment_id: str = None):
+    """Запись движения по балансу в balance_transactions"""
+    await conn.execute(
+        """
+        INSERT INTO balance_transactions
+        (user_id, amount, type, description, payment_id)
+        VALUES (?, ?, ?, ?, ?)
+        """,
+        (user_id, amount, type, description, payment_id)
+    )
+
+
+async def credit_balance(conn: aiosqlite.Connection, user_id: int, amount: float, type: str,
+                         description: str = None, payment_id: str = None) -> float:
+    """Зачисление на баланс в текущей транзакции, возвращает новый баланс"""
+    # У части пользователей исторически несколько строк user_balance:
+    # изменяется всегда первая, ее же читают get_user_balance
+    async with conn.execute(
+        """
+        UPDATE user_balance
+        SET balance = balance + ?, last_update = CURRENT_TIMESTAMP
+        WHERE id = (SELECT MIN(id) FROM user_balance WHERE user_id = ?)
+        RETURNING balance
+        """,
+        (amount, user_id)
+    ) as cursor:
+        row = await cursor.fetchone()
+
+    if row is None:
+        await conn.execute(
+            "INSERT INTO user_balance (user_id, balance) VALUES (?, ?)",
+            (user_id, amount)
+        )
+        new_balance = amount
+    else:
+        new_balance = row[0]
+
+    await _record_transaction(conn, user_id, amount, type, description, payment_id)
+    return new_balance
+
+
+async def debit_balance(conn: aiosqlite.Connection, user_id: int, amount: float, type: str,
+                        description: str = None, payment_id: str = None) -> Optional[float]:
+    """Условное списание в текущей транзакции: новый баланс или None, если средств недостаточно"""
+    # Проверка и списание - один UPDATE, поэтому параллельные списания не уводят баланс в минус
+    async with conn.execute(
+        """
+        UPDATE user_balance
+        SET balance = balance - ?, last_update = CURRENT_TIMESTAMP
+        WHERE id = (SELECT MIN(id) FROM user_balance WHERE user_id = ?)
+        AND balance >= ? - ?
+        RETURNING balance
+        """,
+        (amount, user_id, amount, BALANCE_EPSILON)
+    ) as cursor:
+        row = await cursor.fetchone()
+
+    if row is None:
+        return None
+
+    await _record_transaction(conn, user_id, -amount, type, description, payment_id)
+    return row[0]
+
+
+async def apply_balance_change(conn: aiosqlite.Connection, user_id: int, amount: float, type: str,
+                               description: str = None, payment_id: str = None) -> Optional[float]:
+    """Изменение баланса на amount: положительное - зачисление, отрицательное - условное списание"""
+    if amount < 0:
+        return await debit_balance(conn, user_id, -amount, type, description, payment_id)
+    return await credit_balance(conn, user_id, amount, type, description, payment_id)
+
+
+async def apply_referral_rewards(conn: aiosqlite.Connection, user_id: int = None) -> Dict[int, float]:
+    """Начисление наград (одного или всех рефереров): за вызов не более одной награды на пользователя"""
+    # Как и раньше, выдается старшее выполненное условие без записи в истории наград.
+    # Выборка повторяется в каждом запросе; история пишется последней,
+    # поэтому все запросы видят один и тот же набор начислений
+    grants = """
+        SELECT user_id, condition_id, invitations, reward_sum
+        FROM (
+            SELECT rp.user_id, rc.id AS condition_id, rc.invitations, rc.reward_sum,
+                   ROW_NUMBER() OVER (PARTITION BY rp.user_id ORDER BY rc.invitations DESC) AS rank
+            FROM (
+                SELECT user_id, MAX(total_invites) AS total_invites
+                FROM referral_progress
+                {where}
+                GROUP BY user_id
+            ) rp
+            JOIN referral_condition rc
+                ON rc.is_enable = 1 AND rc.invitations <= rp.total_invites
+            LEFT JOIN referral_rewards_history h
+                ON h.user_id = rp.user_id AND h.condition_id = rc.id
+            WHERE h.id IS NULL
+        )
+        WHERE rank = 1
+    """.format(where='' if user_id is None else 'WHERE user_id = :user_id')
+    params = {'user_id': user_id}
+
+    await conn.execute(f"""
+        INSERT INTO balance_transactions (user_id, amount, type, description)
+        SELECT user_id, reward_sum, 'referral_reward',
+               'Награда за приглашение ' || invitations || ' пользователей'
+        FROM ({grants})
+    """, params)
+    await conn.execute(f"""
+        INSERT INTO user_balance (user_id, balance)
+        SELECT g.user_id, 0 FROM ({grants}) g
+        WHERE NOT EXISTS (SELECT 1 FROM user_balance b WHERE b.user_id = g.user_id)
+    """, params)
+    # Зачисление идет в первую строку user_balance, как в credit_balance
+    await conn.execute(f"""
+        UPDATE user_balance
+        SET balance = balance + g.reward_sum, last_update = CURRENT_TIMESTAMP
+        FROM ({grants}) g
+        WHERE user_balance.id = (SELECT MIN(id) FROM user_balance WHERE user_id = g.user_id)
+    """, params)
+    async with conn.execute(f"""
+        INSERT INTO referral_rewards_history (user_id, condition_id, reward_sum)
+        SELECT user_id, condition_id, reward_sum FROM ({grants})
+        RETURNING user_id, reward_sum
+    """, params) as cursor:
+        rows = await cursor.fetchall()
+
+    return {row[0]: row[1] for row in rows}
+
+
+class BalanceLedger:
+    """Операции с балансом на собственном соединении (для веб-приложения вне очереди записей бота)"""
+
+    def __init__(self, db_path: str, timeout: float = 20.0):
+        self.db_path = db_path
+        self.timeout = timeout
+
+    async def _transaction(self, operation: Callable[[aiosqlite.Connection], Awaitable[Any]]) -> Any:
+        """Выполнение операции в транзакции BEGIN IMMEDIATE"""
+        async with aiosqlite.connect(self.db_path, timeout=self.timeout) as conn:
+            for pragma in SQLITE_PRAGMAS:
+                await conn.execute(pragma)
+            # Блокировка записи берется сразу, а не при первом UPDATE
+            await conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = await operation(conn)
+                await conn.commit()
+                return result
+            except Exception:
+                await conn.rollback()
+                raise
+
+    async def debit(self, user_id: int, amount: float, type: str = 'debit',
+                    description: str = None, payment_id: str = None) -> Optional[float]:
+        """Условное списание: новый баланс или None, если средств недостаточно"""
+        return await self._transaction(
+            lambda conn: debit_balance(conn, user_id, amount, type, description, payment_id)
+        )
+
+    async def credit(self, user_id: int, amount: float, type: str = 'deposit',
+                     description: str = None, payment_id: str = None) -> float:
+        """Зачисление на баланс, возвращает новый баланс"""
+        return await self._transaction(
+            lambda conn: credit_balance(conn, user_id, amount, type, description, payment_id)
+        )
+
+
+class BalanceReconciler:
+    """Фоновая сверка user_balance с суммой проведенных транзакций"""
+
+    def __init__(self, pool: ConnectionPool, interval: float = 300.0):
+        self.pool = pool
+        self.interval = interval
+        self._last_transaction_id: Optional[int] = None
+        self._known_drift: Dict[int, float] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    async def run_once(self) -> Dict[int, float]:
+        """Сверка пользователей с новыми транзакциями (при первом запуске - всех), возвращает расхождения"""
+        full = self._last_transaction_id is None
+        after = self._last_transaction_id or 0
+
+        async with self.pool.reader() as conn:
+            async with conn.execute("SELECT COALESCE(MAX(id), 0) FROM balance_transactions") as cursor:
+                upto = (await cursor.fetchone())[0]
+
+            async with conn.execute(f"""
+                WITH touched AS (
+                    SELECT DISTINCT user_id FROM balance_transactions WHERE id > ? AND id <= ?
+                    UNION
+                    SELECT user_id FROM user_balance WHERE ?
+                )
+                SELECT t.user_id,
+                       COALESCE((SELECT SUM(b.balance) FROM user_balance b
+                                 WHERE b.user_id = t.user_id), 0) AS balance,
+                       COALESCE((SELECT SUM(x.amount) FROM balance_transactions x
+                                 WHERE x.user_id = t.user_id AND x.status = 'succeeded'
+                                 AND x.type NOT IN ({', '.join('?' for _ in NON_BALANCE_TYPES)})), 0) AS ledger
+                FROM touched t
+            """, (after, upto, int(full), *NON_BALANCE_TYPES)) as cursor:
+                rows = await cursor.fetchall()
+
+        drifts = {}
+        for row in rows:
+            drift = round(row['balance'] - row['ledger'], 2)
+            user_id = row['user_id']
+            if abs(drift) < 0.01:
+                self._known_drift.pop(user_id, None)
+                continue
+            drifts[user_id] = drift
+            # Предупреждение только о новых или изменившихся расхождениях
+            if self._known_drift.get(user_id) != drift:
+                self._known_drift[user_id] = drift
+                if not full:
+                    logger.warning(
+                        f"Расхождение баланса пользователя {user_id}: баланс {row['balance']}, "
+                        f"сумма транзакций {row['ledger']}, разница {drift}"
+                    )
+
+        if full and drifts:
+            logger.warning(f"Сверка балансов: расхождения у {len(drifts)} пользователей")
+        self._last_transaction_id = upto
+        logger.debug(f"Сверка балансов: проверено {len(rows)}, расхождений {len(drifts)}")
+        return drifts
+
+    async def _loop(self):
+        """Периодический запуск сверки"""
+        while True:
+            try:
+                await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Ошибка при сверке балансов: {e}")
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        """Запуск фоновой сверки, если она еще не запущена"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._loop())
+
+    async def close(self):
+        """Остановка фоновой сверки"""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except (asyncio.CancelledError, Exception):
+            pass
+        self._task = None
@@ -0,0 +1,634 @@
+import sqlite3
+from typing import Callable, List, Tuple
+
+from loguru import logger
+
+from handlers.db_pool import configure_sqlite_connection
+
+
+def _columns(conn: sqlite3.Connection, table: str) -> List[str]:
+    """Список столбцов таблицы"""
+    return [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+
+
+def _add_column(conn: sqlite3.Connection, table: str, column: str, definition: str):
+    """Добавление столбца, если его еще нет (старые базы могли получить его вручную)"""
+    if column not in _columns(conn, table):
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+        logger.info(f"Добавлен столбец {table}.{column}")
+
+
+def _baseline_schema(conn: sqlite3.Connection):
+    """Базовая схема, ранее создававшаяся в Database.init_db"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS bot_settings (
+            bot_token TEXT NOT NULL,
+            admin_id TEXT NOT NULL,
+            chat_id TEXT,
+            chanel_id TEXT,
+            is_enable BOOLEAN NOT NULL DEFAULT 1
+        )
+    ''')
+
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS server_settings (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            ip TEXT,
+            url TEXT NOT NULL,
+            port TEXT NOT NULL,
+            secret_path TEXT NOT NULL,
+            username TEXT NOT NULL,
+            password TEXT NOT NULL,
+            secretkey TEXT,
+            inbound_id INTEGER,
+            protocol TEXT DEFAULT 'vless',
+            is_enable BOOLEAN NOT NULL DEFAULT 1
+        )
+    ''')
+
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS bot_message (
+            command TEXT PRIMARY KEY,
+            text TEXT NOT NULL,
+            image_path TEXT,
+            is_enable BOOLEAN NOT NULL DEFAULT 1
+        )
+    ''')
+
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS user (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT,
+            telegram_id INTEGER UNIQUE NOT NULL,
+            trial_period BOOLEAN DEFAULT 0,
+            is_enable BOOLEAN NOT NULL DEFAULT 1,
+            date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            referral_code TEXT UNIQUE,
+            referral_count INTEGER DEFAULT 0,
+            referred_by TEXT,
+            name_account TEXT
+        )
+    ''')
+
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS tariff (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            description TEXT,
+            price DECIMAL(10,2) NOT NULL,
+            left_day INTEGER NOT NULL,
+            server_id INTEGER NOT NULL,
+            is_enable BOOLEAN NOT NULL DEFAULT 1,
+            FOREIGN KEY (server_id) REFERENCES server_settings(id)
+        )
+    ''')
+
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS tariff_promo (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            description TEXT,
+            left_day INTEGER NOT NULL,
+            server_id INTEGER,
+            is_enable BOOLEAN NOT NULL DEFAULT 1,
+            FOREIGN KEY (server_id) REFERENCES server_settings(id)
+        )
+    ''')
+
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS trial_settings (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            left_day INTEGER NOT NULL,
+            server_id INTEGER NOT NULL,
+            is_enable BOOLEAN NOT NULL DEFAULT 1,
+            FOREIGN KEY (server_id) REFERENCES server_settings(id)
+        )
+    ''')
+
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS user_subscription (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            tariff_id INTEGER NOT NULL,
+            server_id INTEGER NOT NULL,
+            start_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            end_date TIMESTAMP NOT NULL,
+            vless TEXT,
+            is_active BOOLEAN NOT NULL DEFAULT 1,
+            FOREIGN KEY (user_id) REFERENCES user(id),
+            FOREIGN KEY (tariff_id) REFERENCES tariff(id),
+            FOREIGN KEY (server_id) REFERENCES server_settings(id)
+        )
+    ''')
+
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS yookassa_settings (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT,
+            shop_id TEXT NOT NULL,
+            api_key TEXT NOT NULL,
+            description TEXT,
+            is_enable INTEGER DEFAULT 0
+        )
+    ''')
+
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS promocodes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            promocod TEXT NOT NULL,
+            activation_limit INTEGER DEFAULT 1,
+            activation_total INTEGER DEFAULT 0,
+            percentage DECIMAL(5,2) NOT NULL,
+            is_enable BOOLEAN NOT NULL DEFAULT 1,
+            date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS payments (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            tariff_id INTEGER NOT NULL,
+            price REAL NOT NULL,
+            date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES user (id),
+            FOREIGN KEY (tariff_id) REFERENCES tariff (id)
+        )
+    """)
+
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS support_info (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            message TEXT NOT NULL,
+            bot_version TEXT NOT NULL,
+            support_url TEXT NOT NULL
+        )
+    ''')
+
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS Reviews (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT NOT NULL,
+            message TEXT NOT NULL,
+            date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS notify_settings (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            interval INTEGER NOT NULL,
+            type TEXT NOT NULL,
+            is_enable BOOLEAN NOT NULL DEFAULT 1
+        )
+    ''')
+
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS payments_code (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            pay_code TEXT UNIQUE NOT NULL,
+            sum DECIMAL(10,2) NOT NULL,
+            is_enable BOOLEAN NOT NULL DEFAULT 1,
+            create_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS crypto_settings (
+            api_token TEXT NOT NULL,
+            is_enable BOOLEAN DEFAULT 0,
+            min_amount DECIMAL(10,2) DEFAULT 1.00,
+            supported_assets TEXT,  -- JSON строка с поддерживаемыми криптовалютами
+            webhook_url TEXT,
+            webhook_secret TEXT
+        )
+    ''')
+
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS raffles (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            description TEXT,
+            start_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            end_date TIMESTAMP,
+            status TEXT DEFAULT 'active',
+            winner_ticket_id INTEGER,
+            FOREIGN KEY (winner_ticket_id) REFERENCES raffle_tickets(id)
+        )
+    ''')
+
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS raffle_tickets (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            telegram_id INTEGER NOT NULL,
+            ticket_number TEXT UNIQUE NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            raffle_id INTEGER,
+            FOREIGN KEY (user_id) REFERENCES user(id),
+            FOREIGN KEY (raffle_id) REFERENCES raffles(id),
+            FOREIGN KEY (telegram_id) REFERENCES user(telegram_id)
+        )
+    ''')
+
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS user_balance (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            balance DECIMAL(10,2) DEFAULT 0.00,
+            last_update TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES user(telegram_id)
+        )
+    ''')
+
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS balance_transactions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            amount DECIMAL(10,2) NOT NULL,
+            type TEXT NOT NULL,
+            description TEXT,
+            payment_id TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES user(telegram_id)
+        )
+    ''')
+
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS referral_condition (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            description TEXT,
+            invitations INTEGER NOT NULL,
+            reward_sum DECIMAL(10,2) NOT NULL,
+            is_enable BOOLEAN NOT NULL DEFAULT 1,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS referral_progress (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            total_invites INTEGER DEFAULT 0,
+            last_reward_at TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES user(telegram_id)
+        )
+    """)
+
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_referral_progress_user_id
+        ON referral_progress(user_id)
+    """)
+
+    if conn.execute("SELECT COUNT(*) FROM referral_condition").fetchone()[0] == 0:
+        conn.execute("""
+            INSERT INTO referral_condition (name, description, invitations, reward_sum)
+            VALUES
+            ('Начальный уровень', 'Пригласите 5 друзей и получите награду', 5, 50.00),
+            ('Продвинутый уровень', 'Пригласите 10 друзей и получите награду', 10, 150.00),
+            ('Профессионал', 'Пригласите 25 друзей и получите награду', 25, 500.00)
+        """)
+
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS referral_rewards_history (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            condition_id INTEGER NOT NULL,
+            reward_sum DECIMAL(10,2) NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES user(telegram_id),
+            FOREIGN KEY (condition_id) REFERENCES referral_condition(id)
+        )
+    """)
+
+
+def _runtime_columns(conn: sqlite3.Connection):
+    """Столбцы, которые код использует, но базовая схема не создавала"""
+    _add_column(conn, 'bot_settings', 'reg_notify', 'INTEGER DEFAULT 0')
+    _add_column(conn, 'bot_settings', 'pay_notify', 'INTEGER DEFAULT 0')
+    _add_column(conn, 'server_settings', 'inbound_id_promo', 'INTEGER DEFAULT 2')
+    # NOT NULL с DEFAULT, чтобы существующие записи оставались валидными
+    _add_column(conn, 'balance_transactions', 'status', "TEXT NOT NULL DEFAULT 'succeeded'")
+    _add_column(conn, 'user_subscription', 'payment_id', 'TEXT')
+
+
+def _hot_path_indexes(conn: sqlite3.Connection):
+    """Индексы под самые частые запросы бота и веб-приложения"""
+    # Активные подписки пользователя и их сроки
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_user_subscription_user_active
+        ON user_subscription(user_id, is_active, end_date)
+    """)
+    # Поиск подписки по платежу при продлении
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_user_subscription_payment_id
+        ON user_subscription(payment_id)
+    """)
+    # Обновление статуса транзакции по платежу YooKassa
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_balance_transactions_payment_id
+        ON balance_transactions(payment_id)
+    """)
+    # История транзакций пользователя; заменяет индекс только по user_id
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_balance_transactions_user_created
+        ON balance_transactions(user_id, created_at)
+    """)
+    conn.execute("DROP INDEX IF EXISTS idx_balance_transactions_user_id")
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_user_balance_user_id
+        ON user_balance(user_id)
+    """)
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_raffle_tickets_raffle_telegram
+        ON raffle_tickets(raffle_id, telegram_id)
+    """)
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_referral_rewards_user_condition
+        ON referral_rewards_history(user_id, condition_id)
+    """)
+    conn.execute("ANALYZE")
+
+
+def _subscription_epoch(conn: sqlite3.Connection):
+    """Целочисленные start_ts/end_ts для подписок вместо разбора строк дат"""
+    _add_column(conn, 'user_subscription', 'start_ts', 'INTEGER')
+    _add_column(conn, 'user_subscription', 'end_ts', 'INTEGER')
+
+    # Строки дат хранятся в локальном времени сервера, в разных форматах
+    # (с микросекундами и без); модификатор 'utc' переводит их в unix-время
+    conn.execute("""
+        UPDATE user_subscription
+        SET start_ts = CAST(strftime('%s', start_date, 'utc') AS INTEGER),
+            end_ts = CAST(strftime('%s', end_date, 'utc') AS INTEGER)
+    """)
+
+    # Триггеры поддерживают столбцы для любых писателей, включая веб-приложение
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_user_subscription_ts_insert
+        AFTER INSERT ON user_subscription
+        BEGIN
+            UPDATE user_subscription
+            SET start_ts = CAST(strftime('%s', NEW.start_date, 'utc') AS INTEGER),
+                end_ts = CAST(strftime('%s', NEW.end_date, 'utc') AS INTEGER)
+            WHERE id = NEW.id;
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_user_subscription_ts_update
+        AFTER UPDATE OF start_date, end_date ON user_subscription
+        BEGIN
+            UPDATE user_subscription
+            SET start_ts = CAST(strftime('%s', NEW.start_date, 'utc') AS INTEGER),
+                end_ts = CAST(strftime('%s', NEW.end_date, 'utc') AS INTEGER)
+            WHERE id = NEW.id;
+        END
+    """)
+
+    # Выборка истекающих подписок: диапазон по end_ts среди активных
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_user_subscription_active_end_ts
+        ON user_subscription(is_active, end_ts)
+    """)
+    conn.execute("DROP INDEX IF EXISTS idx_user_subscription_user_active")
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_user_subscription_user_active_ts
+        ON user_subscription(user_id, is_active, end_ts)
+    """)
+
+
+def _raffle_ticket_sequence(conn: sqlite3.Connection):
+    """Счетчик номеров билетов вместо случайных номеров с риском коллизии"""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS raffle_ticket_sequence (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            next_number INTEGER NOT NULL
+        )
+    """)
+    # Старые случайные номера занимают диапазон T100000-T999999,
+    # последовательные начинаются за его пределами
+    conn.execute("""
+        INSERT OR IGNORE INTO raffle_ticket_sequence (id, next_number)
+        VALUES (1, 1000000)
+    """)
+
+
+def _server_inbound_pools(conn: sqlite3.Connection):
+    """Пулы inbounds серверов и inbound каждой подписки для распределения новых ключей"""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS server_inbounds (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            server_id INTEGER NOT NULL,
+            inbound_id INTEGER NOT NULL,
+            max_clients INTEGER,
+            is_enable BOOLEAN NOT NULL DEFAULT 1,
+            panel_clients INTEGER NOT NULL DEFAULT 0,
+            panel_synced_at TIMESTAMP,
+            UNIQUE (server_id, inbound_id),
+            FOREIGN KEY (server_id) REFERENCES server_settings(id)
+        )
+    """)
+    # Исходный пул - единственный inbound из настроек сервера, размещение не меняется
+    conn.execute("""
+        INSERT OR IGNORE INTO server_inbounds (server_id, inbound_id)
+        SELECT id, inbound_id FROM server_settings WHERE inbound_id IS NOT NULL
+    """)
+
+    _add_column(conn, 'user_subscription', 'inbound_id', 'INTEGER')
+    # До пулов все ключи создавались в inbound_id сервера
+    conn.execute("""
+        UPDATE user_subscription
+        SET inbound_id = (SELECT s.inbound_id FROM server_settings s WHERE s.id = user_subscription.server_id)
+        WHERE inbound_id IS NULL
+    """)
+    # Подсчет активных ключей по inbound без обращения к таблице
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_user_subscription_server_inbound
+        ON user_subscription(server_id, inbound_id, is_active, end_ts)
+    """)
+
+
+def _traffic_statistics(conn: sqlite3.Connection):
+    """Учет трафика клиентов по подпискам"""
+    # Последние увиденные счетчики панели: по ним считается прирост
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS traffic_counters (
+            subscription_id INTEGER PRIMARY KEY,
+            up INTEGER NOT NULL DEFAULT 0,
+            down INTEGER NOT NULL DEFAULT 0,
+            updated_at INTEGER NOT NULL
+        )
+    """)
+    # Прирост трафика по часам: одна строка на подписку и час
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS traffic_usage (
+            subscription_id INTEGER NOT NULL,
+            bucket INTEGER NOT NULL,
+            up INTEGER NOT NULL DEFAULT 0,
+            down INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (subscription_id, bucket)
+        ) WITHOUT ROWID
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_traffic_usage_bucket ON traffic_usage(bucket)")
+
+
+def _server_evacuations(conn: sqlite3.Connection):
+    """Задания переноса ключей с сервера"""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS server_evacuations (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            source_server_id INTEGER NOT NULL,
+            target_server_ids TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'running',
+            moved INTEGER NOT NULL DEFAULT 0,
+            failed INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            finished_at TIMESTAMP
+        )
+    """)
+    # Строка на переносимую подписку: новый клиент записывается до его создания на панели,
+    # поэтому прерванное задание продолжается без дублей
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS server_evacuation_items (
+            evacuation_id INTEGER NOT NULL,
+            subscription_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            target_server_id INTEGER NOT NULL,
+            target_inbound_id INTEGER NOT NULL,
+            client_id TEXT NOT NULL,
+            email TEXT NOT NULL,
+            expiry_time INTEGER NOT NULL,
+            vless TEXT,
+            new_subscription_id INTEGER,
+            status TEXT NOT NULL DEFAULT 'planned',
+            error TEXT,
+            notified INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (evacuation_id, subscription_id)
+        )
+    """)
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_server_evacuation_items_status
+        ON server_evacuation_items(evacuation_id, status)
+    """)
+
+
+def _direct_payment_type(conn: sqlite3.Connection):
+    """Оплаты тарифов напрямую через YooKassa из веб-приложения получают тип 'payment'"""
+    # Раньше такие оплаты записывались как 'deposit', хотя баланс не меняли,
+    # и сверка баланса считала бы их пополнениями. Пополнения баланса
+    # описываются иначе ("Пополнение баланса ...") и не затрагиваются
+    conn.execute("""
+        UPDATE balance_transactions
+        SET type = 'payment'
+        WHERE type = 'deposit'
+        AND payment_id IS NOT NULL
+        AND (description LIKE 'Покупка подписки %' OR description LIKE 'Продление подписки %')
+    """)
+
+
+def _subscription_epoch_default_start(conn: sqlite3.Connection):
+    """start_ts подписок, у которых start_date заполнен значением по умолчанию"""
+    # Соглашение для user_subscription.start_date/end_date: локальное время сервера
+    # без зоны ('%Y-%m-%d %H:%M:%S'), так пишут бот и веб-приложение. Строки с явной
+    # зоной (+03:00, Z) SQLite переводит сам, 'utc' для них ничего не меняет.
+    # Исключение - start_date, не переданный при вставке: DEFAULT CURRENT_TIMESTAMP
+    # пишет UTC. Такое значение совпадает с CURRENT_TIMESTAMP той же команды
+    # и переводится без 'utc' (при зоне сервера UTC оба варианта совпадают)
+    start_ts = """CAST(CASE WHEN NEW.start_date = CURRENT_TIMESTAMP
+                            THEN strftime('%s', NEW.start_date)
+                            ELSE strftime('%s', NEW.start_date, 'utc') END AS INTEGER)"""
+    end_ts = "CAST(strftime('%s', NEW.end_date, 'utc') AS INTEGER)"
+
+    conn.execute("DROP TRIGGER IF EXISTS trg_user_subscription_ts_insert")
+    conn.execute(f"""
+        CREATE TRIGGER trg_user_subscription_ts_insert
+        AFTER INSERT ON user_subscription
+        BEGIN
+            UPDATE user_subscription
+            SET start_ts = {start_ts}, end_ts = {end_ts}
+            WHERE id = NEW.id;
+        END
+    """)
+    conn.execute("DROP TRIGGER IF EXISTS trg_user_subscription_ts_update")
+    conn.execute(f"""
+        CREATE TRIGGER trg_user_subscription_ts_update
+        AFTER UPDATE OF start_date, end_date ON user_subscription
+        BEGIN
+            UPDATE user_subscription
+            SET start_ts = {start_ts}, end_ts = {end_ts}
+            WHERE id = NEW.id;
+        END
+    """)
+
+
+def _panel_reconcile_mode(conn: sqlite3.Connection):
+    """Режим сверки панелей с базой: 0 - только отчет, 1 - исправление расхождений"""
+    # По умолчанию сверка только сообщает о расхождениях, исправления включает администратор
+    _add_column(conn, 'bot_settings', 'panel_reconcile', 'INTEGER DEFAULT 0')
+
+
+# Номер версии совпадает с PRAGMA user_version после применения миграции.
+# Новые миграции добавляются только в конец списка.
+MIGRATIONS: List[Tuple[int, str, Callable[[sqlite3.Connection], None]]] = [
+    (1, "базовая схема", _baseline_schema),
+    (2, "недостающие столбцы", _runtime_columns),
+    (3, "индексы горячих запросов", _hot_path_indexes),
+    (4, "целочисленные сроки подписок", _subscription_epoch),
+    (5, "последовательные номера билетов", _raffle_ticket_sequence),
+    (6, "пулы inbounds серверов", _server_inbound_pools),
+    (7, "статистика трафика клиентов", _traffic_statistics),
+    (8, "задания переноса ключей с сервера", _server_evacuations),
+    (9, "тип прямых оплат YooKassa", _direct_payment_type),
+    (10, "start_ts для даты начала по умолчанию", _subscription_epoch_default_start),
+    (11, "режим сверки панелей", _panel_reconcile_mode),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def get_schema_version(conn: sqlite3.Connection) -> int:
+    """Текущая версия схемы, записанная в базе"""
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def apply_migrations(conn: sqlite3.Connection) -> int:
+    """Применение недостающих миграций к открытому соединению, возвращает итоговую версию"""
+    if get_schema_version(conn) >= SCHEMA_VERSION:
+        return SCHEMA_VERSION
+
+    previous_isolation = conn.isolation_level
+    conn.isolation_level = None
+    try:
+        # Бот и веб-приложение могут стартовать одновременно: версия перечитывается
+        # под блокировкой записи, и миграции применяет только первый процесс
+        conn.execute("BEGIN IMMEDIATE")
+        version = get_schema_version(conn)
+        for number, description, migration in MIGRATIONS:
+            if number <= version:
+                continue
+            migration(conn)
+            conn.execute(f"PRAGMA user_version = {number}")
+            logger.info(f"Применена миграция базы данных {number}: {description}")
+            version = number
+        conn.execute("COMMIT")
+        return version
+    except Exception:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.isolation_level = previous_isolation
+
+
+def migrate(db_path: str) -> int:
+    """Приведение схемы базы к актуальной версии"""
+    conn = sqlite3.connect(db_path, timeout=20.0)
+    try:
+        configure_sqlite_connection(conn)
+        return apply_migrations(conn)
+    finally:
+        conn.close()
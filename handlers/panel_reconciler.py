@@ -0,0 +1,195 @@
+import asyncio
+import time
+from collections import defaultdict
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from loguru import logger
+
+from handlers.db_pool import ConnectionPool
+from handlers.x_ui import xui_manager
+
+# Расхождение сроков панели и базы, которое считается ошибкой, а не разницей моментов записи
+RECONCILE_EXPIRY_TOLERANCE = 600
+
+# Клиенты истекших подписок остаются на панели на время, пока подписку можно продлить
+RECONCILE_ORPHAN_GRACE = 7 * 24 * 3600
+
+
+class PanelReconciler:
+    """Фоновая сверка клиентов панелей VLESS с подписками в базе.
+
+    Пока в bot_settings.panel_reconcile не включено исправление, фоновая сверка
+    только сообщает о расхождениях и ничего не меняет ни в базе, ни на панелях.
+    """
+
+    def __init__(self, pool: ConnectionPool, write: Callable[[Callable], Awaitable],
+                 interval: float = 3600.0):
+        self.pool = pool
+        # Запись через очередь записей базы (Database._write)
+        self.write = write
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    async def _servers(self) -> List[Dict]:
+        async with self.pool.reader() as conn:
+            async with conn.execute("SELECT * FROM server_settings WHERE is_enable = 1") as cursor:
+                return [dict(row) for row in await cursor.fetchall()]
+
+    async def fix_enabled(self) -> bool:
+        """Включено ли исправление расхождений (bot_settings.panel_reconcile)"""
+        try:
+            async with self.pool.reader() as conn:
+                async with conn.execute("SELECT panel_reconcile FROM bot_settings LIMIT 1") as cursor:
+                    row = await cursor.fetchone()
+            return bool(row and row[0])
+        except Exception as e:
+            logger.error(f"Ошибка при получении режима сверки панелей: {e}")
+            return False
+
+    async def reconcile_server(self, server: Dict, dry_run: bool = False) -> Optional[Dict[str, int]]:
+        """Сверка одного сервера по одному снимку inbounds; dry_run - только отчет без исправлений"""
+        server_id = server['id']
+        started = int(time.time())
+        # Нужен свежий список: текущий снимок мог устареть на время жизни кеша
+        snapshot = await xui_manager.refresh_snapshot(server)
+        if snapshot is None:
+            logger.error(f"Сверка сервера {server_id} пропущена: не удалось получить inbounds")
+            return None
+
+        now = int(time.time())
+        expired_ids = []
+        expiry_fixes = []
+        missing = defaultdict(list)
+        active = set()
+        inactive_links: Dict[str, tuple] = {}
+        report = defaultdict(int)
+
+        # Один проход по подпискам сервера без загрузки всех строк в память
+        async with self.pool.reader() as conn:
+            async with conn.execute("""
+                SELECT id, user_id, inbound_id, vless, is_active, start_ts, end_ts
+                FROM user_subscription
+                WHERE server_id = ? AND vless LIKE 'vless://%'
+            """, (server_id,)) as cursor:
+                async for row in cursor:
+                    client_id, email = xui_manager.parse_link(row['vless'])
+                    if not client_id:
+                        continue
+                    end_ts = row['end_ts'] or 0
+                    if row['is_active'] and end_ts <= now:
+                        expired_ids.append(row['id'])
+                    if not row['is_active'] or end_ts <= now:
+                        # Ссылка для удаления клиента и самый поздний срок среди неактивных строк
+                        previous = inactive_links.get(client_id)
+                        if previous is None or end_ts > previous[1]:
+                            inactive_links[client_id] = (row['vless'], end_ts)
+                        continue
+
+                    active.add(client_id)
+                    found = snapshot.by_uuid.get(client_id)
+                    if found is None:
+                        if email and email in snapshot.by_email:
+                            # Email занят другим клиентом: восстановить ключ с прежней ссылкой нельзя
+                            report['conflicts'] += 1
+                            logger.warning(f"Сверка сервера {server_id}: email подписки {row['id']} занят другим клиентом")
+                        elif (row['start_ts'] or 0) < started:
+                            # Ключи, созданные после загрузки снимка, в нем еще не видны
+                            inbound_id = row['inbound_id'] or server['inbound_id']
+                            missing[inbound_id].append((client_id, email, row['user_id'], end_ts * 1000))
+                        continue
+
+                    client = found[1]
+                    expiry_time = client.expiry_time or 0
+                    if expiry_time and expiry_time > (end_ts + RECONCILE_EXPIRY_TOLERANCE) * 1000:
+                        # Панель продлена дальше базы (например, продление не записалось в базу) - решает администратор
+                        report['panel_ahead'] += 1
+                        logger.warning(f"Сверка сервера {server_id}: срок клиента {client.email} на панели позже, чем у подписки {row['id']}")
+                    elif expiry_time < (end_ts - RECONCILE_EXPIRY_TOLERANCE) * 1000 or not client.enable:
+                        # Продление записано в базу, но не дошло до панели
+                        expiry_fixes.append((client, end_ts * 1000))
+
+        orphans = []
+        for client_id in snapshot.by_uuid:
+            if client_id in active:
+                continue
+            link_end = inactive_links.get(client_id)
+            if link_end is None:
+                report['unknown'] += 1
+                continue
+            link, end_ts = link_end
+            # Замененный ключ (срок еще не вышел) или давно истекшая подписка
+            if end_ts > now or end_ts < now - RECONCILE_ORPHAN_GRACE:
+                orphans.append((link, snapshot.by_uuid[client_id][0].id))
+
+        report['expired'] = len(expired_ids)
+        report['expiry_fixes'] = len(expiry_fixes)
+        report['missing'] = sum(len(clients) for clients in missing.values())
+        report['orphans'] = len(orphans)
+        if dry_run:
+            report = dict(report)
+            if any(report.values()):
+                logger.info(f"Сверка сервера {server_id} (только отчет): {report}")
+            return report
+
+        if expired_ids:
+            async def _deactivate(conn):
+                await conn.executemany(
+                    "UPDATE user_subscription SET is_active = 0 WHERE id = ? AND is_active = 1 AND end_ts <= ?",
+                    [(subscription_id, now) for subscription_id in expired_ids]
+                )
+            await self.write(_deactivate)
+        if expiry_fixes:
+            report['expiry_fixed'] = await xui_manager.set_clients_expiry(server, expiry_fixes)
+        for inbound_id, clients in missing.items():
+            report['restored'] += await xui_manager.restore_clients(server, inbound_id, clients)
+        if orphans:
+            # Каждый клиент удаляется своим delClient, inbound не пересобирается
+            report['deleted'] = sum(await xui_manager.delete_clients_bulk(server, orphans))
+
+        report = dict(report)
+        if any(report.get(key) for key in ('expired', 'expiry_fixes', 'missing', 'orphans', 'conflicts', 'panel_ahead')):
+            logger.info(f"Сверка сервера {server_id}: {report}")
+        return report
+
+    async def run_once(self, dry_run: bool = False) -> Dict[int, Optional[Dict[str, int]]]:
+        """Сверка всех включенных серверов, возвращает отчеты по серверам"""
+        servers = await self._servers()
+        # Серверы сверяются параллельно, у каждого свой пул потоков запросов к панели
+        results = await asyncio.gather(
+            *(self.reconcile_server(server, dry_run) for server in servers),
+            return_exceptions=True
+        )
+        reports = {}
+        for server, result in zip(servers, results):
+            if isinstance(result, BaseException):
+                logger.error(f"Ошибка при сверке сервера {server['id']}: {result}")
+                result = None
+            reports[server['id']] = result
+        return reports
+
+    async def _loop(self):
+        """Периодический запуск сверки"""
+        while True:
+            try:
+                await self.run_once(dry_run=not await self.fix_enabled())
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Ошибка при сверке панелей с базой: {e}")
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        """Запуск фоновой сверки, если она еще не запущена"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._loop())
+
+    async def close(self):
+        """Остановка фоновой сверки"""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except (asyncio.CancelledError, Exception):
+            pass
+        self._task = None
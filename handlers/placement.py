@@ -0,0 +1,95 @@
+import time
+from typing import Dict, List, Optional
+
+import aiosqlite
+from loguru import logger
+
+from handlers.db_pool import SQLITE_PRAGMAS
+
+
+async def inbound_fill_levels(conn: aiosqlite.Connection, server_id: int = None) -> List[Dict]:
+    """Заполненность inbounds из пулов серверов: активные ключи по базе и клиенты по панели"""
+    async with conn.execute("""
+        SELECT si.server_id, s.name AS server_name, si.inbound_id, si.max_clients,
+               si.is_enable, si.panel_clients, si.panel_synced_at,
+               COUNT(us.id) AS active_clients
+        FROM server_inbounds si
+        JOIN server_settings s ON s.id = si.server_id
+        LEFT JOIN user_subscription us
+               ON us.server_id = si.server_id AND us.inbound_id = si.inbound_id
+              AND us.is_active = 1 AND us.end_ts > ?
+        WHERE ? IS NULL OR si.server_id = ?
+        GROUP BY si.id
+        ORDER BY si.server_id, si.inbound_id
+    """, (int(time.time()), server_id, server_id)) as cursor:
+        rows = await cursor.fetchall()
+
+    levels = []
+    for row in rows:
+        level = dict(row)
+        # Размер JSON настроек inbound определяют все клиенты на панели, включая истекшие
+        level['load'] = max(level['active_clients'], level['panel_clients'] or 0)
+        level['fill'] = round(level['load'] / level['max_clients'], 4) if level['max_clients'] else None
+        levels.append(level)
+    return levels
+
+
+async def record_panel_counts(conn: aiosqlite.Connection, server_id: int, counts: Dict[int, int]):
+    """Сохранение числа клиентов inbounds по снимку панели (без commit)"""
+    await conn.executemany("""
+        UPDATE server_inbounds
+        SET panel_clients = ?, panel_synced_at = CURRENT_TIMESTAMP
+        WHERE server_id = ? AND inbound_id = ?
+    """, [(count, server_id, inbound_id) for inbound_id, count in counts.items()])
+
+
+def pick_inbound(levels: List[Dict]) -> Optional[int]:
+    """Наименее загруженный включенный inbound, не достигший лимита"""
+    candidates = [
+        level for level in levels
+        if level['is_enable'] and (not level['max_clients'] or level['load'] < level['max_clients'])
+    ]
+    if not candidates:
+        return None
+    return min(candidates, key=lambda level: (level['load'], level['inbound_id']))['inbound_id']
+
+
+async def choose_inbound(conn: aiosqlite.Connection, server_settings: Dict,
+                         panel_counts: Optional[Dict[int, int]] = None) -> Optional[int]:
+    """Inbound для нового ключа на сервере или None, если все inbounds пула заполнены"""
+    server_id = server_settings['id']
+    if panel_counts:
+        await record_panel_counts(conn, server_id, panel_counts)
+    levels = await inbound_fill_levels(conn, server_id)
+    if not levels:
+        # Сервер без пула: единственный inbound из настроек сервера
+        return server_settings.get('inbound_id')
+    return pick_inbound(levels)
+
+
+class InboundPlacement:
+    """Размещение новых ключей по inbounds на собственном соединении (для веб-приложения)"""
+
+    def __init__(self, db_path: str, timeout: float = 20.0):
+        self.db_path = db_path
+        self.timeout = timeout
+
+    async def place(self, server_settings: Dict, panel_counts: Optional[Dict[int, int]] = None) -> Optional[Dict]:
+        """Копия настроек сервера с выбранным inbound_id или None, если свободных inbounds нет"""
+        try:
+            async with aiosqlite.connect(self.db_path, timeout=self.timeout) as conn:
+                for pragma in SQLITE_PRAGMAS:
+                    await conn.execute(pragma)
+                conn.row_factory = aiosqlite.Row
+                inbound_id = await choose_inbound(conn, server_settings, panel_counts)
+                await conn.commit()
+        except Exception as e:
+            logger.error(f"Ошибка при выборе inbound для сервера {server_settings['id']}: {e}")
+            # Без данных о заполненности - прежнее поведение
+            return dict(server_settings)
+
+        if inbound_id is None:
+            logger.error(f"Все inbounds сервера {server_settings['id']} заполнены")
+            return None
+        logger.info(f"Новый ключ размещается в inbound {inbound_id} сервера {server_settings['id']}")
+        return dict(server_settings, inbound_id=inbound_id)
@@ -0,0 +1,107 @@
+from typing import Any, Callable, Dict, Iterator, List, Tuple
+
+
+class Record:
+    """Компактная запись строки БД на __slots__ с доступом как к словарю (record['name'])"""
+
+    __slots__ = ()
+
+    # Расположение столбцов для каждого набора cursor.description
+    _layouts: Dict[Tuple, List[Tuple[int, Callable]]] = {}
+    _last_layout: Tuple = (None, None, None)
+
+    def __init__(self, **values):
+        for name, value in values.items():
+            setattr(self, name, value)
+
+    @classmethod
+    def _layout(cls, description) -> List[Tuple[int, Callable]]:
+        """Индексы столбцов запроса и дескрипторы слотов, в которые они записываются"""
+        # description одного курсора - один и тот же объект для всех строк,
+        # проверка по идентичности избавляет от хеширования кортежа на каждой строке
+        last = Record._last_layout
+        if last[0] is cls and last[1] is description:
+            return last[2]
+        key = (cls, description)
+        layout = Record._layouts.get(key)
+        if layout is None:
+            # Лишние столбцы (например, из SELECT *) не сохраняются
+            layout = [(index, getattr(cls, column[0]).__set__) for index, column in enumerate(description)
+                      if column[0] in cls.__slots__]
+            Record._layouts[key] = layout
+        Record._last_layout = (cls, description, layout)
+        return layout
+
+    @classmethod
+    def row_factory(cls, cursor, row):
+        """row_factory для sqlite3/aiosqlite: строка сразу создается как запись"""
+        record = cls.__new__(cls)
+        for index, setter in cls._layout(cursor.description):
+            setter(record, row[index])
+        return record
+
+    def __getitem__(self, key: str) -> Any:
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return getattr(self, key, default)
+
+    def keys(self) -> List[str]:
+        """Поля, выбранные запросом"""
+        return [name for name in self.__slots__ if hasattr(self, name)]
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.__slots__ and hasattr(self, key)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.keys())
+
+    def __len__(self) -> int:
+        return len(self.keys())
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {name: getattr(self, name) for name in self.keys()}
+
+    def __reduce__(self):
+        # copy.deepcopy (кеш настроек) и pickle без __dict__
+        return (_restore_record, (type(self), self.to_dict()))
+
+    def __eq__(self, other) -> bool:
+        return type(self) is type(other) and self.to_dict() == other.to_dict()
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({self.to_dict()!r})"
+
+
+def _restore_record(cls, values: Dict[str, Any]) -> Record:
+    """Восстановление записи при копировании"""
+    return cls(**values)
+
+
+class UserRecord(Record):
+    __slots__ = ('id', 'username', 'telegram_id', 'trial_period', 'is_enable', 'date',
+                 'referral_code', 'referral_count', 'referred_by', 'name_account')
+
+
+class SubscriptionRecord(Record):
+    __slots__ = ('id', 'user_id', 'tariff_id', 'server_id', 'start_date', 'end_date', 'vless',
+                 'is_active', 'payment_id', 'start_ts', 'end_ts', 'inbound_id', 'server_name',
+                 'tariff_name', 'traffic_up', 'traffic_down')
+
+
+class TariffRecord(Record):
+    __slots__ = ('id', 'name', 'description', 'price', 'left_day', 'server_id', 'is_enable',
+                 'server_name')
+
+
+class ServerRecord(Record):
+    __slots__ = ('id', 'name', 'ip', 'url', 'port', 'secret_path', 'username', 'password',
+                 'secretkey', 'inbound_id', 'inbound_id_promo', 'protocol', 'is_enable')
+
+
+class TransactionRecord(Record):
+    __slots__ = ('id', 'user_id', 'amount', 'type', 'description', 'payment_id', 'created_at',
+                 'status')
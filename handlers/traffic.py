@@ -0,0 +1,161 @@
+import asyncio
+import time
+from collections import defaultdict
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+import aiosqlite
+from loguru import logger
+
+from handlers.db_pool import ConnectionPool
+from handlers.x_ui import xui_manager
+from handlers.x_ui_ss import xui_ss_manager
+
+# Размер интервала в traffic_usage
+TRAFFIC_BUCKET = 3600
+
+# Истекшие подписки еще сутки опрашиваются, чтобы учесть их последний трафик
+TRAFFIC_GRACE = 24 * 3600
+
+
+def traffic_bucket(ts: int) -> int:
+    """Начало часового интервала для момента ts"""
+    return ts - ts % TRAFFIC_BUCKET
+
+
+def traffic_delta(current: Tuple[int, int], previous: Optional[Tuple[int, int]]) -> Tuple[int, int]:
+    """Прирост счетчиков (up, down) с прошлого опроса; после сброса счетчика на панели - текущее значение"""
+    if previous is None:
+        # Первое наблюдение - только точка отсчета, накопленный ранее трафик не относится к этому часу
+        return 0, 0
+    (up, down), (previous_up, previous_down) = current, previous
+    return (up if up < previous_up else up - previous_up,
+            down if down < previous_down else down - previous_down)
+
+
+async def record_traffic(conn: aiosqlite.Connection, ts: int,
+                         samples: List[Tuple[int, Tuple[int, int], Tuple[int, int]]]):
+    """Запись счетчиков и прироста трафика (подписка, счетчики, прирост) без commit"""
+    await conn.executemany("""
+        INSERT INTO traffic_counters (subscription_id, up, down, updated_at)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT(subscription_id) DO UPDATE SET
+            up = excluded.up, down = excluded.down, updated_at = excluded.updated_at
+    """, [(subscription_id, up, down, ts) for subscription_id, (up, down), _ in samples])
+    bucket = traffic_bucket(ts)
+    await conn.executemany("""
+        INSERT INTO traffic_usage (subscription_id, bucket, up, down)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT(subscription_id, bucket) DO UPDATE SET
+            up = up + excluded.up, down = down + excluded.down
+    """, [(subscription_id, bucket, up, down) for subscription_id, _, (up, down) in samples if up or down])
+
+
+class TrafficCollector:
+    """Фоновый сбор счетчиков трафика клиентов с панелей всех включенных серверов"""
+
+    def __init__(self, pool: ConnectionPool, write: Callable[[Callable], Awaitable],
+                 interval: float = 300.0):
+        self.pool = pool
+        # Запись через очередь записей базы (Database._write)
+        self.write = write
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    async def _load(self) -> Tuple[List[Dict], Dict[int, List]]:
+        """Включенные серверы и опрашиваемые подписки с последними счетчиками по серверам"""
+        async with self.pool.reader() as conn:
+            async with conn.execute("SELECT * FROM server_settings WHERE is_enable = 1") as cursor:
+                servers = [dict(row) for row in await cursor.fetchall()]
+            async with conn.execute("""
+                SELECT us.id, us.server_id, us.inbound_id, us.vless, tc.up, tc.down
+                FROM user_subscription us
+                LEFT JOIN traffic_counters tc ON tc.subscription_id = us.id
+                WHERE us.is_active = 1 AND us.end_ts > ?
+            """, (int(time.time()) - TRAFFIC_GRACE,)) as cursor:
+                rows = await cursor.fetchall()
+
+        subscriptions = defaultdict(list)
+        for row in rows:
+            subscriptions[row['server_id']].append(row)
+        return servers, subscriptions
+
+    @staticmethod
+    async def _fetch(server: Dict, subscriptions: List) -> Optional[Dict[str, Tuple[int, int]]]:
+        """Счетчики клиентов сервера: vless - одним списком inbounds, SS - по inbound подписок"""
+        ss_inbounds = sorted({row['inbound_id'] or server['inbound_id']
+                              for row in subscriptions if (row['vless'] or '').startswith('ss://')})
+        has_vless = any(not (row['vless'] or '').startswith('ss://') for row in subscriptions)
+        parts = []
+        if has_vless:
+            parts.append(await xui_manager.get_client_traffic(server))
+        if ss_inbounds:
+            parts.append(await xui_ss_manager.get_client_traffic(server, ss_inbounds))
+        if all(part is None for part in parts):
+            return None
+        traffic = {}
+        for part in parts:
+            traffic.update(part or {})
+        return traffic
+
+    async def run_once(self) -> Dict[int, Tuple[int, int]]:
+        """Один опрос всех серверов, возвращает прирост трафика по подпискам"""
+        servers, subscriptions = await self._load()
+        servers = [server for server in servers if subscriptions.get(server['id'])]
+        # Серверы опрашиваются параллельно, ошибка одного не мешает остальным
+        results = await asyncio.gather(
+            *(self._fetch(server, subscriptions[server['id']]) for server in servers),
+            return_exceptions=True
+        )
+
+        ts = int(time.time())
+        samples = []
+        for server, traffic in zip(servers, results):
+            if isinstance(traffic, BaseException) or traffic is None:
+                logger.error(f"Не удалось получить трафик клиентов сервера {server['id']}: {traffic}")
+                continue
+            for row in subscriptions[server['id']]:
+                link = row['vless'] or ''
+                email = xui_ss_manager.parse_link(link) if link.startswith('ss://') else xui_manager.parse_link(link)[1]
+                if email is None:
+                    # Ссылка не разбирается: клиента на панели не сопоставить
+                    continue
+                current = traffic.get(email)
+                if current is None:
+                    continue
+                previous = (row['up'], row['down']) if row['up'] is not None else None
+                if current == previous:
+                    continue
+                samples.append((row['id'], current, traffic_delta(current, previous)))
+
+        if samples:
+            await self.write(lambda conn: record_traffic(conn, ts, samples))
+        usage = {subscription_id: delta for subscription_id, _, delta in samples if any(delta)}
+        logger.debug(f"Сбор трафика: серверов {len(servers)}, изменилось подписок {len(samples)}")
+        return usage
+
+    async def _loop(self):
+        """Периодический запуск сбора"""
+        while True:
+            try:
+                await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Ошибка при сборе трафика клиентов: {e}")
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        """Запуск фонового сбора, если он еще не запущен"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._loop())
+
+    async def close(self):
+        """Остановка фонового сбора"""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except (asyncio.CancelledError, Exception):
+            pass
+        self._task = None
@@ -70,8 +70,6 @@ async def extend_subscription_in_xui(server_settings, vless_link, new_end_date):
             logger.error(f"Не удалось получить клиента для сервера {server_settings['id']}")
             return False
 
-        inbounds = client.inbound.get_list()
-        
         client_id = vless_link.split('://')[1].split('@')[0]
         email = vless_link.split('#')[1] if '#' in vless_link else None
         
@@ -80,27 +78,18 @@ async def extend_subscription_in_xui(server_settings, vless_link, new_end_date):
         target_client = None
         target_inbound = None
         
-        # Поиск клиента
-        for inbound in inbounds:
-            if hasattr(inbound, 'settings') and hasattr(inbound.settings, 'clients'):
-                clients = inbound.settings.clients
-                found = next((c for c in clients if c.id == client_id), None)
-                if found:
-                    target_client, target_inbound = found, inbound
-                    logger.info(f"Клиент найден по ID {client_id} в inbound {inbound.id}")
-                    break
-                if email:
-                    found = next((c for c in clients if hasattr(c, 'email') and c.email == email), None)
-                    if found:
-                        target_client, target_inbound = found, inbound
-                        logger.info(f"Клиент найден по email {email} в inbound {inbound.id}")
-                        break
+        # Поиск клиента по индексу снимка inbounds
+        found = await xui_manager.find_client(server_settings, client_id, email)
+        if found:
+            target_inbound, target_client = found
+            logger.info(f"Клиент найден в inbound {target_inbound.id}")
         
         if not target_client:
             logger.error(f"Клиент не найден ни по ID {client_id}, ни по email {email} на сервере {server_settings['id']}")
             
             # --- ОТЛАДОЧНЫЙ ВЫВОД ---
             logger.warning("--- НАЧАЛО СПИСКА КЛИЕНТОВ НА СЕРВЕРЕ (для отладки) ---")
+            inbounds = await xui_manager.get_inbounds(server_settings) or []
             any_client_found = False
             for i, inbound in enumerate(inbounds):
                 if hasattr(inbound, 'settings') and hasattr(inbound.settings, 'clients'):
@@ -122,7 +111,7 @@ async def extend_subscription_in_xui(server_settings, vless_link, new_end_date):
         target_client.expiry_time = new_expiry
         
         try:
-            client.client.update(target_client.id, target_client)
+            await xui_manager.update_client(server_settings, target_client)
             logger.info(f"Клиент {getattr(target_client, 'email', target_client.id)} успешно обновлен в inbound {target_inbound.id}. Новая дата истечения: {new_end_date}")
             return True
         except Exception as e:
@@ -152,12 +141,12 @@ async def process_renew_subscription(callback: CallbackQuery, state: FSMContext)
                 SELECT 
                     us.*,
                     s.name as server_name,
-                    CAST((julianday(us.end_date) - julianday('now', 'localtime')) * 86400 AS INTEGER) as seconds_left
+                    us.end_ts - CAST(strftime('%s', 'now') AS INTEGER) as seconds_left
                 FROM user_subscription us
                 JOIN server_settings s ON us.server_id = s.id
-                WHERE us.user_id = ? AND us.is_active = 1 AND us.end_date > ?
-                ORDER BY us.end_date DESC
-            """, (callback.from_user.id, time_threshold.strftime('%Y-%m-%d %H:%M:%S'))) as cursor:
+                WHERE us.user_id = ? AND us.is_active = 1 AND us.end_ts > ?
+                ORDER BY us.end_ts DESC
+            """, (callback.from_user.id, int(time_threshold.timestamp()))) as cursor:
                 subscriptions = await cursor.fetchall()
         
         if not subscriptions:
@@ -171,7 +160,7 @@ async def process_renew_subscription(callback: CallbackQuery, state: FSMContext)
             await state.update_data(subscription_id=subscriptions[0]['id'],
                                     server_id=subscriptions[0]['server_id'],
                                     vless=subscriptions[0]['vless'],
-                                    end_date=subscriptions[0]['end_date'])
+                                    end_ts=subscriptions[0]['end_ts'])
             await show_tariffs_for_renewal(callback, state)
             return
         
@@ -246,7 +235,7 @@ async def process_subscription_selection(callback: CallbackQuery, state: FSMCont
         await state.update_data(subscription_id=subscription_id,
                                 server_id=subscription['server_id'],
                                 vless=subscription['vless'],
-                                end_date=subscription['end_date'])
+                                end_ts=subscription['end_ts'])
         
         await show_tariffs_for_renewal(callback, state)
         
@@ -372,13 +361,11 @@ async def process_renew_pay_balance(callback: CallbackQuery, state: FSMContext):
         tariff_price = data.get('tariff_price')
         tariff_days = data.get('tariff_days')
         
-        user_balance = await db.get_user_balance(callback.from_user.id)
-        
-        if user_balance < tariff_price:
+        # Списание условное: при нехватке средств баланс не меняется
+        if not await db.update_balance(callback.from_user.id, -tariff_price, "renewal", f"Продление подписки на {tariff_days} дней"):
             await callback.message.answer("Недостаточно средств на балансе.", reply_markup=get_subscriptions_keyboard())
             return
         
-        await db.update_balance(callback.from_user.id, -tariff_price, "renewal", f"Продление подписки на {tariff_days} дней")
         await state.update_data(payment_method="Баланс")
         await process_subscription_renewal(callback, state)
         
@@ -460,7 +447,7 @@ async def process_subscription_renewal(callback: CallbackQuery, state: FSMContex
         subscription_id = data.get('subscription_id')
         vless = data.get('vless')
         server_id = data.get('server_id')
-        end_date_str = data.get('end_date')
+        end_ts = data.get('end_ts')
         
         async with aiosqlite.connect(db.db_path) as conn:
             conn.row_factory = aiosqlite.Row
@@ -471,7 +458,7 @@ async def process_subscription_renewal(callback: CallbackQuery, state: FSMContex
             await callback.message.answer("Сервер не найден.", reply_markup=get_subscriptions_keyboard())
             return
         
-        end_date = datetime.fromisoformat(end_date_str.replace('Z', '+00:00'))
+        end_date = datetime.fromtimestamp(end_ts)
         
         current_time = datetime.now()
         if end_date < current_time:
@@ -1,98 +1,549 @@
 from py3xui import Api
 from py3xui.client import Client
 from loguru import logger
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Callable, List, Tuple
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import functools
+import threading
+import time
 import aiohttp
+import requests
+from handlers.x_ui_session import SessionManager, is_auth_failure
+from handlers.x_ui_circuit import CircuitBreakers
 from datetime import datetime, timedelta
 import uuid
 import random
+from urllib.parse import unquote
+
+# Ограничение одновременных запросов к одной панели и таймаут одного обращения к ней
+XUI_MAX_CONCURRENCY = 4
+XUI_TIMEOUT = 15.0
+# Таймаут установки соединения с панелью (недоступный сервер определяется быстрее)
+XUI_CONNECT_TIMEOUT = 5.0
+
+# Время жизни снимка inbounds сервера
+INBOUND_SNAPSHOT_TTL = 60.0
+
+# Клиентов в одном запросе addClient при массовом создании
+XUI_BULK_CHUNK = 100
+
+# Наибольший возраст шаблона ссылки inbound, если снимки сервера не загружались
+LINK_TEMPLATE_TTL = 3600.0
+
+
+def _apply_request_timeout(client: Api, timeout: Tuple[float, float]):
+    """Таймауты (соединение, чтение) HTTP-запросов py3xui: без них зависшая панель навсегда занимает поток пула"""
+    for part in (client.client, client.inbound, client.database, client.server):
+        # Собственные повторы py3xui с паузами держат поток до минуты;
+        # недоступность панели учитывает автомат сервера
+        part.max_retries = 1
+        request = part._request_with_retry
+
+        def request_with_timeout(method, url, headers, _request=request, **kwargs):
+            kwargs.setdefault('timeout', timeout)
+            return _request(method, url, headers, **kwargs)
+
+        part._request_with_retry = request_with_timeout
+
+
+def _is_auth_error(error: Exception) -> bool:
+    """Ошибка py3xui из-за недействительной сессии панели"""
+    if isinstance(error, requests.HTTPError) and error.response is not None:
+        return is_auth_failure(error.response.status_code)
+    # После перенаправления на страницу входа py3xui получает HTML вместо JSON
+    return isinstance(error, requests.JSONDecodeError)
+
+
+class InboundSnapshot:
+    """Снимок inbounds сервера с индексом клиентов по UUID и email"""
+
+    def __init__(self, inbounds: list):
+        self.inbounds = inbounds
+        self.fetched_at = time.monotonic()
+        self.by_id: Dict[int, Any] = {inbound.id: inbound for inbound in inbounds}
+        self.by_uuid: Dict[str, Tuple[Any, Client]] = {}
+        self.by_email: Dict[str, Tuple[Any, Client]] = {}
+        for inbound in inbounds:
+            for client in self._clients(inbound):
+                self._index(inbound, client)
+
+    @staticmethod
+    def _clients(inbound) -> list:
+        settings = getattr(inbound, 'settings', None)
+        return getattr(settings, 'clients', None) or []
+
+    def _index(self, inbound, client: Client):
+        # Порядок поиска как при переборе: сначала первый inbound с клиентом
+        if client.id:
+            self.by_uuid.setdefault(client.id, (inbound, client))
+        if client.email:
+            self.by_email.setdefault(client.email, (inbound, client))
+
+    def find(self, client_id: str, email: Optional[str] = None) -> Optional[Tuple[Any, Client]]:
+        """Inbound и клиент по UUID, затем по email"""
+        found = self.by_uuid.get(client_id)
+        if found is None and email:
+            found = self.by_email.get(email)
+        return found
+
+    def add(self, inbound, client: Client):
+        """Учет клиента, добавленного на сервер"""
+        clients = getattr(getattr(inbound, 'settings', None), 'clients', None)
+        if isinstance(clients, list):
+            clients.append(client)
+        self._index(inbound, client)
+
+    def update(self, client: Client):
+        """Учет обновленного клиента (email мог измениться)"""
+        found = self.by_uuid.get(client.id)
+        if found is None:
+            return
+        inbound, old = found
+        if old.email != client.email:
+            self.by_email.pop(old.email, None)
+        self.by_uuid[client.id] = (inbound, client)
+        if client.email:
+            self.by_email[client.email] = (inbound, client)
+
+    def discard(self, client_id: Optional[str] = None, email: Optional[str] = None):
+        """Удаление клиента из индекса"""
+        found = (self.by_uuid.get(client_id) if client_id else None) or (self.by_email.get(email) if email else None)
+        if found is None:
+            return
+        inbound, client = found
+        self.by_uuid.pop(client.id, None)
+        self.by_email.pop(client.email, None)
+        clients = self._clients(inbound)
+        if client in clients:
+            clients.remove(client)
+
+
+class LinkTemplate:
+    """Параметры ссылки vless inbound с Reality: порт и готовая строка запроса"""
+
+    __slots__ = ('port', 'query', 'config_hash', 'created_at')
+
+    def __init__(self, port: int, query: str, config_hash: int):
+        self.port = port
+        self.query = query
+        self.config_hash = config_hash
+        self.created_at = time.monotonic()
+
+    @staticmethod
+    def reality_config(inbound) -> Tuple:
+        """Настройки inbound, от которых зависит ссылка"""
+        reality_settings = inbound.stream_settings.reality_settings
+        return (
+            inbound.port,
+            reality_settings['settings']['publicKey'],
+            reality_settings['serverNames'][0],
+            reality_settings['shortIds'][0],
+        )
+
+    @classmethod
+    def from_inbound(cls, inbound, config: Optional[Tuple] = None) -> 'LinkTemplate':
+        config = config or cls.reality_config(inbound)
+        port, public_key, server_name, short_id = config
+        params = {
+            'type': 'tcp',
+            'security': 'reality',
+            'pbk': public_key,
+            'fp': 'chrome',
+            'sni': server_name,
+            'sid': short_id,
+            'spx': '/',
+            'flow': 'xtls-rprx-vision'
+        }
+        query = '&'.join([f"{k}={v}" for k, v in params.items()])
+        return cls(port, query, hash(config))
+
+    def fill(self, host: str, client_id: str, email: str) -> str:
+        """Ссылка vless для клиента"""
+        return f"vless://{client_id}@{host}:{self.port}?{self.query}#{email}"
+
 
 class XUIManager:
-    def __init__(self):
-        self.clients = {}
+    def __init__(self, max_concurrency: int = XUI_MAX_CONCURRENCY, timeout: float = XUI_TIMEOUT,
+                 connect_timeout: float = XUI_CONNECT_TIMEOUT):
+        # Авторизованные клиенты py3xui; при смене настроек сервера сбрасывается и снимок inbounds
+        self.clients = SessionManager(on_reset=self.invalidate_snapshot)
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        # Недоступная панель отклоняется сразу, не занимая потоки своего пула
+        self.breakers = CircuitBreakers()
+        # py3xui синхронный: вызовы выполняются в пуле потоков своего сервера,
+        # размер пула - предел одновременных запросов к панели
+        self._executors: Dict[Any, ThreadPoolExecutor] = {}
+        self._server_locks: Dict[Any, threading.Lock] = {}
+        self._snapshots: Dict[Any, InboundSnapshot] = {}
+        # Шаблоны ссылок по (сервер, inbound): создание ключа не требует списка inbounds
+        self._link_templates: Dict[Tuple[Any, int], LinkTemplate] = {}
+        self._lock = threading.Lock()
 
-    async def get_client(self, server_settings: Dict) -> Optional[Api]:
-        """Получение или создание клиента для сервера"""
+    def _executor(self, server_id) -> ThreadPoolExecutor:
+        """Пул потоков сервера"""
+        with self._lock:
+            executor = self._executors.get(server_id)
+            if executor is None:
+                executor = ThreadPoolExecutor(
+                    max_workers=self.max_concurrency,
+                    thread_name_prefix=f"xui-{server_id}"
+                )
+                self._executors[server_id] = executor
+                self._server_locks[server_id] = threading.Lock()
+            return executor
+
+    async def _run(self, server_id, func: Callable, *args, timeout: Optional[float] = None) -> Any:
+        """Выполнение синхронного вызова py3xui в пуле потоков сервера с таймаутом и учетом доступности панели"""
+        deadline = timeout or self.connect_timeout + self.timeout
+        with self.breakers.guard(server_id):
+            loop = asyncio.get_running_loop()
+            future = loop.run_in_executor(self._executor(server_id), functools.partial(func, *args))
+            try:
+                return await asyncio.wait_for(future, deadline)
+            except asyncio.TimeoutError:
+                logger.error(f"Сервер {server_id} не ответил за {deadline} сек.")
+                raise
+
+    def circuit_states(self) -> List[Dict]:
+        """Доступность панелей серверов для администратора"""
+        return self.breakers.states()
+
+    def _connect(self, server_settings: Dict) -> Api:
+        """Создание и авторизация клиента (выполняется в пуле потоков)"""
         server_id = server_settings['id']
-        
-        if server_id in self.clients:
-            return self.clients[server_id]
-        
-        try:
+        # Параллельные первые обращения к серверу авторизуются один раз
+        with self._server_locks[server_id]:
+            client = self.clients.get(server_id, server_settings)
+            if client is not None:
+                return client
+
             logger.info(f"Создание клиента для сервера {server_id}")
             logger.info(f"URL: {server_settings['url']}")
             logger.info(f"Port: {server_settings['port']}")
             logger.info(f"Path: {server_settings['secret_path']}")
-            
+
             url = server_settings['url']
             if not url.startswith('http'):
                 url = f"https://{url}"
             url = f"{url}:{server_settings['port']}/{server_settings['secret_path']}"
-            
+
             logger.info(f"API URL: {url}")
-            
+
             client = Api(
                 url,
                 server_settings['username'],
                 server_settings['password'],
                 use_tls_verify=False
             )
-            
+            _apply_request_timeout(client, (self.connect_timeout, self.timeout))
+
             client.login()
             inbounds = client.inbound.get_list()
             logger.info(f"Подключение успешно. Найдено {len(inbounds)} inbounds")
-            
-            self.clients[server_id] = client
+
+            self._set_snapshot(server_id, InboundSnapshot(inbounds))
+            self.clients.put(server_id, server_settings, client)
+            return client
+
+    def _set_snapshot(self, server_id, snapshot: InboundSnapshot):
+        """Сохранение снимка и обновление шаблонов ссылок его inbounds"""
+        self._snapshots[server_id] = snapshot
+        for inbound in snapshot.inbounds:
+            key = (server_id, inbound.id)
+            try:
+                config = LinkTemplate.reality_config(inbound)
+            except (AttributeError, KeyError, IndexError, TypeError):
+                # Inbound без Reality (например, Shadowsocks) ссылок vless не выдает
+                self._link_templates.pop(key, None)
+                continue
+            template = self._link_templates.get(key)
+            if template is not None and template.config_hash == hash(config):
+                template.created_at = time.monotonic()
+                continue
+            if template is not None:
+                logger.info(f"Настройки Reality inbound {inbound.id} сервера {server_id} изменились, шаблон ссылки обновлен")
+            self._link_templates[key] = LinkTemplate.from_inbound(inbound, config)
+
+    def _link_template(self, server_id, inbound_id: int) -> Optional[LinkTemplate]:
+        """Шаблон ссылки inbound, если он получен не раньше LINK_TEMPLATE_TTL назад"""
+        template = self._link_templates.get((server_id, inbound_id))
+        if template is None or time.monotonic() - template.created_at >= LINK_TEMPLATE_TTL:
+            return None
+        return template
+
+    def _load_snapshot(self, server_id, client: Api, newer_than: float) -> InboundSnapshot:
+        """Загрузка снимка inbounds, если текущий получен не позже newer_than (выполняется в пуле потоков)"""
+        # Одновременные промахи по одному серверу загружают список один раз
+        with self._server_locks[server_id]:
+            snapshot = self._snapshots.get(server_id)
+            if snapshot is not None and snapshot.fetched_at > newer_than:
+                return snapshot
+            snapshot = InboundSnapshot(client.inbound.get_list())
+            self._set_snapshot(server_id, snapshot)
+            logger.debug(f"Снимок inbounds сервера {server_id} обновлен: {len(snapshot.by_uuid)} клиентов")
+            return snapshot
+
+    async def get_client(self, server_settings: Dict) -> Optional[Api]:
+        """Получение или создание клиента для сервера"""
+        server_id = server_settings['id']
+        
+        client = self.clients.get(server_id, server_settings)
+        if client is not None:
             return client
-            
+        
+        try:
+            # Авторизация занимает до двух запросов к панели - только вне цикла событий
+            return await self._run(server_id, self._connect, server_settings)
         except Exception as e:
             logger.error(f"Ошибка при создании клиента X-UI для сервера {server_id}: {e}")
             return None
 
-    def _find_inbound(self, inbounds: list, inbound_id: int) -> Optional[Any]:
-        """Поиск inbound по ID"""
-        return next((i for i in inbounds if i.id == inbound_id), None)
+    async def _call(self, server_settings: Dict, operation: Callable[[Api], Any]) -> Any:
+        """Вызов py3xui с клиентом сервера: при недействительной сессии - повторный вход и один повтор"""
+        server_id = server_settings['id']
+        client = await self.get_client(server_settings)
+        if not client:
+            raise RuntimeError(f"Нет подключения к серверу {server_id}")
+        try:
+            return await self._run(server_id, operation, client)
+        except Exception as e:
+            if not _is_auth_error(e):
+                raise
+            logger.warning(f"Сессия панели сервера {server_id} недействительна, повторный вход")
+            # Параллельный вызов мог уже войти заново - его сессию не сбрасываем
+            self.clients.invalidate(server_id, client)
+
+        client = await self.get_client(server_settings)
+        if not client:
+            raise RuntimeError(f"Нет подключения к серверу {server_id}")
+        return await self._run(server_id, operation, client)
+
+    async def get_snapshot(self, server_settings: Dict,
+                           stale: Optional[InboundSnapshot] = None) -> Optional[InboundSnapshot]:
+        """Снимок inbounds сервера не старше INBOUND_SNAPSHOT_TTL (и новее stale, если он задан)"""
+        client = await self.get_client(server_settings)
+        if not client:
+            return None
+        server_id = server_settings['id']
+        newer_than = time.monotonic() - INBOUND_SNAPSHOT_TTL
+        if stale is not None:
+            newer_than = max(newer_than, stale.fetched_at)
+        snapshot = self._snapshots.get(server_id)
+        if snapshot is not None and snapshot.fetched_at > newer_than:
+            return snapshot
+        return await self._call(server_settings, lambda api: self._load_snapshot(server_id, api, newer_than))
+
+    async def refresh_snapshot(self, server_settings: Dict) -> Optional[InboundSnapshot]:
+        """Снимок inbounds, загруженный заново (или параллельным вызовом уже после текущего)"""
+        return await self.get_snapshot(server_settings, stale=self._snapshots.get(server_settings['id']))
+
+    def inbound_client_counts(self, server_id) -> Dict[int, int]:
+        """Число клиентов в inbounds сервера по уже загруженному снимку (без запроса к панели)"""
+        snapshot = self._snapshots.get(server_id)
+        if snapshot is None:
+            return {}
+        return {inbound.id: len(InboundSnapshot._clients(inbound)) for inbound in snapshot.inbounds}
+
+    async def get_client_traffic(self, server_settings: Dict) -> Optional[Dict[str, Tuple[int, int]]]:
+        """Счетчики трафика клиентов сервера {email: (up, down)} одним запросом списка inbounds"""
+        server_id = server_settings['id']
+        try:
+            # Счетчики нужны свежие: список загружается заново и заодно обновляет снимок
+            snapshot = await self.refresh_snapshot(server_settings)
+        except Exception as e:
+            logger.error(f"Ошибка при получении трафика клиентов сервера {server_id}: {e}")
+            return None
+        if snapshot is None:
+            return None
+        traffic = {}
+        for inbound in snapshot.inbounds:
+            for stats in getattr(inbound, 'client_stats', None) or []:
+                if stats.email:
+                    traffic[stats.email] = (stats.up or 0, stats.down or 0)
+        return traffic
+
+    def invalidate_snapshot(self, server_id):
+        """Сброс снимка inbounds сервера"""
+        self._snapshots.pop(server_id, None)
+
+    async def get_inbounds(self, server_settings: Dict) -> Optional[list]:
+        """Список inbounds сервера"""
+        snapshot = await self.get_snapshot(server_settings)
+        return snapshot.inbounds if snapshot else None
+
+    async def get_inbound(self, server_settings: Dict, inbound_id: int) -> Optional[Any]:
+        """Inbound сервера по ID"""
+        snapshot = await self.get_snapshot(server_settings)
+        if snapshot is None:
+            return None
+        inbound = snapshot.by_id.get(inbound_id)
+        if inbound is None:
+            snapshot = await self.get_snapshot(server_settings, stale=snapshot)
+            inbound = snapshot.by_id.get(inbound_id) if snapshot else None
+        return inbound
+
+    async def find_client(self, server_settings: Dict, client_id: str,
+                          email: Optional[str] = None) -> Optional[Tuple[Any, Client]]:
+        """Поиск клиента по UUID или email: (inbound, клиент) или None"""
+        snapshot = await self.get_snapshot(server_settings)
+        if snapshot is None:
+            return None
+        found = snapshot.find(client_id, email)
+        if found is None:
+            # Клиент мог быть добавлен другим процессом (бот/веб-приложение) после снимка
+            snapshot = await self.get_snapshot(server_settings, stale=snapshot)
+            found = snapshot.find(client_id, email) if snapshot else None
+        return found
+
+    async def update_client(self, server_settings: Dict, target_client: Client):
+        """Обновление клиента на сервере"""
+        server_id = server_settings['id']
+        try:
+            await self._call(server_settings, lambda api: api.client.update(target_client.id, target_client))
+        except Exception:
+            # Клиент из снимка уже изменен вызывающим кодом, а на сервере - неизвестно
+            self.invalidate_snapshot(server_id)
+            raise
+        snapshot = self._snapshots.get(server_id)
+        if snapshot is not None:
+            snapshot.update(target_client)
 
     async def create_trial_user(self, server_settings: Dict, trial_settings: Dict, telegram_id: int) -> Optional[str]:
         """Создание пользователя"""
-        try:
-            logger.info(f"Начало создания пользователя для telegram_id: {telegram_id}")
-            
-            client = await self.get_client(server_settings)
-            if not client:
-                logger.error(f"Не удалось получить клиента для сервера {server_settings['id']}")
-                return None
+        logger.info(f"Начало создания пользователя для telegram_id: {telegram_id}")
+        links = await self.create_users_bulk(server_settings, [(telegram_id, trial_settings['left_day'])])
+        return links[0]
 
-            end_time = datetime.now() + timedelta(days=trial_settings['left_day'])
-            
-            inbound_id = server_settings.get('inbound_id', 1)
-            
+    @staticmethod
+    def unique_email(telegram_id: int, taken) -> str:
+        """Email клиента, не занятый в inbound и в текущей пачке"""
+        while True:
             unique_id = ''.join([str(random.randint(0, 9)) for _ in range(5)])
             email = f"@TOR_VPNbot ⚡ | tg_{telegram_id}@{unique_id}"
-            
-            logger.info(f"Создание пользователя в inbound {inbound_id}")
-            logger.info(f"Email: {email}")
-            logger.info(f"Дата окончания: {end_time}")
+            if email not in taken:
+                return email
 
-            inbounds = client.inbound.get_list()
-            logger.info(f"Подключение успешно. Найдено {len(inbounds)} inbounds")
-            
-            inbound = self._find_inbound(inbounds, inbound_id)
+    @staticmethod
+    def _link_host(server_settings: Dict) -> str:
+        """Адрес сервера в ссылке vless"""
+        host = server_settings['url']
+        if not host.startswith('http'):
+            host = f"https://{host}"
+        return host.split('://')[1]
+
+    async def client_link(self, server_settings: Dict, inbound_id: int, client_id: str, email: str) -> Optional[str]:
+        """Ссылка vless для клиента inbound по шаблону (список inbounds загружается, только если шаблона нет)"""
+        server_id = server_settings['id']
+        template = self._link_template(server_id, inbound_id)
+        if template is None:
+            inbound = await self.get_inbound(server_settings, inbound_id)
             if not inbound:
-                logger.error(f"Inbound {inbound_id} не найден на сервере {server_settings['id']}")
+                logger.error(f"Inbound {inbound_id} не найден на сервере {server_id}")
                 return None
-            
-            logger.debug(f"Текущий inbound: {inbound}")
+            template = self._link_template(server_id, inbound_id) or LinkTemplate.from_inbound(inbound)
+        return template.fill(self._link_host(server_settings), client_id, email)
+
+    async def create_users_bulk(self, server_settings: Dict, grants: List[Tuple[int, int]]) -> List[Optional[str]]:
+        """Создание клиентов по списку (telegram_id, дней): ссылки vless в том же порядке, None - при ошибке"""
+        links: List[Optional[str]] = [None] * len(grants)
+        if not grants:
+            return links
+
+        server_id = server_settings['id']
+        try:
+            client = await self.get_client(server_settings)
+            if not client:
+                logger.error(f"Не удалось получить клиента для сервера {server_id}")
+                return links
+
+            inbound_id = server_settings.get('inbound_id', 1)
+            # Параметры ссылки берутся из шаблона; список inbounds загружается, только если его нет
+            template = self._link_template(server_id, inbound_id)
+            if template is None:
+                inbound = await self.get_inbound(server_settings, inbound_id)
+                if not inbound:
+                    logger.error(f"Inbound {inbound_id} не найден на сервере {server_id}")
+                    return links
+                template = self._link_template(server_id, inbound_id) or LinkTemplate.from_inbound(inbound)
+            host = self._link_host(server_settings)
 
-            client_id = str(uuid.uuid4())
-            new_client = Client(
+            # Панель отклоняет весь addClient, если хотя бы один email уже занят
+            snapshot = self._snapshots.get(server_id)
+            taken = set(snapshot.by_email) if snapshot is not None else set()
+            now = datetime.now()
+            new_clients = []
+            for telegram_id, days in grants:
+                email = self.unique_email(telegram_id, taken)
+                taken.add(email)
+                new_clients.append(Client(
+                    id=str(uuid.uuid4()),
+                    email=email,
+                    enable=True,
+                    flow="xtls-rprx-vision",
+                    tg_id=str(telegram_id),
+                    total_gb=0,
+                    expiry_time=int((now + timedelta(days=days)).timestamp() * 1000),
+                    limit_ip=1,
+                    reset=0,
+                    password="",
+                    method="",
+                    sub_id="",
+                    up=0,
+                    down=0,
+                    total=0,
+                    inbound_id=inbound_id
+                ))
+        except Exception as e:
+            logger.error(f"Ошибка при подготовке клиентов для сервера {server_id}: {e}")
+            return links
+
+        logger.info(f"Создание {len(new_clients)} клиентов в inbound {inbound_id} сервера {server_id}")
+        for start in range(0, len(new_clients), XUI_BULK_CHUNK):
+            chunk = new_clients[start:start + XUI_BULK_CHUNK]
+            try:
+                await self._call(server_settings, lambda api: api.client.add(inbound_id, chunk))
+            except asyncio.TimeoutError:
+                # Запрос мог дойти до панели: состояние inbound неизвестно
+                self.invalidate_snapshot(server_id)
+                logger.error(f"Таймаут при добавлении клиентов {start + 1}-{start + len(chunk)} на сервер {server_id}")
+                continue
+            except Exception as e:
+                logger.error(f"Ошибка при добавлении клиентов {start + 1}-{start + len(chunk)} на сервер {server_id}: {e}")
+                continue
+
+            snapshot = self._snapshots.get(server_id)
+            inbound = snapshot.by_id.get(inbound_id) if snapshot is not None else None
+            for offset, new_client in enumerate(chunk):
+                if inbound is not None:
+                    snapshot.add(inbound, new_client)
+                links[start + offset] = template.fill(host, new_client.id, new_client.email)
+
+        created = sum(1 for link in links if link)
+        if len(grants) == 1:
+            if created:
+                logger.info(f"Ссылка для клиента успешно сгенерирована: {links[0]}")
+            else:
+                logger.error(f"Не удалось создать клиента для пользователя {grants[0][0]}")
+        else:
+            logger.info(f"Создано клиентов на сервере {server_id}: {created} из {len(grants)}")
+        return links
+
+    async def restore_clients(self, server_settings: Dict, inbound_id: int,
+                              clients: List[Tuple[str, str, Any, int]]) -> int:
+        """Повторное создание клиентов (UUID, email, telegram_id, срок в мс) с прежними ссылками, возвращает число созданных"""
+        server_id = server_settings['id']
+        new_clients = [
+            Client(
                 id=client_id,
                 email=email,
                 enable=True,
                 flow="xtls-rprx-vision",
-                tg_id=str(telegram_id),
+                tg_id=str(telegram_id or ''),
                 total_gb=0,
-                expiry_time=int(end_time.timestamp() * 1000),
+                expiry_time=expiry_time,
                 limit_ip=1,
                 reset=0,
                 password="",
@@ -103,73 +554,109 @@ class XUIManager:
                 total=0,
                 inbound_id=inbound_id
             )
+            for client_id, email, telegram_id, expiry_time in clients
+        ]
 
-            success = False
+        restored = 0
+        for start in range(0, len(new_clients), XUI_BULK_CHUNK):
+            chunk = new_clients[start:start + XUI_BULK_CHUNK]
             try:
-                logger.debug("Попытка создания клиента первым способом...")
-                client.client.add(inbound_id, new_client)
-                logger.info("Клиент успешно создан первым способом")
-                success = True
+                await self._call(server_settings, lambda api: api.client.add(inbound_id, chunk))
             except Exception as e:
-                logger.debug(f"Ошибка при добавлении клиента первым способом: {e}")
-                try:
-                    logger.debug("Попытка создания клиента вторым способом...")
-                    client.client.add(inbound_id, [new_client])
-                    logger.info("Клиент успешно создан вторым способом")
-                    success = True
-                except Exception as e:
-                    logger.error(f"Ошибка при добавлении клиента вторым способом: {e}")
-
-            if not success:
-                logger.error(f"Не удалось создать клиента для пользователя {telegram_id}")
-                return None
+                # При таймауте запрос мог дойти до панели - следующий снимок покажет результат
+                self.invalidate_snapshot(server_id)
+                logger.error(f"Ошибка при восстановлении клиентов в inbound {inbound_id} сервера {server_id}: {e}")
+                continue
+            restored += len(chunk)
+            snapshot = self._snapshots.get(server_id)
+            inbound = snapshot.by_id.get(inbound_id) if snapshot is not None else None
+            if inbound is not None:
+                for new_client in chunk:
+                    snapshot.add(inbound, new_client)
+        return restored
 
-            logger.debug("Начало формирования ссылки для подключения")
-            host = server_settings['url']
-            if not host.startswith('http'):
-                host = f"https://{host}"
-            host = host.split('://')[1]
-
-            reality_settings = inbound.stream_settings.reality_settings
-            
-            params = {
-                'type': 'tcp',
-                'security': 'reality',
-                'pbk': reality_settings['settings']['publicKey'],
-                'fp': 'chrome',
-                'sni': reality_settings['serverNames'][0],
-                'sid': reality_settings['shortIds'][0],
-                'spx': '/',
-                'flow': 'xtls-rprx-vision'
-            }
-            
-            params_str = '&'.join([f"{k}={v}" for k, v in params.items()])
-            
-            link = f"vless://{client_id}@{host}:{inbound.port}?{params_str}#{email}"
-            
-            logger.info(f"Ссылка для клиента успешно сгенерирована: {link}")
-            return link
+    async def set_clients_expiry(self, server_settings: Dict, updates: List[Tuple[Client, int]]) -> int:
+        """Установка срока (мс) и включение клиентов снимка, возвращает число обновленных"""
+        server_id = server_settings['id']
 
-        except Exception as e:
-            logger.error(f"Критическая ошибка при создании пользователя {telegram_id}: {e}")
-            logger.exception("Полный стек ошибки:")
-            return None
+        async def update(target_client: Client, expiry_time: int) -> bool:
+            target_client.expiry_time = expiry_time
+            target_client.enable = True
+            try:
+                await self.update_client(server_settings, target_client)
+                return True
+            except Exception as e:
+                logger.error(f"Ошибка при обновлении срока клиента {target_client.email} на сервере {server_id}: {e}")
+                return False
 
-    async def delete_user(self, server_settings: Dict, telegram_id: int) -> bool:
-        """Удаление пользователя"""
-        try:
-            client = await self.get_client(server_settings)
-            if not client:
+        # Панель обновляет клиентов по одному; параллельность ограничена пулом потоков сервера
+        results = await asyncio.gather(*(update(client, expiry_time) for client, expiry_time in updates))
+        return sum(results)
+
+    @staticmethod
+    def parse_link(link: str) -> Tuple[Optional[str], Optional[str]]:
+        """UUID и email клиента из ссылки vless (user_subscription.vless)"""
+        client_id = email = None
+        if '://' in link and '@' in link:
+            client_id = link.split('://', 1)[1].split('@', 1)[0]
+        if '#' in link:
+            email = unquote(link.split('#', 1)[1])
+        return client_id, email
+
+    async def _delete_clients(self, server_settings: Dict, targets: List[Tuple[int, str, Optional[str]]]) -> List[bool]:
+        """Удаление клиентов (inbound, UUID, email) через delClient, результаты в том же порядке"""
+        server_id = server_settings['id']
+
+        async def delete(inbound_id: int, client_id: str, email: Optional[str]) -> bool:
+            try:
+                await self._call(server_settings, lambda api: api.client.delete(inbound_id, client_id))
+            except Exception as e:
+                logger.error(f"Ошибка при удалении клиента {email or client_id} с сервера {server_id}: {e}")
                 return False
+            snapshot = self._snapshots.get(server_id)
+            if snapshot is not None:
+                snapshot.discard(client_id=client_id)
+            logger.info(f"Клиент {email or client_id} удален из inbound {inbound_id} сервера {server_id}")
+            return True
 
-            inbound_id = server_settings.get('inbound_id', 1)
-            email = f"tg_{telegram_id}_trial"
-            
-            success = client.client.remove(inbound_id, email)
-            return success
+        # Каждый клиент удаляется своим delClient: панель меняет только его запись, не пересобирая inbound,
+        # поэтому одновременные добавления клиентов не теряются. Параллельность ограничена пулом потоков сервера
+        return list(await asyncio.gather(*(delete(*target) for target in targets)))
 
-        except Exception as e:
-            logger.error(f"Ошибка при удалении пользователя {telegram_id}: {e}")
-            return False
+    async def delete_clients_bulk(self, server_settings: Dict,
+                                  keys: List[Tuple[str, Optional[int]]]) -> List[bool]:
+        """Удаление клиентов по ссылке vless и inbound подписки (user_subscription.inbound_id): результаты в том же порядке"""
+        results = [False] * len(keys)
+        server_id = server_settings['id']
+        default_inbound_id = server_settings.get('inbound_id') or 1
+
+        # Ради удаления список inbounds не скачивается: снимок используется, только если он уже загружен.
+        # Иначе клиент удаляется по UUID из ссылки в inbound подписки
+        snapshot = self._snapshots.get(server_id)
+        if snapshot is not None and snapshot.fetched_at <= time.monotonic() - INBOUND_SNAPSHOT_TTL:
+            snapshot = None
+
+        positions = []
+        targets = []
+        for index, (link, inbound_id) in enumerate(keys):
+            client_id, email = self.parse_link(link)
+            if not client_id:
+                logger.error(f"В ссылке {link} нет UUID клиента")
+                continue
+            found = snapshot.find(client_id, email) if snapshot is not None else None
+            if found is not None:
+                inbound, client = found
+                targets.append((inbound.id, client.id, client.email))
+            else:
+                targets.append((inbound_id or default_inbound_id, client_id, email))
+            positions.append(index)
+
+        for index, deleted in zip(positions, await self._delete_clients(server_settings, targets)):
+            results[index] = deleted
+        return results
+
+    async def delete_client_by_link(self, server_settings: Dict, link: str, inbound_id: Optional[int] = None) -> bool:
+        """Удаление одного клиента по ссылке vless"""
+        return (await self.delete_clients_bulk(server_settings, [(link, inbound_id)]))[0]
 
 xui_manager = XUIManager()
@@ -0,0 +1,162 @@
+import asyncio
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+import aiohttp
+import requests
+from loguru import logger
+
+# Подряд неудачных обращений, после которых панель считается недоступной
+CIRCUIT_FAILURE_THRESHOLD = 3
+
+# Пауза перед пробным запросом к недоступной панели
+CIRCUIT_RESET_TIMEOUT = 30.0
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitOpenError(RuntimeError):
+    """Панель сервера недоступна: запросы к ней временно не выполняются"""
+
+
+def is_panel_failure(error: BaseException) -> bool:
+    """Ошибка означает недоступность панели, а не отказ в конкретной операции"""
+    if isinstance(error, requests.HTTPError) and error.response is not None:
+        return error.response.status_code >= 500
+    return isinstance(error, (
+        asyncio.TimeoutError, TimeoutError, ConnectionError,
+        requests.ConnectionError, requests.Timeout,
+        aiohttp.ClientConnectionError, aiohttp.ServerTimeoutError,
+    ))
+
+
+class CallOutcome:
+    """Итог одного обращения к панели, если он не виден по исключению (например, ответ 5xx)"""
+
+    __slots__ = ('error',)
+
+    def __init__(self):
+        self.error: Optional[str] = None
+
+    def fail(self, reason: str):
+        self.error = reason
+
+
+class CircuitBreaker:
+    """Состояние доступности панели одного сервера"""
+
+    def __init__(self, server_id, failure_threshold: int, reset_timeout: float):
+        self.server_id = server_id
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.last_error: Optional[str] = None
+        self._probing = False
+        # Веб-приложение обращается к панелям из нескольких потоков Flask
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """Можно ли обращаться к панели; после паузы пропускается один пробный запрос"""
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = HALF_OPEN
+            if self.state == HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def success(self):
+        with self._lock:
+            if self.state != CLOSED:
+                logger.info(f"Панель сервера {self.server_id} снова доступна")
+            self.state = CLOSED
+            self.failures = 0
+            self._probing = False
+
+    def failure(self, reason: str):
+        with self._lock:
+            self.failures += 1
+            self.last_error = reason
+            self._probing = False
+            if self.state == HALF_OPEN or (self.state == CLOSED and self.failures >= self.failure_threshold):
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+                logger.error(
+                    f"Панель сервера {self.server_id} недоступна ({reason}), "
+                    f"запросы приостановлены на {self.reset_timeout:.0f} сек."
+                )
+
+    def release(self):
+        """Завершение пробного запроса без результата (вызов отменен)"""
+        with self._lock:
+            self._probing = False
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            retry_in = None
+            if self.state == OPEN:
+                retry_in = max(0.0, round(self.reset_timeout - (time.monotonic() - self.opened_at), 1))
+            return {
+                'server_id': self.server_id,
+                'state': self.state,
+                'failures': self.failures,
+                'last_error': self.last_error,
+                'retry_in': retry_in,
+            }
+
+
+class CircuitBreakers:
+    """Автоматы доступности панелей по серверам"""
+
+    def __init__(self, failure_threshold: int = CIRCUIT_FAILURE_THRESHOLD,
+                 reset_timeout: float = CIRCUIT_RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._breakers: Dict[Any, CircuitBreaker] = {}
+        self._lock = threading.Lock()
+
+    def get(self, server_id) -> CircuitBreaker:
+        with self._lock:
+            breaker = self._breakers.get(server_id)
+            if breaker is None:
+                breaker = CircuitBreaker(server_id, self.failure_threshold, self.reset_timeout)
+                self._breakers[server_id] = breaker
+            return breaker
+
+    @contextmanager
+    def guard(self, server_id) -> Iterator[CallOutcome]:
+        """Обращение к панели: сразу CircuitOpenError, если панель недоступна, иначе учет результата"""
+        breaker = self.get(server_id)
+        if not breaker.allow():
+            raise CircuitOpenError(f"Панель сервера {server_id} временно недоступна")
+        outcome = CallOutcome()
+        try:
+            yield outcome
+        except Exception as e:
+            if is_panel_failure(e):
+                breaker.failure(f"{type(e).__name__}: {e}")
+            else:
+                # Панель ответила, операция не удалась по другой причине
+                breaker.success()
+            raise
+        except BaseException:
+            breaker.release()
+            raise
+        if outcome.error:
+            breaker.failure(outcome.error)
+        else:
+            breaker.success()
+
+    def states(self) -> List[Dict[str, Any]]:
+        """Состояние автоматов всех серверов (для администратора)"""
+        with self._lock:
+            breakers = list(self._breakers.values())
+        return [breaker.to_dict() for breaker in breakers]
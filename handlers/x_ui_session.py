@@ -0,0 +1,74 @@
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from loguru import logger
+
+# Сессия панели 3x-ui живет около часа: обновляем ее заранее, а не после отказа
+SESSION_MAX_AGE = 50 * 60
+
+# Ответы панели на запрос с недействительной сессией: 3x-ui либо отвечает 401/404,
+# либо перенаправляет на страницу входа
+AUTH_FAILURE_STATUSES = (401, 403, 404)
+
+
+def is_auth_failure(status: int) -> bool:
+    """Ответ панели означает, что сессия недействительна"""
+    return status in AUTH_FAILURE_STATUSES or 300 <= status < 400
+
+
+def settings_fingerprint(server_settings: Dict) -> Tuple:
+    """Параметры сервера, от которых зависит сессия"""
+    return tuple(server_settings.get(key) for key in ('url', 'port', 'secret_path', 'username', 'password'))
+
+
+class PanelSession:
+    """Авторизованная сессия панели: клиент или cookie, время входа и параметры сервера"""
+
+    def __init__(self, value: Any, fingerprint: Tuple):
+        self.value = value
+        self.fingerprint = fingerprint
+        self.created_at = time.monotonic()
+
+    def age(self) -> float:
+        return time.monotonic() - self.created_at
+
+
+class SessionManager:
+    """Кеш сессий панелей по серверам с обновлением по возрасту и при смене настроек сервера"""
+
+    def __init__(self, max_age: float = SESSION_MAX_AGE,
+                 on_reset: Optional[Callable[[Any], None]] = None):
+        self.max_age = max_age
+        # Вызывается, когда у сервера сменились адрес или учетные данные
+        self.on_reset = on_reset
+        self._sessions: Dict[Any, PanelSession] = {}
+
+    def get(self, server_id, server_settings: Dict) -> Optional[Any]:
+        """Действующая сессия сервера или None, если ее нужно получить заново"""
+        session = self._sessions.get(server_id)
+        if session is None:
+            return None
+        if session.fingerprint != settings_fingerprint(server_settings):
+            logger.info(f"Настройки сервера {server_id} изменились, сессия панели сброшена")
+            self.invalidate(server_id)
+            if self.on_reset:
+                self.on_reset(server_id)
+            return None
+        if session.age() >= self.max_age:
+            logger.info(f"Сессия панели сервера {server_id} устарела, выполняется повторный вход")
+            self.invalidate(server_id)
+            return None
+        return session.value
+
+    def put(self, server_id, server_settings: Dict, value: Any):
+        """Сохранение новой сессии сервера"""
+        self._sessions[server_id] = PanelSession(value, settings_fingerprint(server_settings))
+
+    def invalidate(self, server_id, value: Any = None):
+        """Сброс сессии сервера (только если это все еще value, когда он задан)"""
+        session = self._sessions.get(server_id)
+        if session is not None and (value is None or session.value is value):
+            del self._sessions[server_id]
+
+    def __contains__(self, server_id) -> bool:
+        return server_id in self._sessions
@@ -1,6 +1,9 @@
 from loguru import logger
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, Awaitable, List, Tuple
 import aiohttp
+import asyncio
+from yarl import URL
+from urllib.parse import unquote
 from datetime import datetime, timedelta
 import uuid
 import random
@@ -9,13 +12,82 @@ import os
 import secrets
 import json
 import string
+from handlers.x_ui_session import SessionManager, is_auth_failure
+from handlers.x_ui_circuit import CircuitBreakers
+
+# Параметры пула соединений к одной панели
+PANEL_CONNECTION_LIMIT = 8
+PANEL_KEEPALIVE_TIMEOUT = 60
+PANEL_DNS_CACHE_TTL = 300
+PANEL_REQUEST_TIMEOUT = 15
+PANEL_CONNECT_TIMEOUT = 5
+
+# Клиентов в одном запросе addClient при массовом создании
+SS_BULK_CHUNK = 100
 
 class XUIShadowsocksManager:
     def __init__(self):
-        self.sessions = {}  
+        self.sessions = SessionManager()
+        # Недоступная панель отклоняется сразу, без ожидания таймаутов
+        self.breakers = CircuitBreakers()
+        # Сессии aiohttp по (цикл событий, адрес панели): сессия привязана к своему циклу,
+        # а веб-приложение запускает новый цикл на каждый запрос
+        self._http: Dict[Tuple[int, str], Tuple[asyncio.AbstractEventLoop, aiohttp.ClientSession]] = {}
+
+    def _http_session(self, panel_url: str) -> aiohttp.ClientSession:
+        """Долгоживущая сессия aiohttp для панели в текущем цикле событий"""
+        loop = asyncio.get_running_loop()
+        for key, (owner, _) in list(self._http.items()):
+            if owner.is_closed():
+                # Цикл завершился без close(): его соединения уже не использовать
+                logger.warning(f"Сессия панели {key[1]} не была закрыта до завершения цикла событий")
+                del self._http[key]
+
+        key = (id(loop), panel_url)
+        entry = self._http.get(key)
+        if entry is not None and entry[0] is loop and not entry[1].closed:
+            return entry[1]
 
-    async def _login(self, server_settings: Dict) -> Optional[str]:
-        """Авторизация на сервере и получение токена сессии"""
+        connector = aiohttp.TCPConnector(
+            limit_per_host=PANEL_CONNECTION_LIMIT,
+            keepalive_timeout=PANEL_KEEPALIVE_TIMEOUT,
+            ttl_dns_cache=PANEL_DNS_CACHE_TTL,
+            ssl=False
+        )
+        session = aiohttp.ClientSession(
+            connector=connector,
+            # unsafe: панели часто доступны по IP, а по умолчанию cookie для IP не сохраняются
+            cookie_jar=aiohttp.CookieJar(unsafe=True),
+            timeout=aiohttp.ClientTimeout(
+                total=PANEL_CONNECT_TIMEOUT + PANEL_REQUEST_TIMEOUT,
+                sock_connect=PANEL_CONNECT_TIMEOUT,
+                sock_read=PANEL_REQUEST_TIMEOUT
+            )
+        )
+        self._http[key] = (loop, session)
+        return session
+
+    def circuit_states(self) -> List[Dict]:
+        """Доступность панелей серверов для администратора"""
+        return self.breakers.states()
+
+    async def close(self):
+        """Закрытие сессий aiohttp текущего цикла событий"""
+        loop = asyncio.get_running_loop()
+        for key, (owner, session) in list(self._http.items()):
+            if owner is loop:
+                del self._http[key]
+                await session.close()
+
+    async def closing(self, coro: Awaitable) -> Any:
+        """Выполнение корутины с закрытием сессий панелей в конце (для каждого asyncio.run веб-приложения)"""
+        try:
+            return await coro
+        finally:
+            await self.close()
+
+    async def _login(self, server_settings: Dict) -> Optional[Dict]:
+        """Авторизация на сервере и сохранение сессии"""
         server_id = server_settings.get('server_id', server_settings.get('id'))
         
         try:
@@ -37,38 +109,42 @@ class XUIShadowsocksManager:
                 'password': server_settings['password']
             }
             
-            async with aiohttp.ClientSession() as session:
+            session = self._http_session(base_url)
+            with self.breakers.guard(server_id) as outcome:
                 async with session.post(
                     login_url,
                     json=login_data,
                     headers={
                         'Content-Type': 'application/json',
                         'Accept': 'application/json'
-                    },
-                    ssl=False
+                    }
                 ) as response:
                     response_text = await response.text()
-                    logger.debug(f"Ответ сервера: {response.status}, {response_text}")
-                    
-                    if response.status != 200:
-                        logger.error(f"Ошибка авторизации на сервере {server_id}: {response.status}")
-                        return None
-                    
-                    cookies = response.cookies
-                    logger.debug(f"Полученные cookies: {cookies}")
-                    session_token = cookies.get('session') or cookies.get('3x-ui')
-                    if not session_token:
-                        logger.error(f"Не удалось получить токен сессии для сервера {server_id}")
-                        return None
-                    
-                    self.sessions[server_id] = {
-                        'token': session_token.value,
-                        'base_url': f"{base_url}/{server_settings['secret_path']}",
-                        'cookie_name': 'session' if cookies.get('session') else '3x-ui'
-                    }
-                    
-                    logger.info(f"Успешная авторизация на сервере {server_id}")
-                    return session_token.value
+                if response.status >= 500:
+                    outcome.fail(f"HTTP {response.status}")
+            logger.debug(f"Ответ сервера: {response.status}, {response_text}")
+            
+            if response.status != 200:
+                logger.error(f"Ошибка авторизации на сервере {server_id}: {response.status}")
+                return None
+            
+            cookies = response.cookies
+            logger.debug(f"Полученные cookies: {cookies}")
+            session_token = cookies.get('session') or cookies.get('3x-ui')
+            if not session_token:
+                logger.error(f"Не удалось получить токен сессии для сервера {server_id}")
+                return None
+            
+            session_data = {
+                'token': session_token.value,
+                'panel_url': base_url,
+                'base_url': f"{base_url}/{server_settings['secret_path']}",
+                'cookie_name': 'session' if cookies.get('session') else '3x-ui'
+            }
+            self.sessions.put(server_id, server_settings, session_data)
+            
+            logger.info(f"Успешная авторизация на сервере {server_id}")
+            return session_data
             
         except Exception as e:
             logger.error(f"Ошибка при авторизации на сервере {server_id}: {e}")
@@ -78,41 +154,64 @@ class XUIShadowsocksManager:
         """Получение или создание сессии для сервера"""
         server_id = server_settings.get('server_id', server_settings.get('id'))
         
-        if server_id in self.sessions:
-            return self.sessions[server_id]
+        session_data = self.sessions.get(server_id, server_settings)
+        if session_data is not None:
+            return session_data
         
-        token = await self._login(server_settings)
-        if not token:
-            return None
+        return await self._login(server_settings)
+
+    async def _request(self, server_settings: Dict, method: str, path: str,
+                       headers: Optional[Dict] = None, **kwargs) -> Tuple[int, str]:
+        """Запрос к API панели: при недействительной сессии - повторный вход и один повтор"""
+        server_id = server_settings.get('server_id', server_settings.get('id'))
         
-        return self.sessions[server_id]
+        for attempt in range(2):
+            session_data = await self._get_session(server_settings)
+            if not session_data:
+                raise Exception(f"Не удалось получить сессию для сервера {server_id}")
+            
+            session = self._http_session(session_data['panel_url'])
+            # Cookie сессии хранится в cookie jar; вход мог выполняться в другом цикле событий
+            session.cookie_jar.update_cookies(
+                {session_data['cookie_name']: session_data['token']},
+                URL(session_data['panel_url'])
+            )
+            
+            # Без перехода по редиректу: перенаправление на страницу входа - признак истекшей сессии
+            with self.breakers.guard(server_id) as outcome:
+                async with session.request(
+                    method,
+                    f"{session_data['base_url']}{path}",
+                    headers={'Accept': 'application/json', **(headers or {})},
+                    allow_redirects=False,
+                    **kwargs
+                ) as response:
+                    status = response.status
+                    text = await response.text()
+                if status >= 500:
+                    outcome.fail(f"HTTP {status}")
+            
+            if attempt == 0 and is_auth_failure(status):
+                logger.warning(f"Сессия панели сервера {server_id} недействительна ({status}), повторный вход")
+                self.sessions.invalidate(server_id, session_data)
+                continue
+            
+            return status, text
 
     async def _get_inbounds(self, server_settings: Dict) -> Optional[List]:
         """Получение списка inbounds с сервера"""
-        session_data = await self._get_session(server_settings)
-        if not session_data:
-            return None
-        
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(
-                    f"{session_data['base_url']}/panel/api/inbounds/list",
-                    headers={
-                        'Accept': 'application/json',
-                        'Cookie': f"{session_data['cookie_name']}={session_data['token']}"
-                    },
-                    ssl=False
-                ) as response:
-                    if response.status != 200:
-                        logger.error(f"Ошибка получения списка inbounds: {response.status}")
-                        return None
-                    
-                    data = await response.json()
-                    if not data.get('success'):
-                        logger.error(f"Ошибка в ответе API: {data.get('msg')}")
-                        return None
-                    
-                    return data.get('obj', [])
+            status, text = await self._request(server_settings, 'GET', '/panel/api/inbounds/list')
+            if status != 200:
+                logger.error(f"Ошибка получения списка inbounds: {status}")
+                return None
+            
+            data = json.loads(text)
+            if not data.get('success'):
+                logger.error(f"Ошибка в ответе API: {data.get('msg')}")
+                return None
+            
+            return data.get('obj', [])
             
         except Exception as e:
             logger.error(f"Ошибка при получении списка inbounds: {e}")
@@ -120,35 +219,35 @@ class XUIShadowsocksManager:
 
     async def _get_inbound(self, server_settings: Dict, inbound_id: int) -> Optional[Dict]:
         """Получение информации о конкретном inbound"""
-        session_data = await self._get_session(server_settings)
-        if not session_data:
-            return None
-        
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(
-                    f"{session_data['base_url']}/panel/api/inbounds/get/{inbound_id}",
-                    headers={
-                        'Accept': 'application/json',
-                        'Cookie': f"{session_data['cookie_name']}={session_data['token']}"
-                    },
-                    ssl=False
-                ) as response:
-                    if response.status != 200:
-                        logger.error(f"Ошибка получения информации об inbound {inbound_id}: {response.status}")
-                        return None
-                    
-                    data = await response.json()
-                    if not data.get('success'):
-                        logger.error(f"Ошибка в ответе API: {data.get('msg')}")
-                        return None
-                    
-                    return data.get('obj')
+            status, text = await self._request(server_settings, 'GET', f"/panel/api/inbounds/get/{inbound_id}")
+            if status != 200:
+                logger.error(f"Ошибка получения информации об inbound {inbound_id}: {status}")
+                return None
+            
+            data = json.loads(text)
+            if not data.get('success'):
+                logger.error(f"Ошибка в ответе API: {data.get('msg')}")
+                return None
+            
+            return data.get('obj')
             
         except Exception as e:
             logger.error(f"Ошибка при получении информации об inbound {inbound_id}: {e}")
             return None
 
+    async def get_client_traffic(self, server_settings: Dict, inbound_ids: List[int]) -> Optional[Dict[str, Tuple[int, int]]]:
+        """Счетчики трафика клиентов {email: (up, down)}: один запрос на inbound, inbounds - параллельно"""
+        inbounds = await asyncio.gather(*(self._get_inbound(server_settings, inbound_id) for inbound_id in inbound_ids))
+        if inbound_ids and all(inbound is None for inbound in inbounds):
+            return None
+        traffic = {}
+        for inbound in inbounds:
+            for stats in (inbound or {}).get('clientStats') or []:
+                if stats.get('email'):
+                    traffic[stats['email']] = (stats.get('up') or 0, stats.get('down') or 0)
+        return traffic
+
     def _generate_ss_password(self) -> str:
         """Генерация пароля для Shadowsocks клиента"""
         random_bytes = secrets.token_bytes(32)
@@ -156,65 +255,68 @@ class XUIShadowsocksManager:
 
     async def create_ss_user(self, server_settings: Dict, trial_settings: Dict, telegram_id: int) -> Optional[str]:
         """Создание пользователя Shadowsocks"""
-        try:
-            logger.info(f"Начало создания SS пользователя для telegram_id: {telegram_id}")
-            
-            server_id = server_settings.get('server_id', server_settings.get('id'))
-            logger.debug(f"Используем ID сервера: {server_id}")
-            
-            session_data = await self._get_session(server_settings)
-            if not session_data:
-                logger.error(f"Не удалось получить сессию для сервера {server_id}")
-                return None
+        logger.info(f"Начало создания SS пользователя для telegram_id: {telegram_id}")
+        links = await self.create_ss_users_bulk(server_settings, [(telegram_id, trial_settings['left_day'])])
+        return links[0]
 
-            end_time = datetime.now() + timedelta(days=trial_settings['left_day'])
-            
-            inbound_id = server_settings.get('inbound_id', 1)
-            
-            email = f"tg_{telegram_id}@{random.randint(10000, 99999)}"
-            
+    @staticmethod
+    def _ss_link(server_settings: Dict, inbound: Dict, full_password: str, email: str) -> str:
+        """Ссылка ss:// для клиента Shadowsocks 2022"""
+        host = server_settings['url']
+        if '://' in host:
+            host = host.split('://')[1]
+       
+        if ':' in host:
+            host = host.split(':')[0]
+
+        method = "2022-blake3-aes-256-gcm"  
+        method_and_password = f"{method}:{full_password}"
+        encoded_part = base64.b64encode(method_and_password.encode()).decode()
+
+        encoded_email = email.replace('@', '%40')
+        
+        return f"ss://{encoded_part}@{host}:{inbound['port']}?type=tcp#SS-2022-{encoded_email}"
+
+    async def create_ss_users_bulk(self, server_settings: Dict, grants: List[Tuple[int, int]]) -> List[Optional[str]]:
+        """Создание клиентов Shadowsocks по списку (telegram_id, дней): ссылки в том же порядке, None - при ошибке"""
+        links: List[Optional[str]] = [None] * len(grants)
+        if not grants:
+            return links
+
+        server_id = server_settings.get('server_id', server_settings.get('id'))
+        inbound_id = server_settings.get('inbound_id', 1)
+        try:
             inbound = await self._get_inbound(server_settings, inbound_id)
             if not inbound:
                 logger.error(f"Не удалось получить информацию об inbound {inbound_id}")
-                return None
-            
-            logger.debug(f"Найден inbound: {inbound}")
-            
-            try:
-                settings = json.loads(inbound['settings'])
-                logger.debug(f"Настройки inbound: {settings}")
-                
-                existing_emails = [client.get('email') for client in settings.get('clients', [])]
-                logger.debug(f"Существующие email: {existing_emails}")
-                if email in existing_emails:
-                    logger.warning(f"Клиент с email {email} уже существует, генерируем новый email")
-                    email = f"tg_{telegram_id}@{random.randint(10000, 99999)}"
-                
-                method = settings.get('method', '2022-blake3-aes-256-gcm')
-                server_password = settings.get('password', '')
-                
-                logger.debug(f"Метод шифрования: {method}")
-                logger.debug(f"Получен пароль сервера: {server_password}")
-            except Exception as e:
-                logger.error(f"Ошибка при парсинге настроек inbound: {e}")
-                return None
+                return links
 
-            client_password = base64.b64encode(secrets.token_bytes(32)).decode()
-            
-            if ':' in server_password:
-                full_password = server_password
-            else:
-                full_password = f"{server_password}:{client_password}"
-            
-            logger.debug(f"Сформирован полный пароль: {full_password}")
+            settings = json.loads(inbound['settings'])
+            server_password = settings.get('password', '')
+            logger.debug(f"Метод шифрования: {settings.get('method', '2022-blake3-aes-256-gcm')}")
+        except Exception as e:
+            logger.error(f"Ошибка при парсинге настроек inbound: {e}")
+            return links
 
-            new_client = {
+        # Панель отклоняет весь addClient, если хотя бы один email уже занят
+        taken = {client.get('email') for client in settings.get('clients', [])}
+        now = datetime.now()
+        prepared = []
+        for telegram_id, days in grants:
+            email = f"tg_{telegram_id}@{random.randint(10000, 99999)}"
+            while email in taken:
+                email = f"tg_{telegram_id}@{random.randint(10000, 99999)}"
+            taken.add(email)
+
+            client_password = self._generate_ss_password()
+            full_password = server_password if ':' in server_password else f"{server_password}:{client_password}"
+            prepared.append(({
                 "id": str(uuid.uuid4()),
                 "email": email,
                 "enable": True,
                 "tgId": str(telegram_id),
                 "totalGB": 0,
-                "expiryTime": int(end_time.timestamp() * 1000),
+                "expiryTime": int((now + timedelta(days=days)).timestamp() * 1000),
                 "limitIp": 1,
                 "reset": 0,
                 "password": client_password, 
@@ -222,123 +324,121 @@ class XUIShadowsocksManager:
                 "up": 0,
                 "down": 0,
                 "total": 0
-            }
+            }, full_password))
 
-            logger.debug(f"Попытка добавить клиента: {new_client}")
-            
+        logger.info(f"Создание {len(prepared)} SS клиентов в inbound {inbound_id} сервера {server_id}")
+        for start in range(0, len(prepared), SS_BULK_CHUNK):
+            chunk = prepared[start:start + SS_BULK_CHUNK]
             payload = {
                 "id": inbound_id,
-                "settings": json.dumps({"clients": [new_client]}, separators=(',', ':'))
+                "settings": json.dumps({"clients": [client for client, _ in chunk]}, separators=(',', ':'))
             }
+            try:
+                status, text = await self._request(
+                    server_settings,
+                    'POST',
+                    '/panel/api/inbounds/addClient',
+                    headers={'Content-Type': 'application/json'},
+                    json=payload
+                )
+                logger.debug(f"Статус ответа: {status}, URL: /panel/api/inbounds/addClient, Текст: {text}")
+                
+                data = json.loads(text) if text else {}
+                if status != 200 or not data.get('success', False):
+                    error_msg = data.get('msg', 'Неизвестная ошибка')
+                    raise Exception(f"Ошибка при добавлении клиента: {error_msg}")
+            except Exception as e:
+                logger.error(f"Ошибка при добавлении SS клиентов {start + 1}-{start + len(chunk)} на сервер {server_id}: {e}")
+                continue
+
+            for offset, (client, full_password) in enumerate(chunk):
+                links[start + offset] = self._ss_link(server_settings, inbound, full_password, client['email'])
+
+        created = sum(1 for link in links if link)
+        if len(grants) == 1:
+            if created:
+                logger.info(f"SS ссылка для клиента успешно сгенерирована: {links[0]}")
+        else:
+            logger.info(f"Создано SS клиентов на сервере {server_id}: {created} из {len(grants)}")
+        return links
+
+    async def delete_ss_user(self, server_settings: Dict, email: str) -> bool:
+        """Удаление пользователя Shadowsocks по началу email (tg_<id>@)"""
+        try:
+            inbound_id = server_settings.get('inbound_id', 1)
             
-            logger.debug(f"Отправляемый payload: {payload}")
+            # Только inbound сервера, а не список всех inbounds
+            target_inbound = await self._get_inbound(server_settings, inbound_id)
+            if not target_inbound:
+                raise Exception(f"Inbound {inbound_id} не найден")
             
+            settings = json.loads(target_inbound['settings'])
             clients = settings.get('clients', [])
             
-            clients.append(new_client)
+            email_prefix = email.rstrip('@')  
+            target_client = next((c for c in clients if c['email'].startswith(email_prefix)), None)
             
-            settings['clients'] = clients
-            
-            async with aiohttp.ClientSession() as session:
-                async with session.post(
-                    f"{session_data['base_url']}/panel/api/inbounds/addClient",
-                    headers={
-                        'Accept': 'application/json',
-                        'Content-Type': 'application/json',
-                        'Cookie': f"{session_data['cookie_name']}={session_data['token']}"
-                    },
-                    json=payload,
-                    ssl=False
-                ) as response:
-                    status = response.status
-                    text = await response.text()
-                    logger.debug(f"Статус ответа: {status}, URL: {session_data['base_url']}/panel/api/inbounds/addClient, Текст: {text}")
-                    
-                    data = json.loads(text) if text else {}
-                    if status != 200 or not data.get('success', False):
-                        error_msg = data.get('msg', 'Неизвестная ошибка')
-                        logger.error(f"Ошибка при добавлении клиента: {error_msg}")
-                        raise Exception(f"Ошибка при добавлении клиента: {error_msg}")
-            
-            logger.info("SS клиент успешно создан")
-
-            host = server_settings['url']
-            if '://' in host:
-                host = host.split('://')[1]
-           
-            if ':' in host:
-                host = host.split(':')[0]
-
-            method = "2022-blake3-aes-256-gcm"  
-            method_and_password = f"{method}:{full_password}"
-            encoded_part = base64.b64encode(method_and_password.encode()).decode()
-
-            encoded_email = email.replace('@', '%40')
+            if not target_client:
+                logger.warning(f"Клиент с email, начинающимся с {email_prefix}, не найден")
+                return False
             
-            ss_link = f"ss://{encoded_part}@{host}:{inbound['port']}?type=tcp#SS-2022-{encoded_email}"
+            full_email = target_client['email']
+            logger.info(f"Найден полный email клиента: {full_email}")
             
-            logger.info(f"SS ссылка для клиента успешно сгенерирована: {ss_link}")
-            return ss_link
+            return await self._delete_ss_email(server_settings, inbound_id, full_email)
             
         except Exception as e:
-            logger.error(f"Ошибка при создании SS пользователя: {e}")
+            logger.error(f"Ошибка при удалении SS пользователя: {e}")
+            return False
+
+    @staticmethod
+    def parse_link(link: str) -> Optional[str]:
+        """Email клиента из ссылки ss:// (user_subscription.vless): фрагмент SS-2022-<email>"""
+        if '#' not in link:
             return None
+        name = unquote(link.split('#', 1)[1])
+        return name[len('SS-2022-'):] if name.startswith('SS-2022-') else name
 
-    async def delete_ss_user(self, server_settings: Dict, email: str) -> bool:
-        """Удаление пользователя Shadowsocks"""
+    async def _delete_ss_email(self, server_settings: Dict, inbound_id: int, email: str) -> bool:
+        """Удаление клиента inbound по email одним запросом delClient"""
         try:
-            session_data = await self._get_session(server_settings)
-            if not session_data:
-                logger.error("Не удалось получить сессию")
-                return False
-
-            inbound_id = server_settings.get('inbound_id', 1)
+            status, text = await self._request(
+                server_settings,
+                'POST',
+                f"/panel/api/inbounds/{inbound_id}/delClient/{email}"
+            )
+            logger.debug(f"Статус ответа: {status}, Текст: {text}")
             
-            async with aiohttp.ClientSession() as session:
-                async with session.get(
-                    f"{session_data['base_url']}/panel/api/inbounds/list",
-                    headers={'Cookie': f"{session_data['cookie_name']}={session_data['token']}"},
-                    ssl=False
-                ) as response:
-                    data = await response.json()
-                    inbounds = data.get('obj', [])
-                    
-                    target_inbound = next((i for i in inbounds if i['id'] == inbound_id), None)
-                    if not target_inbound:
-                        raise Exception(f"Inbound {inbound_id} не найден")
-                    
-                    settings = json.loads(target_inbound['settings'])
-                    clients = settings.get('clients', [])
-                    
-                    email_prefix = email.rstrip('@')  
-                    target_client = next((c for c in clients if c['email'].startswith(email_prefix)), None)
-                    
-                    if not target_client:
-                        logger.warning(f"Клиент с email, начинающимся с {email_prefix}, не найден")
-                        return False
-                    
-                    full_email = target_client['email']
-                    logger.info(f"Найден полный email клиента: {full_email}")
-                    
-                    async with session.post(
-                        f"{session_data['base_url']}/panel/api/inbounds/{inbound_id}/delClient/{full_email}",
-                        headers={'Cookie': f"{session_data['cookie_name']}={session_data['token']}"},
-                        ssl=False
-                    ) as response:
-                        status = response.status
-                        text = await response.text()
-                        logger.debug(f"Статус ответа: {status}, Текст: {text}")
-                        
-                        data = json.loads(text)
-                        if status != 200 or not data.get('success', False):
-                            error_msg = data.get('msg', 'Неизвестная ошибка')
-                            raise Exception(f"Ошибка при удалении клиента: {error_msg}")
-                
-                logger.info(f"SS клиент {full_email} успешно удален")
-                return True
+            data = json.loads(text) if text else {}
+            if status != 200 or not data.get('success', False):
+                error_msg = data.get('msg', 'Неизвестная ошибка')
+                raise Exception(f"Ошибка при удалении клиента: {error_msg}")
             
+            logger.info(f"SS клиент {email} успешно удален из inbound {inbound_id}")
+            return True
         except Exception as e:
-            logger.error(f"Ошибка при удалении SS пользователя: {e}")
+            logger.error(f"Ошибка при удалении SS клиента {email}: {e}")
             return False
 
+    async def delete_ss_clients_bulk(self, server_settings: Dict,
+                                     keys: List[Tuple[str, Optional[int]]]) -> List[bool]:
+        """Удаление клиентов Shadowsocks по ссылке и inbound подписки (user_subscription.inbound_id): результаты в том же порядке"""
+        default_inbound_id = server_settings.get('inbound_id') or 1
+        emails = [self.parse_link(link) for link, _ in keys]
+        for (link, _), email in zip(keys, emails):
+            if not email:
+                logger.error(f"В ссылке {link} нет email клиента")
+
+        # Каждый клиент удаляется своим delClient; параллельность ограничена пулом соединений к панели
+        results = await asyncio.gather(*(
+            self._delete_ss_email(server_settings, inbound_id or default_inbound_id, email)
+            for (_, inbound_id), email in zip(keys, emails) if email
+        ))
+        deleted = iter(results)
+        return [next(deleted) if email else False for email in emails]
+
+    async def delete_ss_client(self, server_settings: Dict, link: str, inbound_id: Optional[int] = None) -> bool:
+        """Удаление одного клиента Shadowsocks по ссылке"""
+        return (await self.delete_ss_clients_bulk(server_settings, [(link, inbound_id)]))[0]
+
 xui_ss_manager = XUIShadowsocksManager() 
\ No newline at end of file
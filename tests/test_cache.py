@@ -0,0 +1,51 @@
+import asyncio
+
+from handlers.cache import TTLCache, cached, invalidates
+
+
+class Settings:
+    def __init__(self):
+        self.cache = TTLCache(default_ttl=60.0)
+        self.calls = 0
+        self.fail = False
+
+    @cached('tariffs', error="Ошибка при получении тарифов", fallback=[])
+    async def get_tariffs(self):
+        self.calls += 1
+        if self.fail:
+            raise RuntimeError("database is locked")
+        return [{'id': 1}]
+
+    @invalidates('tariffs')
+    async def update_tariff(self):
+        pass
+
+
+def test_cached_result_is_reused_until_invalidated():
+    settings = Settings()
+
+    async def scenario():
+        assert await settings.get_tariffs() == [{'id': 1}]
+        assert await settings.get_tariffs() == [{'id': 1}]
+        assert settings.calls == 1
+        await settings.update_tariff()
+        await settings.get_tariffs()
+        assert settings.calls == 2
+
+    asyncio.run(scenario())
+
+
+def test_error_fallback_is_not_cached():
+    settings = Settings()
+    settings.fail = True
+
+    async def scenario():
+        tariffs = await settings.get_tariffs()
+        assert tariffs == []
+        # Запасное значение - копия, изменение не влияет на следующие вызовы
+        tariffs.append('x')
+        settings.fail = False
+        assert await settings.get_tariffs() == [{'id': 1}]
+        assert settings.calls == 2
+
+    asyncio.run(scenario())
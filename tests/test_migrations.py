@@ -0,0 +1,111 @@
+import sqlite3
+import time
+
+import pytest
+
+from handlers.migrations import MIGRATIONS, SCHEMA_VERSION, apply_migrations, get_schema_version
+
+
+@pytest.fixture
+def conn(tmp_path):
+    conn = sqlite3.connect(tmp_path / "database.db")
+    apply_migrations(conn)
+    yield conn
+    conn.close()
+
+
+def query_plan(conn: sqlite3.Connection, sql: str, params: tuple) -> str:
+    """План запроса одной строкой"""
+    return "\n".join(row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params))
+
+
+def test_schema_version(conn):
+    assert get_schema_version(conn) == SCHEMA_VERSION
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == SCHEMA_VERSION
+
+
+def test_current_schema_skips_migrations(conn):
+    statements = []
+    conn.set_trace_callback(statements.append)
+    assert apply_migrations(conn) == SCHEMA_VERSION
+    assert statements == ["PRAGMA user_version"]
+
+
+def test_expiring_subscriptions_use_index(conn):
+    # Database.get_expiring_subscriptions
+    plan = query_plan(conn, """
+        SELECT * FROM user_subscription
+        WHERE is_active = 1
+        AND end_ts BETWEEN ? AND ?
+    """, (0, 86400))
+    assert "SEARCH user_subscription USING INDEX idx_user_subscription_active_end_ts" in plan
+
+
+@pytest.mark.parametrize("after, params", [
+    ("", (1, 21)),
+    ("AND (created_at, id) < (?, ?)", (1, "2024-01-01 00:00:00", 100, 21)),
+])
+def test_transactions_page_uses_index(conn, after, params):
+    # Database.get_balance_transactions_page: первая и следующие страницы
+    plan = query_plan(conn, f"""
+        SELECT * FROM balance_transactions
+        WHERE user_id = ? {after}
+        ORDER BY created_at DESC, id DESC
+        LIMIT ?
+    """, params)
+    assert "SEARCH balance_transactions USING INDEX idx_balance_transactions_user_created" in plan
+    assert "USE TEMP B-TREE" not in plan
+
+
+def test_direct_payments_retyped(tmp_path):
+    conn = sqlite3.connect(tmp_path / "database.db")
+    for number, _, migration in MIGRATIONS[:8]:
+        migration(conn)
+        conn.execute(f"PRAGMA user_version = {number}")
+    conn.executemany("""
+        INSERT INTO balance_transactions (user_id, amount, type, description, payment_id, status)
+        VALUES (1, ?, 'deposit', ?, ?, ?)
+    """, [
+        (100, "Пополнение баланса на сумму 100.0 руб.", "p-1", "succeeded"),
+        (4, "Покупка подписки Срочный", "p-2", "pending"),
+        (1, "Продление подписки Срочный", "p-3", "succeeded"),
+        (50, "Покупка подписки вручную", None, "succeeded"),
+    ])
+    conn.commit()
+
+    apply_migrations(conn)
+    types = conn.execute("SELECT payment_id, type FROM balance_transactions ORDER BY id").fetchall()
+    conn.close()
+    assert types == [("p-1", "deposit"), ("p-2", "payment"), ("p-3", "payment"), (None, "deposit")]
+
+
+@pytest.fixture
+def moscow_time(monkeypatch):
+    # Зона со смещением, чтобы локальное время отличалось от UTC
+    monkeypatch.setenv("TZ", "Europe/Moscow")
+    time.tzset()
+    yield
+    monkeypatch.undo()
+    time.tzset()
+
+
+def test_subscription_epoch_from_local_dates(moscow_time, conn):
+    conn.execute("""
+        INSERT INTO user_subscription (user_id, tariff_id, server_id, start_date, end_date)
+        VALUES (1, 1, 1, '2025-01-01 10:00:00', '2025-01-31 10:00:00')
+    """)
+    # 2025-01-01 10:00 MSK = 07:00 UTC
+    assert conn.execute("SELECT start_ts, end_ts FROM user_subscription").fetchone() == (1735714800, 1738306800)
+
+    conn.execute("UPDATE user_subscription SET end_date = '2025-02-01 03:00:00+03:00'")
+    assert conn.execute("SELECT end_ts FROM user_subscription").fetchone() == (1738368000,)
+
+
+def test_subscription_epoch_default_start(moscow_time, conn):
+    # start_date не передан: DEFAULT CURRENT_TIMESTAMP записывает UTC
+    conn.execute("""
+        INSERT INTO user_subscription (user_id, tariff_id, server_id, end_date)
+        VALUES (1, 1, 1, '2025-01-31 10:00:00')
+    """)
+    start_ts, = conn.execute("SELECT start_ts FROM user_subscription").fetchone()
+    assert abs(start_ts - time.time()) < 5
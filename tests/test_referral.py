@@ -0,0 +1,55 @@
+import asyncio
+import sqlite3
+
+import aiosqlite
+import pytest
+
+from handlers.ledger import apply_referral_rewards
+from handlers.migrations import apply_migrations
+
+REFERRER_ID = 100
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = str(tmp_path / "database.db")
+    conn = sqlite3.connect(path)
+    apply_migrations(conn)
+    conn.execute("INSERT INTO user (telegram_id, referral_code) VALUES (?, 'REFERRER')", (REFERRER_ID,))
+    conn.execute("INSERT INTO referral_progress (user_id, total_invites) VALUES (?, 12)", (REFERRER_ID,))
+    conn.commit()
+    conn.close()
+    return path
+
+
+def run_checks(path, calls):
+    # Каждый вызов - отдельная транзакция, как проверка награды через очередь записей
+    async def _run():
+        results = []
+        async with aiosqlite.connect(path) as conn:
+            for _ in range(calls):
+                totals = await apply_referral_rewards(conn, REFERRER_ID)
+                await conn.commit()
+                results.append(totals.get(REFERRER_ID))
+        return results
+    return asyncio.run(_run())
+
+
+def test_one_reward_per_check(db_path):
+    # Выполнены условия на 5 и 10 приглашений: сначала старшее, затем младшее
+    assert run_checks(db_path, 3) == [150.0, 50.0, None]
+
+    conn = sqlite3.connect(db_path)
+    balance = conn.execute("SELECT balance FROM user_balance WHERE user_id = ?", (REFERRER_ID,)).fetchall()
+    transactions = conn.execute("""
+        SELECT amount, type, description FROM balance_transactions WHERE user_id = ? ORDER BY id
+    """, (REFERRER_ID,)).fetchall()
+    history = conn.execute("SELECT COUNT(*) FROM referral_rewards_history WHERE user_id = ?", (REFERRER_ID,)).fetchone()
+    conn.close()
+
+    assert balance == [(200.0,)]
+    assert transactions == [
+        (150.0, 'referral_reward', 'Награда за приглашение 10 пользователей'),
+        (50.0, 'referral_reward', 'Награда за приглашение 5 пользователей'),
+    ]
+    assert history == (2,)
@@ -2,27 +2,27 @@
 import sqlite3
 import os
 from datetime import datetime, timedelta
+from handlers.db_pool import configure_sqlite_connection, enable_wal
+from handlers.migrations import apply_migrations
 
 class DatabaseManager:
     """Менеджер для работы с базой данных"""
     
     @staticmethod
     def prepare_database():
-        """Проверяет и подготавливает базу данных, добавляя необходимые столбцы."""
+        """Проверяет и подготавливает базу данных, применяя миграции схемы."""
         db_path = DatabaseManager.get_db_path()
         try:
-            conn = sqlite3.connect(db_path)
-            cursor = conn.cursor()
+            conn = sqlite3.connect(db_path, timeout=20.0)
+            configure_sqlite_connection(conn)
 
-            # Проверка наличия столбца 'status' в 'balance_transactions'
-            cursor.execute("PRAGMA table_info(balance_transactions)")
-            columns = [info[1] for info in cursor.fetchall()]
-            if 'status' not in columns:
-                print("Adding 'status' column to 'balance_transactions' table.")
-                # Добавляем столбец с NOT NULL и DEFAULT 'succeeded', чтобы существующие записи были валидными
-                cursor.execute("ALTER TABLE balance_transactions ADD COLUMN status TEXT NOT NULL DEFAULT 'succeeded'")
-                conn.commit()
-                print("Column 'status' added successfully.")
+            # WAL позволяет читателям не ждать писателей бота и фоновых проверок платежей
+            journal_mode = enable_wal(conn)
+            if journal_mode.lower() != 'wal':
+                print(f"Не удалось включить WAL, текущий режим журнала: {journal_mode}")
+
+            # Недостающие столбцы и индексы добавляются общими миграциями бота
+            apply_migrations(conn)
 
             conn.close()
         except sqlite3.Error as e:
@@ -39,7 +39,8 @@ class DatabaseManager:
         db_path = DatabaseManager.get_db_path()
         conn = None
         try:
-            conn = sqlite3.connect(db_path)
+            conn = sqlite3.connect(db_path, timeout=20.0)
+            configure_sqlite_connection(conn)
             conn.row_factory = sqlite3.Row
             cursor = conn.cursor()
             cursor.execute(query, params)
@@ -108,15 +109,19 @@ class DatabaseManager:
 
     @staticmethod
     def get_user_subscriptions(user_id):
-        return DatabaseManager._execute("SELECT us.*, s.name as server_name, t.name as tariff_name FROM user_subscription us LEFT JOIN server_settings s ON us.server_id = s.id LEFT JOIN tariff t ON us.tariff_id = t.id WHERE us.user_id = ? AND us.is_active = 1 ORDER BY us.end_date DESC", (user_id,), fetchall=True)
+        # Только столбцы, которые нужны для списка подписок в веб-приложении
+        # Трафик - из локальной статистики (handlers/traffic.py), без запросов к панелям
+        query = "SELECT us.id, us.server_id, us.vless, us.start_ts, us.end_ts, s.name as server_name, t.name as tariff_name, (SELECT COALESCE(SUM(tu.up), 0) FROM traffic_usage tu WHERE tu.subscription_id = us.id) as traffic_up, (SELECT COALESCE(SUM(tu.down), 0) FROM traffic_usage tu WHERE tu.subscription_id = us.id) as traffic_down FROM user_subscription us LEFT JOIN server_settings s ON us.server_id = s.id LEFT JOIN tariff t ON us.tariff_id = t.id WHERE us.user_id = ? AND us.is_active = 1 ORDER BY us.end_ts DESC"
+        return DatabaseManager._execute(query, (user_id,), fetchall=True)
 
     @staticmethod
     def get_latest_user_subscription(user_id):
-        return DatabaseManager._execute("SELECT us.*, s.name as server_name FROM user_subscription us JOIN server_settings s ON us.server_id = s.id WHERE us.user_id = ? ORDER BY us.is_active DESC, us.end_date DESC LIMIT 1", (user_id,), fetchone=True)
+        query = "SELECT us.id, us.start_ts, us.end_ts, s.name as server_name FROM user_subscription us JOIN server_settings s ON us.server_id = s.id WHERE us.user_id = ? ORDER BY us.is_active DESC, us.end_ts DESC LIMIT 1"
+        return DatabaseManager._execute(query, (user_id,), fetchone=True)
 
     @staticmethod
     def get_full_subscription_for_replacement(subscription_id, user_id):
-        query = "SELECT us.*, ss.*, t.id as tariff_id, t.name as tariff_name, us.user_id as telegram_id FROM user_subscription us JOIN server_settings ss ON us.server_id = ss.id JOIN tariff t ON us.tariff_id = t.id WHERE us.id = ? AND us.is_active = 1 AND us.user_id = ?"
+        query = "SELECT us.*, ss.*, t.id as tariff_id, t.name as tariff_name, us.user_id as telegram_id, COALESCE(us.inbound_id, ss.inbound_id) as subscription_inbound_id FROM user_subscription us JOIN server_settings ss ON us.server_id = ss.id JOIN tariff t ON us.tariff_id = t.id WHERE us.id = ? AND us.is_active = 1 AND us.user_id = ?"
         return DatabaseManager._execute(query, (subscription_id, user_id), fetchone=True)
         
     @staticmethod
@@ -124,14 +129,29 @@ class DatabaseManager:
         return DatabaseManager._execute("SELECT * FROM server_settings WHERE id = ? AND is_enable = 1", (server_id,), fetchone=True)
 
     @staticmethod
-    def deactivate_subscription(subscription_id):
-        return DatabaseManager._execute("UPDATE user_subscription SET is_active = 0 WHERE id = ?", (subscription_id,), commit=True)
-
-    @staticmethod
-    def create_replaced_subscription(user_id, tariff_id, new_server_id, end_date, new_key, payment_id):
-        query = "INSERT INTO user_subscription (user_id, tariff_id, server_id, end_date, vless, is_active, payment_id) VALUES (?, ?, ?, ?, ?, 1, ?)"
-        params = (user_id, tariff_id, new_server_id, end_date, new_key, payment_id)
-        return DatabaseManager._execute(query, params, commit=True)
+    def replace_subscription(old_subscription_id, user_id, tariff_id, new_server_id, inbound_id, end_date, new_key, payment_id):
+        """Деактивация старой подписки и создание новой в одной транзакции, возвращает id новой"""
+        conn = None
+        try:
+            conn = sqlite3.connect(DatabaseManager.get_db_path(), timeout=20.0)
+            configure_sqlite_connection(conn)
+            with conn:
+                cursor = conn.execute("UPDATE user_subscription SET is_active = 0 WHERE id = ? AND is_active = 1", (old_subscription_id,))
+                if cursor.rowcount != 1:
+                    # Подписку уже заменили параллельным запросом
+                    raise sqlite3.IntegrityError(f"подписка {old_subscription_id} уже неактивна")
+                # start_date в локальном времени, как у остальных подписок: DEFAULT CURRENT_TIMESTAMP записал бы UTC
+                cursor = conn.execute(
+                    "INSERT INTO user_subscription (user_id, tariff_id, server_id, inbound_id, start_date, end_date, vless, is_active, payment_id) VALUES (?, ?, ?, ?, ?, ?, ?, 1, ?)",
+                    (user_id, tariff_id, new_server_id, inbound_id, datetime.now().strftime('%Y-%m-%d %H:%M:%S'), end_date, new_key, payment_id)
+                )
+                return cursor.lastrowid
+        except sqlite3.Error as e:
+            print(f"Ошибка базы данных: {e}")
+            return False
+        finally:
+            if conn:
+                conn.close()
 
     @staticmethod
     def format_date(date_str):
@@ -145,10 +165,10 @@ class DatabaseManager:
         return None, date_str, 0
 
     @staticmethod
-    def calculate_subscription_time(start_date_str, end_date_str):
+    def calculate_subscription_time(start_ts, end_ts):
         try:
-            start_date = datetime.strptime(start_date_str.split('.')[0], '%Y-%m-%d %H:%M:%S')
-            end_date = datetime.strptime(end_date_str.split('.')[0], '%Y-%m-%d %H:%M:%S')
+            start_date = datetime.fromtimestamp(start_ts)
+            end_date = datetime.fromtimestamp(end_ts)
             now = datetime.now()
             if end_date < now: return {'status': 'expired', 'days_left': 0, 'hours_left': 0, 'minutes_left': 0, 'seconds_left': 0, 'time_display': "0с", 'formatted_date': end_date.strftime('%d.%m.%Y'), 'progress_percent': 100}
             total_seconds = (end_date - start_date).total_seconds()
@@ -179,7 +199,7 @@ class DB:
         if not subscriptions: return []
         result = []
         for sub in subscriptions:
-            time_data = DatabaseManager.calculate_subscription_time(sub['start_date'], sub['end_date'])
+            time_data = DatabaseManager.calculate_subscription_time(sub['start_ts'], sub['end_ts'])
             if time_data['status'] != 'expired':
                 result.append({
                     'id': sub['id'],
@@ -187,6 +207,8 @@ class DB:
                 'server_name': sub['server_name'] or 'Неизвестно',
                 'tariff_name': sub['tariff_name'] or 'Неизвестно',
                 'vless': sub['vless'] or '',
+                'traffic_up': sub['traffic_up'] or 0,
+                'traffic_down': sub['traffic_down'] or 0,
                 'is_active': True,
                 **time_data
             })
@@ -196,7 +218,7 @@ class DB:
     def get_user_subscription_data(user_id):
         subscription = DatabaseManager.get_latest_user_subscription(user_id)
         if not subscription: return {'status': 'no_subscription', 'expiry_date': None, 'days_left': 0, 'hours_left': 0, 'time_display': "0ч", 'server_name': None, 'progress_percent': 0}
-        time_data = DatabaseManager.calculate_subscription_time(subscription['start_date'], subscription['end_date'])
+        time_data = DatabaseManager.calculate_subscription_time(subscription['start_ts'], subscription['end_ts'])
         return {'status': time_data['status'], 'expiry_date': time_data['formatted_date'], 'days_left': time_data['days_left'], 'hours_left': time_data['hours_left'], 'time_display': time_data['time_display'], 'progress_percent': time_data['progress_percent'], 'server_name': subscription['server_name']}
 
     @staticmethod
@@ -22,6 +22,10 @@ if project_root not in sys.path:
 from bd import DB, DatabaseManager
 from yookassa import Configuration, Payment
 from handlers.x_ui import xui_manager
+from handlers.x_ui_ss import xui_ss_manager
+from handlers.ledger import BalanceLedger
+from handlers.placement import InboundPlacement
+from handlers.records import UserRecord
 from webappnew.web.notifier import notify_of_purchase_or_renewal
 
 by_bp = Blueprint('by', __name__)
@@ -30,14 +34,15 @@ class PurchaseDatabase:
     """Класс для работы с базой данных при покупке"""
     def __init__(self):
         self.db_path = DatabaseManager.get_db_path()
+        self.ledger = BalanceLedger(self.db_path)
+        self.placement = InboundPlacement(self.db_path)
 
-    async def get_user_by_telegram_id(self, telegram_id: int) -> Optional[Dict]:
+    async def get_user_by_telegram_id(self, telegram_id: int) -> Optional[UserRecord]:
         try:
             async with aiosqlite.connect(self.db_path) as conn:
-                conn.row_factory = aiosqlite.Row
+                conn.row_factory = UserRecord.row_factory
                 async with conn.execute("SELECT * FROM user WHERE telegram_id = ?", (telegram_id,)) as cursor:
-                    user = await cursor.fetchone()
-                    return dict(user) if user else None
+                    return await cursor.fetchone()
         except Exception as e:
             logger.error(f"Ошибка при получении пользователя: {e}")
             return None
@@ -84,22 +89,27 @@ class PurchaseDatabase:
     async def deduct_balance(self, telegram_id: int, amount: float, reason: str) -> bool:
         """Списать средства с баланса пользователя"""
         try:
-            async with aiosqlite.connect(self.db_path) as conn:
-                await conn.execute("UPDATE user_balance SET balance = balance - ? WHERE user_id = ?", (amount, telegram_id))
-                await conn.execute("INSERT INTO balance_transactions (user_id, amount, type, description) VALUES (?, ?, 'debit', ?)", (telegram_id, -amount, reason))
-                await conn.commit()
-                return True
+            return await self.ledger.debit(telegram_id, amount, 'debit', reason) is not None
         except Exception as e:
             logger.error(f"Ошибка при списании с баланса: {e}")
             return False
 
+    async def refund_balance(self, telegram_id: int, amount: float) -> bool:
+        """Вернуть списанные средства на баланс пользователя"""
+        try:
+            await self.ledger.credit(telegram_id, amount, 'refund', 'Возврат за неудавшуюся покупку')
+            return True
+        except Exception as e:
+            logger.error(f"Ошибка при возврате на баланс: {e}")
+            return False
+
     async def create_pending_yookassa_transaction(self, user_id: int, amount: float, payment_id: str, description: str):
         try:
             async with aiosqlite.connect(self.db_path) as conn:
                 await conn.execute(
                     """
                     INSERT INTO balance_transactions (user_id, amount, type, description, payment_id, status)
-                    VALUES (?, ?, 'deposit', ?, ?, 'pending')
+                    VALUES (?, ?, 'payment', ?, ?, 'pending')
                     """,
                     (user_id, amount, description, payment_id)
                 )
@@ -178,7 +188,7 @@ def _track_payment(payment_id: str, user_id: int, tariff_id: int):
     while time.time() - start_time < 660: # 11 минут
         try:
             # Запускаем асинхронную проверку в новом цикле событий
-            result = asyncio.run(purchase_manager.check_yookassa_purchase_status(payment_id, user_id, tariff_id))
+            result = asyncio.run(xui_ss_manager.closing(purchase_manager.check_yookassa_purchase_status(payment_id, user_id, tariff_id)))
             # Если платеж успешно обработан, выходим из цикла
             if result and result.get('success'):
                 logger.info(f"Платеж покупки {payment_id} успешно обработан. Завершение фоновой задачи.")
@@ -190,7 +200,7 @@ def _track_payment(payment_id: str, user_id: int, tariff_id: int):
 
     logger.warning(f"Время ожидания платежа {payment_id} истекло. Фоновая задача завершена.")
     # Опционально: обновить статус в БД на 'expired' или 'failed'
-    asyncio.run(purchase_manager.db.update_transaction_status(payment_id, 'failed'))
+    asyncio.run(xui_ss_manager.closing(purchase_manager.db.update_transaction_status(payment_id, 'failed')))
 
 
 class PurchaseManager:
@@ -203,32 +213,53 @@ class PurchaseManager:
         if not xui_manager: return f"vless://mock-key-{user_id}"
         return await xui_manager.create_trial_user(server_settings=tariff_data, trial_settings=tariff_data, telegram_id=user_id)
 
-    async def _create_subscription(self, user_id: int, tariff_data: Dict, payment_method: str, payment_id: str = None) -> Dict:
+    async def _place(self, tariff_data: Dict) -> Optional[Dict]:
+        """Настройки сервера тарифа (id - сервер, а не тариф) с наименее загруженным inbound"""
+        server_id = tariff_data['server_id']
+        return await self.db.placement.place(
+            dict(tariff_data, id=server_id),
+            xui_manager.inbound_client_counts(server_id) if xui_manager else None
+        )
+
+    async def _create_subscription(self, user_id: int, tariff_data: Dict, payment_method: str, payment_id: str = None,
+                                   placed: Optional[Dict] = None) -> Dict:
+        vless_key = None
         try:
             end_date = datetime.now() + timedelta(days=tariff_data['left_day'])
-            vless_key = await self._create_xui_key(tariff_data, user_id)
+            server_id = tariff_data['server_id']
+            placed = placed or await self._place(tariff_data)
+            if not placed: return {'success': False, 'error': 'На сервере нет свободных мест'}
+
+            vless_key = await self._create_xui_key(placed, user_id)
             if not vless_key: return {'success': False, 'error': 'Ошибка при создании ключа в 3x-ui'}
 
             async with aiosqlite.connect(self.db.db_path) as conn:
                 await conn.execute(
-                    "INSERT INTO user_subscription (user_id, tariff_id, server_id, end_date, vless, is_active, start_date, payment_id) VALUES (?, ?, ?, ?, ?, 1, ?, ?)",
-                    (user_id, tariff_data['id'], tariff_data['server_id'], end_date.strftime('%Y-%m-%d %H:%M:%S'), vless_key, datetime.now().strftime('%Y-%m-%d %H:%M:%S'), payment_id)
+                    "INSERT INTO user_subscription (user_id, tariff_id, server_id, inbound_id, end_date, vless, is_active, start_date, payment_id) VALUES (?, ?, ?, ?, ?, ?, 1, ?, ?)",
+                    (user_id, tariff_data['id'], server_id, placed.get('inbound_id'), end_date.strftime('%Y-%m-%d %H:%M:%S'), vless_key, datetime.now().strftime('%Y-%m-%d %H:%M:%S'), payment_id)
                 )
                 await conn.commit()
+        except Exception as e:
+            logger.error(f"Ошибка при создании подписки: {e}", exc_info=True)
+            if vless_key and xui_manager and vless_key.startswith('vless://'):
+                # Подписка не сохранена: ключ на панели не должен остаться без нее
+                await xui_manager.delete_client_by_link(placed, vless_key, placed.get('inbound_id'))
+            return {'success': False, 'error': 'Ошибка при создании подписки'}
 
+        sub_info = {
+            'tariff_name': tariff_data['name'], 'server_name': tariff_data['server_name'],
+            'days': tariff_data['left_day'], 'payment_method': payment_method,
+            'amount': tariff_data['price'], 'end_date_formatted': end_date.strftime('%d.%m.%Y'),
+            'days_left': tariff_data['left_day'], 'vless_key': vless_key
+        }
+        # Подписка уже сохранена: ошибка уведомления не делает покупку неудавшейся
+        try:
             user_info = await self.db.get_user_by_telegram_id(user_id)
-            sub_info = {
-                'tariff_name': tariff_data['name'], 'server_name': tariff_data['server_name'],
-                'days': tariff_data['left_day'], 'payment_method': payment_method,
-                'amount': tariff_data['price'], 'end_date_formatted': end_date.strftime('%d.%m.%Y'),
-                'days_left': tariff_data['left_day'], 'vless_key': vless_key
-            }
             notify_of_purchase_or_renewal('purchase', user_id, user_info, sub_info)
-
-            return {'success': True, **sub_info}
         except Exception as e:
-            logger.error(f"Ошибка при создании подписки: {e}", exc_info=True)
-            return {'success': False, 'error': 'Ошибка при создании подписки'}
+            logger.error(f"Ошибка при отправке уведомления о покупке: {e}")
+
+        return {'success': True, **sub_info}
 
     async def create_yookassa_purchase_payment(self, user_id: int, tariff_id: int) -> Dict:
         tariff = await self.db.get_tariff_by_id(tariff_id)
@@ -250,9 +281,7 @@ class PurchaseManager:
             return {'success': False, 'error': 'Ошибка создания платежа YooKassa'}
 
     async def _deduct_balance(self, user_id: int, amount: float, reason: str) -> bool:
-        current_balance = await self.db.get_user_balance(user_id)
-        if current_balance < amount:
-            return False
+        # Проверка остатка выполняется самим списанием
         return await self.db.deduct_balance(user_id, amount, reason)
 
     async def process_purchase_from_balance(self, user_id: int, tariff_id: int) -> Dict:
@@ -260,10 +289,20 @@ class PurchaseManager:
         if not tariff_data:
             return {'success': False, 'error': 'Тариф не найден'}
 
+        # Место на сервере проверяется до списания, чтобы не брать деньги за заведомо неудачную покупку
+        placed = await self._place(tariff_data)
+        if not placed:
+            return {'success': False, 'error': 'На сервере нет свободных мест'}
+
         if not await self._deduct_balance(user_id, tariff_data['price'], f"Покупка подписки {tariff_data['name']}"):
             return {'success': False, 'error': 'Недостаточно средств на балансе'}
 
-        return await self._create_subscription(user_id, tariff_data, 'Баланс')
+        result = await self._create_subscription(user_id, tariff_data, 'Баланс', placed=placed)
+        if not result.get('success'):
+            # Ключ или подписка не созданы: списание возвращается на баланс
+            if await self.db.refund_balance(user_id, tariff_data['price']):
+                logger.info(f"Средства за неудавшуюся покупку возвращены пользователю {user_id}")
+        return result
 
     async def check_yookassa_purchase_status(self, payment_id: str, user_id: int, tariff_id: int) -> Dict:
         # Проверяем, не был ли платеж уже обработан
@@ -316,7 +355,7 @@ def purchase_create_yookassa():
     user_id = session.get('user_id')
     if not user_id: return jsonify({'success': False, 'error': 'Unauthorized'}), 401
     data = request.get_json()
-    result = asyncio.run(purchase_manager.create_yookassa_purchase_payment(user_id, int(data['tariff_id'])))
+    result = asyncio.run(xui_ss_manager.closing(purchase_manager.create_yookassa_purchase_payment(user_id, int(data['tariff_id']))))
     return jsonify(result)
 
 @by_bp.route('/api/purchase/from_balance', methods=['POST'])
@@ -329,7 +368,7 @@ def purchase_from_balance():
     if not tariff_id:
         return jsonify({'success': False, 'error': 'Tariff ID is required'}), 400
     
-    result = asyncio.run(purchase_manager.process_purchase_from_balance(user_id, int(tariff_id)))
+    result = asyncio.run(xui_ss_manager.closing(purchase_manager.process_purchase_from_balance(user_id, int(tariff_id))))
     return jsonify(result)
 
 @by_bp.route('/api/purchase/get_tracking_status', methods=['POST'])
@@ -340,11 +379,11 @@ def get_purchase_tracking_status():
         return jsonify({'status': 'error', 'message': 'payment_id is required'}), 400
 
     # Получаем статус напрямую из БД
-    status = asyncio.run(purchase_manager.db.get_transaction_status(payment_id))
+    status = asyncio.run(xui_ss_manager.closing(purchase_manager.db.get_transaction_status(payment_id)))
 
     if status == 'succeeded':
         # Если успешно, получаем детали подписки для отображения в модальном окне
-        sub_details = asyncio.run(purchase_manager.db.get_subscription_details_by_payment_id(payment_id))
+        sub_details = asyncio.run(xui_ss_manager.closing(purchase_manager.db.get_subscription_details_by_payment_id(payment_id)))
         if sub_details:
             # Формируем ответ, который ожидает фронтенд
             result_data = {
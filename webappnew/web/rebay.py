@@ -23,6 +23,8 @@ from bd import DB, DatabaseManager
 from yookassa import Configuration, Payment
 from handlers.x_ui import xui_manager
 from handlers.x_ui_ss import xui_ss_manager
+from handlers.ledger import BalanceLedger
+from handlers.records import UserRecord
 from webappnew.web.notifier import notify_of_purchase_or_renewal
 import threading
 import time
@@ -68,14 +70,14 @@ class RenewalDatabase:
 
     def __init__(self):
         self.db_path = DatabaseManager.get_db_path()
+        self.ledger = BalanceLedger(self.db_path)
 
-    async def get_user_by_telegram_id(self, telegram_id: int) -> Optional[Dict]:
+    async def get_user_by_telegram_id(self, telegram_id: int) -> Optional[UserRecord]:
         try:
             async with aiosqlite.connect(self.db_path) as conn:
-                conn.row_factory = aiosqlite.Row
+                conn.row_factory = UserRecord.row_factory
                 async with conn.execute("SELECT * FROM user WHERE telegram_id = ?", (telegram_id,)) as cursor:
-                    user = await cursor.fetchone()
-                    return dict(user) if user else None
+                    return await cursor.fetchone()
         except Exception as e:
             logger.error(f"Ошибка при получении пользователя: {e}")
             return None
@@ -92,18 +94,19 @@ class RenewalDatabase:
 
     async def deduct_balance(self, telegram_id: int, amount: float) -> bool:
         try:
-            async with aiosqlite.connect(self.db_path) as conn:
-                current_balance = await self.get_user_balance(telegram_id)
-                if current_balance < amount: return False
-                new_balance = current_balance - amount
-                await conn.execute("UPDATE user_balance SET balance = ? WHERE user_id = ?", (new_balance, telegram_id))
-                await conn.execute("INSERT INTO balance_transactions (user_id, amount, type, description, status) VALUES (?, ?, 'debit', 'Продление подписки', 'succeeded')", (telegram_id, -amount))
-                await conn.commit()
-                return True
+            return await self.ledger.debit(telegram_id, amount, 'debit', 'Продление подписки') is not None
         except Exception as e:
             logger.error(f"Ошибка при списании с баланса: {e}")
             return False
 
+    async def refund_balance(self, telegram_id: int, amount: float) -> bool:
+        try:
+            await self.ledger.credit(telegram_id, amount, 'refund', 'Возврат за неудавшееся продление')
+            return True
+        except Exception as e:
+            logger.error(f"Ошибка при возврате на баланс: {e}")
+            return False
+
     async def get_subscription_by_id(self, subscription_id: int) -> Optional[Dict]:
         try:
             async with aiosqlite.connect(self.db_path) as conn:
@@ -155,7 +158,7 @@ class RenewalDatabase:
         try:
             async with aiosqlite.connect(self.db_path) as conn:
                 await conn.execute(
-                    "INSERT INTO balance_transactions (user_id, amount, type, description, payment_id, status) VALUES (?, ?, 'deposit', ?, ?, 'pending')",
+                    "INSERT INTO balance_transactions (user_id, amount, type, description, payment_id, status) VALUES (?, ?, 'payment', ?, ?, 'pending')",
                     (user_id, amount, description, payment_id)
                 )
                 await conn.commit()
@@ -231,7 +234,7 @@ def _track_renewal_payment(payment_id: str, user_id: int, sub_id: int, tariff_id
     start_time = time.time()
     while time.time() - start_time < 660: # 11 минут
         try:
-            result = asyncio.run(renewal_manager.check_yookassa_renewal_status(payment_id, user_id, sub_id, tariff_id))
+            result = asyncio.run(xui_ss_manager.closing(renewal_manager.check_yookassa_renewal_status(payment_id, user_id, sub_id, tariff_id)))
             if result and result.get('success'):
                 logger.info(f"Платеж продления {payment_id} успешно обработан. Завершение фоновой задачи.")
                 return
@@ -241,7 +244,7 @@ def _track_renewal_payment(payment_id: str, user_id: int, sub_id: int, tariff_id
         time.sleep(20)
 
     logger.warning(f"Время ожидания платежа продления {payment_id} истекло. Фоновая задача завершена.")
-    asyncio.run(renewal_manager.db.update_transaction_status(payment_id, 'failed'))
+    asyncio.run(xui_ss_manager.closing(renewal_manager.db.update_transaction_status(payment_id, 'failed')))
 
 
 class RenewalManager:
@@ -257,26 +260,15 @@ class RenewalManager:
                 logger.error(f"Не удалось получить клиента для сервера {server_settings['id']}")
                 return False
 
-            inbounds = client.inbound.get_list()
             client_id = vless_link.split('://')[1].split('@')[0]
             email = vless_link.split('#')[1] if '#' in vless_link else None
             logger.info(f"Поиск клиента: client_id={client_id}, email={email}")
 
             target_client = None
-            for inbound in inbounds:
-                if hasattr(inbound, 'settings') and hasattr(inbound.settings, 'clients'):
-                    clients = inbound.settings.clients
-                    found = next((c for c in clients if c.id == client_id), None)
-                    if found:
-                        target_client = found
-                        logger.info(f"Клиент найден по ID {client_id} в inbound {inbound.id}")
-                        break
-                    if email:
-                        found = next((c for c in clients if hasattr(c, 'email') and c.email == email), None)
-                        if found:
-                            target_client = found
-                            logger.info(f"Клиент найден по email {email} в inbound {inbound.id}")
-                            break
+            found = await xui_manager.find_client(server_settings, client_id, email)
+            if found:
+                target_inbound, target_client = found
+                logger.info(f"Клиент найден в inbound {target_inbound.id}")
             
             if not target_client:
                 logger.error(f"Клиент не найден ни по ID, ни по email на сервере {server_settings['id']}")
@@ -284,7 +276,7 @@ class RenewalManager:
 
             new_expiry = int(new_end_date.timestamp() * 1000)
             target_client.expiry_time = new_expiry
-            client.client.update(target_client.id, target_client)
+            await xui_manager.update_client(server_settings, target_client)
             logger.info(f"Клиент {getattr(target_client, 'email', target_client.id)} успешно обновлен. Новая дата истечения: {new_end_date}")
             return True
         except Exception as e:
@@ -310,8 +302,7 @@ class RenewalManager:
         if not await self.db.deduct_balance(user_id, tariff['price']):
             return {'success': False, 'error': 'Недостаточно средств'}
 
-        end_date_str = subscription['end_date'].split('.')[0]
-        end_date = datetime.strptime(end_date_str, '%Y-%m-%d %H:%M:%S')
+        end_date = datetime.fromtimestamp(subscription['end_ts'])
         new_end_date = (end_date if end_date > datetime.now() else datetime.now()) + timedelta(days=tariff['left_day'])
 
         if await self.extend_subscription_in_xui(subscription, subscription['vless'], new_end_date):
@@ -326,7 +317,7 @@ class RenewalManager:
             notify_of_purchase_or_renewal('renewal', user_id, user_info, sub_info)
             return {'success': True, **sub_info}
         else:
-            await self.db.deduct_balance(user_id, -tariff['price'])
+            await self.db.refund_balance(user_id, tariff['price'])
             return {'success': False, 'error': 'Ошибка продления в X-UI'}
 
     async def create_yookassa_renewal_payment(self, user_id: int, sub_id: int, tariff_id: int) -> Dict:
@@ -363,8 +354,7 @@ class RenewalManager:
             tariff = await self.db.get_tariff_by_id(tariff_id)
             if not tariff: return {'success': False, 'error': 'Тариф не найден'}
 
-            end_date_str = subscription['end_date'].split('.')[0]
-            end_date = datetime.strptime(end_date_str, '%Y-%m-%d %H:%M:%S')
+            end_date = datetime.fromtimestamp(subscription['end_ts'])
             new_end_date = (end_date if end_date > datetime.now() else datetime.now()) + timedelta(days=tariff['left_day'])
 
             if await self.extend_subscription_in_xui(subscription, subscription['vless'], new_end_date):
@@ -410,7 +400,7 @@ def renewal_from_balance():
     user_id = session.get('user_id')
     if not user_id: return jsonify({'success': False, 'error': 'Unauthorized'}), 401
     data = request.get_json()
-    result = asyncio.run(renewal_manager.process_renewal_from_balance(user_id, int(data['subscription_id']), int(data['tariff_id'])))
+    result = asyncio.run(xui_ss_manager.closing(renewal_manager.process_renewal_from_balance(user_id, int(data['subscription_id']), int(data['tariff_id']))))
     return jsonify(result)
 
 @rebay_bp.route('/api/renewal/create_yookassa', methods=['POST'])
@@ -418,7 +408,7 @@ def renewal_create_yookassa():
     user_id = session.get('user_id')
     if not user_id: return jsonify({'success': False, 'error': 'Unauthorized'}), 401
     data = request.get_json()
-    result = asyncio.run(renewal_manager.create_yookassa_renewal_payment(user_id, int(data['subscription_id']), int(data['tariff_id'])))
+    result = asyncio.run(xui_ss_manager.closing(renewal_manager.create_yookassa_renewal_payment(user_id, int(data['subscription_id']), int(data['tariff_id']))))
     return jsonify(result)
 
 @rebay_bp.route('/api/renewal/calculate_text', methods=['POST'])
@@ -433,14 +423,13 @@ def calculate_renewal_text():
         return jsonify({'success': False, 'error': 'Missing subscription_id or tariff_id'}), 400
 
     try:
-        subscription = asyncio.run(renewal_manager.db.get_subscription_by_id(int(subscription_id)))
-        tariff = asyncio.run(renewal_manager.db.get_tariff_by_id(int(tariff_id)))
+        subscription = asyncio.run(xui_ss_manager.closing(renewal_manager.db.get_subscription_by_id(int(subscription_id))))
+        tariff = asyncio.run(xui_ss_manager.closing(renewal_manager.db.get_tariff_by_id(int(tariff_id))))
 
         if not subscription or not tariff:
             return jsonify({'success': False, 'error': 'Subscription or tariff not found'}), 404
         
-        end_date_str = subscription['end_date'].split('.')[0]
-        end_date = datetime.strptime(end_date_str, '%Y-%m-%d %H:%M:%S')
+        end_date = datetime.fromtimestamp(subscription['end_ts'])
         time_remaining = end_date - datetime.now()
         renewal_days = tariff.get('left_day', 0)
         total_delta = time_remaining + timedelta(days=renewal_days)
@@ -464,10 +453,10 @@ def get_renewal_tracking_status():
     if not payment_id:
         return jsonify({'status': 'error', 'message': 'payment_id is required'}), 400
 
-    status = asyncio.run(renewal_manager.db.get_transaction_status(payment_id))
+    status = asyncio.run(xui_ss_manager.closing(renewal_manager.db.get_transaction_status(payment_id)))
 
     if status == 'succeeded':
-        sub_details = asyncio.run(renewal_manager.db.get_subscription_details_by_payment_id(payment_id))
+        sub_details = asyncio.run(xui_ss_manager.closing(renewal_manager.db.get_subscription_details_by_payment_id(payment_id)))
         if sub_details:
             result_data = {
                 'success': True,
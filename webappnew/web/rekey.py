@@ -1,22 +1,74 @@
 import os
 from datetime import datetime
-from typing import Dict, List
+from typing import Any, Callable, Dict, List, Optional
 from loguru import logger
 import sys
-import re
+import time
 import asyncio
 
 from bd import DB, DatabaseManager
+from handlers.placement import InboundPlacement
 
 try:
     from handlers.x_ui import xui_manager
     from handlers.x_ui_ss import xui_ss_manager
-    import py3xui
 except ImportError:
     logger.warning("XUI managers not found")
     xui_manager = None
     xui_ss_manager = None
-    py3xui = None
+
+async def _create_on_panel(old_subscription, server_settings: Dict, days_left: int) -> Optional[str]:
+    """Создание нового ключа пользователя на сервере замены"""
+    trial_settings = {'left_day': days_left}
+    telegram_id = old_subscription['telegram_id']
+    if old_subscription['vless'].startswith('ss://'):
+        return await xui_ss_manager.create_ss_user(server_settings=server_settings, trial_settings=trial_settings, telegram_id=telegram_id)
+    return await xui_manager.create_trial_user(server_settings=server_settings, trial_settings=trial_settings, telegram_id=telegram_id)
+
+
+async def _delete_from_panel(server_settings: Dict, link: str, inbound_id: Optional[int]) -> bool:
+    """Удаление ключа с панели по ссылке и inbound"""
+    try:
+        if link.startswith('ss://'):
+            return await xui_ss_manager.delete_ss_client(server_settings, link, inbound_id)
+        return await xui_manager.delete_client_by_link(server_settings, link, inbound_id)
+    except Exception as e:
+        logger.error(f"Ошибка при удалении ключа с сервера: {e}")
+        return False
+
+
+async def _replace_key_async(old_subscription, new_server, days_left: int,
+                             save: Callable[[str, Optional[int]], Any]) -> Dict:
+    """Замена ключа за один запуск цикла событий: новый ключ, запись в базу, затем удаление старого"""
+    # Новый ключ размещается в наименее загруженном inbound нового сервера
+    is_shadowsocks = old_subscription['vless'].startswith('ss://')
+    panel_counts = xui_manager.inbound_client_counts(new_server['id']) if not is_shadowsocks else None
+    server_settings = await InboundPlacement(DatabaseManager.get_db_path()).place(dict(new_server), panel_counts)
+    if not server_settings:
+        return {'success': False, 'error': 'На новом сервере нет свободных мест'}
+
+    try:
+        new_key = await _create_on_panel(old_subscription, server_settings, days_left)
+    except Exception as e:
+        logger.error(f"Ошибка при создании нового ключа: {e}")
+        new_key = None
+    if not new_key:
+        return {'success': False, 'error': 'Ошибка при создании нового ключа'}
+
+    # Старый ключ удаляется только после фиксации замены в базе: если запись не удалась
+    # (подписку успели продлить или деактивировать), у пользователя остается рабочий старый ключ
+    inbound_id = server_settings.get('inbound_id')
+    if not await asyncio.to_thread(save, new_key, inbound_id):
+        if not await _delete_from_panel(server_settings, new_key, inbound_id):
+            logger.error(f"Не удалось удалить новый ключ после ошибки замены подписки {old_subscription['id']}")
+        return {'success': False, 'error': 'Ошибка при сохранении нового ключа'}
+
+    old_server = dict(old_subscription, id=old_subscription['server_id'])
+    if await _delete_from_panel(old_server, old_subscription['vless'], old_subscription['subscription_inbound_id']):
+        logger.info(f"Старый ключ подписки {old_subscription['id']} удален с сервера {old_subscription['server_id']}")
+    else:
+        logger.warning(f"Не удалось удалить старый ключ подписки {old_subscription['id']}")
+    return {'success': True, 'new_key': new_key}
 
 def get_user_keys(telegram_id: int) -> List[Dict]:
     """Get a list of active user keys using the centralized DB class."""
@@ -91,7 +143,6 @@ def get_available_servers(current_server_id: int, protocol: str) -> List[Dict]:
 
 def replace_key(telegram_id: int, old_key_id: int, new_server_id: int) -> Dict:
     """Replace a key with a new server, now using centralized DB calls."""
-    import asyncio
     try:
         old_subscription = DatabaseManager.get_full_subscription_for_replacement(old_key_id, telegram_id)
         if not old_subscription:
@@ -102,49 +153,32 @@ def replace_key(telegram_id: int, old_key_id: int, new_server_id: int) -> Dict:
             return {'success': False, 'error': 'Новый сервер недоступен'}
 
         is_shadowsocks = old_subscription['vless'].startswith('ss://')
-        end_date = old_subscription['end_date'].split('.')[0]
-        end_datetime = datetime.strptime(end_date, '%Y-%m-%d %H:%M:%S')
-        days_left = max(1, int((end_datetime - datetime.now()).total_seconds() / 86400))
-        
-        server_settings = dict(new_server)
-        trial_settings = {'left_day': days_left}
-
-        if is_shadowsocks:
-            if not xui_ss_manager: return {'success': False, 'error': 'XUI SS Manager не найден'}
-            new_key = asyncio.run(xui_ss_manager.create_ss_user(server_settings=server_settings, trial_settings=trial_settings, telegram_id=old_subscription['telegram_id']))
-        else:
-            if not xui_manager: return {'success': False, 'error': 'XUI Manager не найден'}
-            new_key = asyncio.run(xui_manager.create_trial_user(server_settings=server_settings, trial_settings=trial_settings, telegram_id=old_subscription['telegram_id']))
-
-        if not new_key:
-            return {'success': False, 'error': 'Ошибка при создании нового ключа'}
-
-        try:
-            if is_shadowsocks:
-                asyncio.run(xui_ss_manager.delete_ss_user(server_settings=dict(old_subscription), email=f"tg_{old_subscription['telegram_id']}@"))
-            else:
-                uuid_match = re.search(r'vless://([^@]+)@', old_subscription['vless'])
-                if uuid_match:
-                    client_uuid = uuid_match.group(1)
-                    api_url = f"{old_subscription['url']}:{old_subscription['port']}/{old_subscription['secret_path']}"
-                    async def delete_client():
-                        api = py3xui.AsyncApi(host=api_url, username=old_subscription['username'], password=old_subscription['password'], use_tls_verify=False)
-                        await api.login()
-                        await api.client.delete(old_subscription['inbound_id'], client_uuid)
-                    asyncio.run(delete_client())
-                    logger.info(f"Клиент успешно удален с сервера {api_url}")
-        except Exception as e:
-            logger.warning(f"Не удалось удалить старый ключ: {e}")
-
-        DatabaseManager.deactivate_subscription(old_key_id)
-        DatabaseManager.create_replaced_subscription(
-            user_id=old_subscription['telegram_id'],
-            tariff_id=old_subscription['tariff_id'],
-            new_server_id=new_server_id,
-            end_date=end_date,
-            new_key=new_key,
-            payment_id=old_subscription['payment_id']
-        )
+        if is_shadowsocks and not xui_ss_manager: return {'success': False, 'error': 'XUI SS Manager не найден'}
+        if not is_shadowsocks and not xui_manager: return {'success': False, 'error': 'XUI Manager не найден'}
+
+        end_datetime = datetime.fromtimestamp(old_subscription['end_ts'])
+        end_date = end_datetime.strftime('%Y-%m-%d %H:%M:%S')
+        days_left = max(1, int((old_subscription['end_ts'] - time.time()) / 86400))
+
+        def save(new_key: str, inbound_id: Optional[int]) -> bool:
+            # Старая подписка деактивируется и новая создается в одной транзакции
+            return bool(DatabaseManager.replace_subscription(
+                old_subscription_id=old_key_id,
+                user_id=old_subscription['telegram_id'],
+                tariff_id=old_subscription['tariff_id'],
+                new_server_id=new_server_id,
+                inbound_id=inbound_id,
+                end_date=end_date,
+                new_key=new_key,
+                payment_id=old_subscription['payment_id']
+            ))
+
+        # Соединения SS закрываются до завершения asyncio.run
+        coro = _replace_key_async(old_subscription, new_server, days_left, save)
+        result = asyncio.run(xui_ss_manager.closing(coro) if xui_ss_manager else coro)
+        if not result['success']:
+            return result
+        new_key = result['new_key']
 
         return {'success': True, 'new_key': new_key, 'server_name': new_server['name'], 'tariff_name': old_subscription['tariff_name'], 'end_date': end_date}
 